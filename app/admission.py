@@ -0,0 +1,214 @@
+"""
+Admission control for Shotput's uploads.
+
+Every upload is admitted before any image work starts, and refused at once
+(503 with Retry-After) rather than queued when this process is at one of its
+limits:
+
+- max_decodes: uploads whose image work (decoding, optimizing, hashing,
+  encoding derivatives) is running or waiting for the process pool;
+- max_queued_commits: stored uploads waiting for their commit;
+- max_inflight_bytes: total size of the uploads being processed, from
+  admission until their response.
+
+A client sending uploads faster than rate_per_s (in bursts of up to burst) is
+refused with 429 and a Retry-After telling it when a token is available again.
+
+Limits apply per worker process. Admitting and releasing only happen on the
+event loop, so plain counters suffice.
+"""
+
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+import math
+import time
+
+
+class Overloaded(Exception):
+    """An upload refused by admission control; maps to an HTTP error with Retry-After."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float, reason: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+        self.reason = reason  # decodes, commits, bytes or rate
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    """Refills at `rate` tokens per second up to `burst`; starts full."""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, cost: float, now: float) -> float:
+        """Takes `cost` tokens if there are enough; returns 0, or the seconds until there are."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    One token bucket per client key, e.g. the client's address.
+
+    Args:
+        rate_per_s: Sustained uploads per second per client (0 disables).
+        burst: Uploads a client may send at once after being idle.
+        max_clients: Buckets kept; the least recently used are forgotten
+            (a forgotten client starts over with a full bucket).
+    """
+
+    def __init__(self, rate_per_s: float, burst: float, max_clients: int = 10000):
+        self.rate = rate_per_s
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, client: str, cost: float = 1):
+        """
+        Raises:
+            Overloaded: 429 if the client has no tokens left.
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        # A batch larger than the bucket could never pass; charge it a full bucket
+        wait = bucket.take(min(cost, self.burst), now)
+        if wait:
+            raise Overloaded(
+                429, f"Too many uploads from {client}; at most {self.rate:g} per second.", wait, "rate"
+            )
+
+
+class Admission:
+    """An admitted upload's share of the limits; release() it exactly once when it is answered."""
+
+    def __init__(self, controller: "AdmissionController", size: int):
+        self.controller = controller
+        self.size = size
+        self._decoding = True
+        self._released = False
+
+    def decoded(self):
+        """The upload's image work is done; frees its decode slot early (it may still wait for its commit)."""
+        if self._decoding:
+            self._decoding = False
+            self.controller.decoding -= 1
+
+    def release(self):
+        if self._released:
+            return
+        self.decoded()
+        self._released = True
+        self.controller.inflight_bytes -= self.size
+
+
+class AdmissionController:
+    """
+    Decides whether this process takes another upload right now.
+
+    Args:
+        max_decodes: Uploads with image work running or queued at once (0: no limit).
+        max_queued_commits: Stored uploads waiting for a commit (0: no limit).
+        max_inflight_bytes: Bytes of uploads being processed (0: no limit).
+            An upload is always admitted when nothing else is in flight, so a
+            single file up to the upload size limit gets through.
+        queued_commits: Reads the number of uploads waiting for a commit.
+        retry_after_s: Retry-After sent with 503s.
+        rate_limiter: Per-client rate limit, if any.
+    """
+
+    def __init__(
+        self,
+        max_decodes: int = 0,
+        max_queued_commits: int = 0,
+        max_inflight_bytes: int = 0,
+        queued_commits: Callable[[], int] = lambda: 0,
+        retry_after_s: float = 2,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        self.max_decodes = max_decodes
+        self.max_queued_commits = max_queued_commits
+        self.max_inflight_bytes = max_inflight_bytes
+        self.queued_commits = queued_commits
+        self.retry_after_s = retry_after_s
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(0, 1)
+        self.decoding = 0
+        self.inflight_bytes = 0
+
+    def check_rate(self, client: str, cost: float = 1):
+        """Raises Overloaded (429) if `client` is over its rate limit."""
+        self.rate_limiter.check(client, cost)
+
+    def admit(self, size: int) -> Admission:
+        """
+        Admits an upload of `size` bytes.
+
+        Raises:
+            Overloaded: 503 if any limit is reached.
+        """
+        full = self._full(size)
+        if full is not None:
+            reason, detail = full
+            raise Overloaded(503, f"The server is busy ({detail}); retry shortly.", self.retry_after_s, reason)
+        self.decoding += 1
+        self.inflight_bytes += size
+        return Admission(self, size)
+
+    def _full(self, size: int) -> Optional[Tuple[str, str]]:
+        """(limit, description) of the limit one more upload of `size` bytes would exceed, or None."""
+        if self.max_decodes and self.decoding >= self.max_decodes:
+            return "decodes", f"{self.decoding} of {self.max_decodes} uploads being processed"
+        if self.max_queued_commits:
+            queued = self.queued_commits()
+            if queued >= self.max_queued_commits:
+                return "commits", f"{queued} of {self.max_queued_commits} uploads waiting for a commit"
+        if self.max_inflight_bytes and self.inflight_bytes and self.inflight_bytes + size > self.max_inflight_bytes:
+            return "bytes", f"{self.inflight_bytes} of {self.max_inflight_bytes} bytes in flight"
+        return None
+
+    @property
+    def saturated(self) -> bool:
+        """Whether the next upload would be refused (taking the smallest possible one)."""
+        return self._full(1) is not None
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "saturated": self.saturated,
+            "decodes": {"current": self.decoding, "limit": self.max_decodes},
+            "queued_commits": {"current": self.queued_commits(), "limit": self.max_queued_commits},
+            "inflight_bytes": {"current": self.inflight_bytes, "limit": self.max_inflight_bytes},
+            "rate_limit": {
+                "per_s": self.rate_limiter.rate,
+                "burst": self.rate_limiter.burst,
+                "clients": len(self.rate_limiter),
+            }
+            if self.rate_limiter.enabled
+            else None,
+            "retry_after_s": self.retry_after_s,
+        }
@@ -0,0 +1,171 @@
+"""
+Precompressed, content-hashed delivery of Shotput's UI assets.
+
+The pages, script and favicon are built once: each is hashed (SHA-256) and
+encoded with gzip and, when the brotli module is installed, brotli at maximum
+quality, keeping only encodings that are smaller. Requests then pick an
+encoding from Accept-Encoding and get a strong ETag per encoding, a 304 on
+revalidation and `Vary: Accept-Encoding`. Assets added with a fingerprint get a
+URL containing their hash and can be cached forever; pages are served with
+`no-cache`, so a repeat visit costs one revalidation.
+"""
+
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+from typing import Any, Dict, Iterable, Optional
+import functools
+import gzip
+import hashlib
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+REVALIDATE = "no-cache"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Server preference when the client accepts several equally
+ENCODING_PREFERENCE = ("br", "gzip", "identity")
+
+
+@dataclass(frozen=True)
+class Asset:
+    media_type: str
+    digest: str  # Hex SHA-256 of the uncompressed body
+    bodies: Dict[str, bytes]  # Content-coding -> body; "identity" is always present
+    cache_control: str
+
+    def etag(self, coding: str) -> str:
+        # Strong ETags must differ between encodings of the same content
+        return f'"{self.digest[:32]}"' if coding == "identity" else f'"{self.digest[:32]}-{coding}"'
+
+
+@functools.lru_cache(maxsize=None)
+def _brotli() -> Optional[Any]:
+    """The brotli module, imported when assets are first built; None means gzip only."""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def encode_body(body: bytes) -> Dict[str, bytes]:
+    """The identity body plus every compressed encoding that is smaller."""
+    bodies = {"identity": body}
+    encoded = gzip.compress(body, compresslevel=9, mtime=0)  # mtime=0: same bytes every build
+    if len(encoded) < len(body):
+        bodies["gzip"] = encoded
+    brotli = _brotli()
+    if brotli is not None:
+        encoded = brotli.compress(body, quality=11)
+        if len(encoded) < len(body):
+            bodies["br"] = encoded
+    return bodies
+
+
+def negotiate_encoding(accept_encoding: Optional[str], available: Iterable[str]) -> str:
+    """
+    Picks a content-coding per RFC 9110 section 12.5.3: the highest q-value
+    among the available ones, ties broken by ENCODING_PREFERENCE. Identity is
+    acceptable unless refused explicitly (or via "*;q=0").
+    """
+    available = set(available)
+    if not accept_encoding:
+        return "identity"
+    q: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        q[token] = weight
+    default = q.get("*")
+    candidates = []
+    for rank, coding in enumerate(ENCODING_PREFERENCE):
+        if coding not in available:
+            continue
+        weight = q.get(coding, default if default is not None else (1.0 if coding == "identity" else 0.0))
+        if weight > 0:
+            candidates.append((-weight, rank, coding))
+    return min(candidates)[2] if candidates else "identity"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match evaluation, which uses the weak comparison (RFC 9110 section 13.1.2)."""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    candidates = [t[2:] if t.startswith("W/") else t for t in candidates]
+    return (etag[2:] if etag.startswith("W/") else etag) in candidates
+
+
+class AssetStore:
+    """In-memory table of built assets, keyed by URL path."""
+
+    def __init__(self):
+        self._assets: Dict[str, Asset] = {}
+        self._urls: Dict[str, str] = {}
+
+    def add(
+        self,
+        path: str,
+        body: bytes,
+        media_type: str,
+        cache_control: str = REVALIDATE,
+        fingerprint: bool = False,
+    ) -> str:
+        """
+        Builds an asset and registers it under path.
+
+        Args:
+            path: URL path, e.g. "/" or "/script.js".
+            fingerprint: Also register it under a URL containing its hash
+                (e.g. /static/script.3f2a9c1b7d0e.js), served as immutable.
+
+        Returns:
+            The URL pages should reference: the fingerprinted one if requested.
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        bodies = encode_body(body)
+        self._assets[path] = Asset(media_type, digest, bodies, cache_control)
+        url = path
+        if fingerprint:
+            name = PurePosixPath(path)
+            url = f"/static/{name.stem}.{digest[:12]}{name.suffix}"
+            self._assets[url] = Asset(media_type, digest, bodies, IMMUTABLE)
+        self._urls[path] = url
+        return url
+
+    def url(self, path: str) -> str:
+        """The URL to reference path by (its fingerprinted URL, if it has one)."""
+        return self._urls.get(path, path)
+
+    def get(self, path: str) -> Optional[Asset]:
+        return self._assets.get(path)
+
+    def response(self, path: str, request: Request) -> Response:
+        """The response for GET/HEAD of path (404 if it is not an asset)."""
+        asset = self._assets.get(path)
+        if asset is None:
+            return Response(status_code=404)
+        coding = negotiate_encoding(request.headers.get("accept-encoding"), asset.bodies)
+        etag = asset.etag(coding)
+        headers = {"ETag": etag, "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(content=asset.bodies[coding], media_type=asset.media_type, headers=headers)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Body size per encoding of every asset, e.g. for logging."""
+        return {path: {c: len(b) for c, b in asset.bodies.items()} for path, asset in self._assets.items()}
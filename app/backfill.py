@@ -0,0 +1,314 @@
+# /// script
+# requires-python = ">=3.9"
+# dependencies = [
+#     "fastapi",
+#     "uvicorn[standard]",
+#     "python-multipart",
+#     "Pillow",
+#     "GitPython",
+#     "toml",
+#     "numpy",
+# ]
+# ///
+"""
+Backfill for images that were uploaded before an ingest-time optimization existed.
+
+Walks IMAGE_SUB_DIR with a process pool and runs the same image code as
+/upload_image/ on every stored image: lossless PNG optimization (rewritten in
+place under the same name, so existing CDN URLs keep working) and/or the
+responsive WebP/AVIF derivatives. Results are committed in bounded batches.
+
+Progress is recorded per file in <state dir>/backfill.sqlite3, so an
+interrupted run picks up where it stopped, and files that were processed but
+not yet committed are committed first on the next run.
+
+Usage (from the repository root, like the server):
+
+    uv run app/backfill.py                    # whatever config.toml enables
+    uv run app/backfill.py --png --workers 8  # only PNG optimization
+    uv run app/backfill.py --derivatives --limit 50
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import time
+
+from imaging import (
+    derivative_name,
+    derivative_widths,
+    image_info,
+    is_derivative_name,
+    optimize_png_file,
+    write_derivative,
+)
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+
+
+def backfill_image(
+    path: str,
+    png: bool,
+    widths: List[int],
+    formats: List[str],
+    quality: Dict[str, int],
+) -> dict:
+    """
+    Optimizes one stored image and writes its missing derivatives.
+
+    Runs in the process pool. The original keeps its name; an optimized PNG
+    replaces it through a temporary file and os.replace
+    (see optimize_png_file).
+
+    Returns:
+        A dict with name, before, after (bytes of the original), derivative_bytes,
+        written (names of the files that changed or were created) and error.
+    """
+    src = Path(path)
+    before = src.stat().st_size
+    result = {
+        "name": src.name,
+        "before": before,
+        "after": before,
+        "derivative_bytes": 0,
+        "written": [],
+        "error": None,
+    }
+    try:
+        if png and src.suffix.lower() == ".png":
+            _, after = optimize_png_file(path)
+            if after < before:
+                result["after"] = after
+                result["written"].append(src.name)
+
+        if formats:
+            width, _, animated = image_info(path)
+            if not animated:  # Would lose the animation
+                for fmt in formats:
+                    for w in derivative_widths(width, widths):
+                        dst = src.with_name(derivative_name(src.name, w, fmt))
+                        if dst.exists():
+                            continue
+                        _, _, d_bytes = write_derivative(path, str(dst), w, fmt, quality.get(fmt, 80))
+                        # Same rule as uploads: only keep variants that save bytes
+                        if d_bytes >= result["after"]:
+                            dst.unlink(missing_ok=True)
+                            continue
+                        result["derivative_bytes"] += d_bytes
+                        result["written"].append(dst.name)
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+class BackfillManifest:
+    """
+    Per-file progress of backfill runs.
+
+    A file is skipped when it was processed with the same tasks and its size
+    and mtime still match; `committed` is 0 between processing and the batch
+    commit that includes its changes.
+    """
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS backfill ("
+            " name TEXT PRIMARY KEY, tasks TEXT NOT NULL,"
+            " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " before INTEGER NOT NULL, after INTEGER NOT NULL,"
+            " derivative_bytes INTEGER NOT NULL, written TEXT NOT NULL,"
+            " error TEXT, committed INTEGER NOT NULL)"
+        )
+        self._db.commit()
+
+    def is_done(self, name: str, tasks: str, size: int, mtime_ns: int) -> bool:
+        row = self._db.execute(
+            "SELECT tasks, size, mtime_ns FROM backfill WHERE name = ?", (name,)
+        ).fetchone()
+        return row is not None and row == (tasks, size, mtime_ns)
+
+    def record(self, result: dict, tasks: str, size: int, mtime_ns: int):
+        self._db.execute(
+            "INSERT OR REPLACE INTO backfill VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                result["name"],
+                tasks,
+                size,
+                mtime_ns,
+                result["before"],
+                result["after"],
+                result["derivative_bytes"],
+                "\n".join(result["written"]),
+                result["error"],
+                0 if result["written"] else 1,
+            ),
+        )
+        self._db.commit()
+
+    def uncommitted(self) -> List[Tuple[str, List[str]]]:
+        rows = self._db.execute("SELECT name, written FROM backfill WHERE committed = 0").fetchall()
+        return [(name, written.split("\n")) for name, written in rows]
+
+    def mark_committed(self, names: List[str]):
+        self._db.executemany("UPDATE backfill SET committed = 1 WHERE name = ?", [(n,) for n in names])
+        self._db.commit()
+
+    def totals(self) -> Tuple[int, int, int, int]:
+        """(files, bytes before, bytes after, derivative bytes) over every run."""
+        return self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(before), 0), COALESCE(SUM(after), 0),"
+            " COALESCE(SUM(derivative_bytes), 0) FROM backfill WHERE error IS NULL"
+        ).fetchone()
+
+    def close(self):
+        self._db.close()
+
+
+def _format_bytes(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+
+def _pending_images(image_dir: Path, manifest: BackfillManifest, tasks: str) -> List[Path]:
+    pending = []
+    with os.scandir(image_dir) as it:
+        for entry in it:
+            if not entry.is_file() or entry.name.startswith(".") or is_derivative_name(entry.name):
+                continue
+            if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            st = entry.stat()
+            if not manifest.is_done(entry.name, tasks, st.st_size, st.st_mtime_ns):
+                pending.append(Path(entry.path))
+    return sorted(pending)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    # The server module owns the configuration and the commit engines. It is
+    # imported here rather than at the top so pool workers never load it.
+    import shotput
+
+    shotput.apply_config(shotput.load_config(shotput.CONFIG_FILE_PATH))
+    parser = argparse.ArgumentParser(description="Optimize the images already stored in IMAGE_SUB_DIR.")
+    parser.add_argument("--png", action="store_true", help="losslessly optimize PNGs")
+    parser.add_argument("--derivatives", action="store_true", help="write missing WebP/AVIF derivatives")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="process pool size")
+    parser.add_argument("--batch-size", type=int, default=200, help="images per commit")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many images (0: all)")
+    args = parser.parse_args(argv)
+
+    # Without explicit task flags, do what new uploads get
+    png = args.png or (not args.derivatives and shotput.OPTIMIZE_PNG)
+    formats = shotput.DERIVATIVE_FORMATS if (args.derivatives or not args.png) else []
+    widths = sorted(shotput.DERIVATIVE_WIDTHS)
+    if not png and not formats:
+        print("Nothing to do: PNG optimization and derivatives are both disabled.")
+        return 0
+    tasks = ";".join(
+        filter(None, ["png" if png else "", f"{','.join(formats)}@{','.join(map(str, widths))}" if formats else ""])
+    )
+
+    image_dir = shotput.IMAGES_REPO_PATH / shotput.IMAGE_SUB_DIR
+    if not image_dir.is_dir():
+        print(f"Image directory {image_dir} does not exist.")
+        return 1
+    manifest = BackfillManifest(shotput._ensure_state_dir() / "backfill.sqlite3")
+    commit_fn = shotput._make_commit_fn()
+
+    def commit_batch(batch: List[Tuple[str, List[str]]]) -> bool:
+        paths = [image_dir / name for _, written in batch for name in written]
+        message = f"Backfill {len(batch)} images via Shotput ({tasks})"
+        success, detail, _ = commit_fn(paths, message)
+        if success:
+            manifest.mark_committed([name for name, _ in batch])
+            print(f"Committed {len(paths)} files from {len(batch)} images.")
+        else:
+            print(f"Commit failed, the files stay pending for the next run: {detail}")
+        return success
+
+    # Changes from an interrupted run go in first
+    leftover = manifest.uncommitted()
+    if leftover:
+        print(f"Committing {len(leftover)} images processed by an earlier run...")
+        if not commit_batch(leftover):
+            manifest.close()
+            return 1
+
+    pending = _pending_images(image_dir, manifest, tasks)
+    if args.limit:
+        pending = pending[: args.limit]
+    print(f"Backfilling {len(pending)} images in {image_dir} ({tasks}) with {args.workers} workers")
+
+    started = time.monotonic()
+    run_before = run_after = run_derivatives = failed = 0
+    batch: List[Tuple[str, List[str]]] = []
+    ok = True
+    with ProcessPoolExecutor(
+        max_workers=max(1, args.workers), mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        # Keep a bounded number of images in flight so a crash loses little work
+        queue = iter(pending)
+        in_flight = {}
+        done_count = 0
+        while True:
+            while len(in_flight) < args.workers * 2:
+                path = next(queue, None)
+                if path is None:
+                    break
+                future = pool.submit(backfill_image, str(path), png, widths, formats, shotput.DERIVATIVE_QUALITY)
+                in_flight[future] = path
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = in_flight.pop(future)
+                result = future.result()
+                st = path.stat()
+                manifest.record(result, tasks, st.st_size, st.st_mtime_ns)
+                done_count += 1
+                if result["error"]:
+                    failed += 1
+                    print(f"  {result['name']}: {result['error']}")
+                    continue
+                run_before += result["before"]
+                run_after += result["after"]
+                run_derivatives += result["derivative_bytes"]
+                if result["written"]:
+                    batch.append((result["name"], result["written"]))
+                if done_count % 100 == 0:
+                    print(f"  {done_count}/{len(pending)} images processed")
+            if len(batch) >= args.batch_size:
+                ok = commit_batch(batch) and ok
+                batch = []
+
+    if batch:
+        ok = commit_batch(batch) and ok
+
+    elapsed = time.monotonic() - started
+    files, total_before, total_after, total_derivatives = manifest.totals()
+    manifest.close()
+
+    print("\n--- Backfill report ---")
+    print(f"This run: {len(pending) - failed} images in {elapsed:.1f}s, {failed} failed")
+    saved = run_before - run_after
+    pct = 100 * saved / run_before if run_before else 0
+    print(f"  originals:   {_format_bytes(run_before)} -> {_format_bytes(run_after)} (-{_format_bytes(saved)}, {pct:.1f}%)")
+    print(f"  derivatives: +{_format_bytes(run_derivatives)}")
+    saved = total_before - total_after
+    pct = 100 * saved / total_before if total_before else 0
+    print(f"All runs: {files} images")
+    print(f"  originals:   {_format_bytes(total_before)} -> {_format_bytes(total_after)} (-{_format_bytes(saved)}, {pct:.1f}%)")
+    print(f"  derivatives: +{_format_bytes(total_derivatives)}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
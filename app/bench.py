@@ -0,0 +1,640 @@
+# /// script
+# requires-python = ">=3.9"
+# dependencies = [
+#     "fastapi",
+#     "uvicorn[standard]",
+#     "python-multipart",
+#     "Pillow",
+#     "GitPython",
+#     "toml",
+#     "numpy",
+#     "httpx",
+# ]
+# ///
+"""
+Load and latency benchmark for the Shotput server.
+
+Every scenario runs the real server (app/shotput.py under uvicorn) in a
+subprocess against a throwaway images repository whose `origin` is a local
+bare repository, so commits and pushes are real but nothing leaves the
+machine. The repository is seeded with a given number of images first, to show
+how uploads behave as blog-media/ grows.
+
+Payloads are generated up front (screenshot-like PNGs, photo-like JPEGs and
+small animated GIFs at screenshot sizes, each one unique so deduplication never
+short-circuits an upload) and posted to /upload_image/ at each configured
+concurrency. Per scenario it reports p50/p95/p99 latency, throughput, the peak
+RSS of the server and of its worker processes, and commits per upload.
+
+With --nodes N, N servers run against N clones of the same bare origin (like
+Shotput on a laptop and a home server sharing one images repository) and the
+uploads are spread over them. After each level the run waits for every node
+to push and checks that origin holds every upload; rebases onto the other
+nodes' pushes are reported.
+
+With --startup N, no uploads are made: the server is cold-started N times per
+repository size instead, timing the first /health response (how soon a
+scaled-to-zero container can take traffic) and the end of the startup scans.
+
+Usage (from the repository root, like the server):
+
+    uv run app/bench.py                                      # quick run
+    uv run app/bench.py --repo-sizes 0,1000,10000,30000 --concurrency 1,8,32
+    uv run app/bench.py --engine index --requests 50 --json bench.json
+    uv run app/bench.py --set derivatives.formats=[] --set similar.enabled=false
+    uv run app/bench.py --nodes 3 --concurrency 8 --set repository.push_debounce_ms=100
+    uv run app/bench.py --startup 10 --repo-sizes 0,10000
+
+Runs are reproducible for a given --seed; results go to stdout (and --json).
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+import toml
+from PIL import Image, ImageDraw
+
+SERVER_SCRIPT = Path(__file__).with_name("shotput.py")
+IMAGE_SUB_DIR = "blog-media"
+SCREEN_SIZES = [(1280, 800), (1440, 900), (1920, 1080), (2560, 1440)]
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "gif": "image/gif"}
+
+
+# --- Payloads ---
+
+
+def _screenshot(rng: random.Random, size: Tuple[int, int]) -> Image.Image:
+    """Flat UI-like image: window chrome, panels, text-like runs and a few icons."""
+    w, h = size
+    bg = tuple(rng.randrange(200, 256) for _ in range(3))
+    img = Image.new("RGB", size, bg)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, w, 36], fill=tuple(rng.randrange(30, 90) for _ in range(3)))
+    sidebar = rng.randrange(w // 8, w // 4)
+    draw.rectangle([0, 36, sidebar, h], fill=tuple(rng.randrange(220, 246) for _ in range(3)))
+    y = 60
+    while y < h - 20:
+        x = sidebar + 24 if rng.random() < 0.85 else 16
+        # A "line of text": runs of short dark blocks
+        while x < w - 40 and rng.random() < 0.97:
+            word = rng.randrange(12, 70)
+            draw.rectangle([x, y, x + word, y + 9], fill=tuple(rng.randrange(20, 90) for _ in range(3)))
+            x += word + rng.randrange(5, 10)
+        y += rng.choice((18, 18, 22, 40))
+    for _ in range(rng.randrange(2, 6)):
+        x0, y0 = rng.randrange(sidebar, w - 120), rng.randrange(40, h - 120)
+        draw.rounded_rectangle(
+            [x0, y0, x0 + rng.randrange(60, 300), y0 + rng.randrange(30, 160)],
+            radius=6,
+            fill=tuple(rng.randrange(0, 256) for _ in range(3)),
+        )
+    return img
+
+
+def _photo(np_rng: np.random.Generator, size: Tuple[int, int]) -> Image.Image:
+    """Smooth gradients plus sensor-like noise, which is what makes JPEGs large."""
+    w, h = size
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    channels = []
+    for _ in range(3):
+        fx, fy, phase = np_rng.uniform(0.5, 3, 2).tolist() + [np_rng.uniform(0, 6.28)]
+        base = 128 + 90 * np.sin(xx / w * fx * 6.28 + phase) * np.cos(yy / h * fy * 6.28)
+        channels.append(base + np_rng.normal(0, 12, (h, w)))
+    return Image.fromarray(np.clip(np.stack(channels, axis=-1), 0, 255).astype(np.uint8), "RGB")
+
+
+def _stamp(img: Image.Image, index: int) -> Image.Image:
+    """Makes every payload unique (different bytes and SHA-256) without changing its character."""
+    img = img.copy()
+    ImageDraw.Draw(img).text((8, 8), f"#{index:06d}", fill=(255, 0, 0))
+    return img
+
+
+def make_payloads(count: int, formats: List[str], seed: int) -> List[Tuple[str, bytes, str]]:
+    """Returns (file name, bytes, content type) for `count` unique uploads."""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    # A handful of base images, stamped per upload: realistic sizes without
+    # spending minutes encoding
+    bases: Dict[str, List[Image.Image]] = {}
+    for fmt in formats:
+        sizes = SCREEN_SIZES if fmt != "gif" else [(480, 270), (640, 360)]
+        if fmt == "jpeg":
+            bases[fmt] = [_photo(np_rng, rng.choice(sizes)) for _ in range(4)]
+        else:
+            bases[fmt] = [_screenshot(rng, rng.choice(sizes)) for _ in range(4)]
+
+    payloads = []
+    for i in range(count):
+        fmt = formats[i % len(formats)]
+        img = _stamp(rng.choice(bases[fmt]), i)
+        buf = io.BytesIO()
+        if fmt == "png":
+            img.save(buf, "PNG")
+        elif fmt == "jpeg":
+            img.save(buf, "JPEG", quality=90)
+        else:
+            frames = [img.convert("P", palette=Image.ADAPTIVE)]
+            frames += [_stamp(img, i * 1000 + f).convert("P", palette=Image.ADAPTIVE) for f in range(1, 4)]
+            frames[0].save(buf, "GIF", save_all=True, append_images=frames[1:], duration=100, loop=0)
+        ext = "jpg" if fmt == "jpeg" else fmt
+        payloads.append((f"bench-{i:06d}.{ext}", buf.getvalue(), MIME_TYPES[fmt]))
+    return payloads
+
+
+# --- Throwaway repository ---
+
+
+def _git(cwd: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def _seed_image(index: int) -> bytes:
+    # Small distinct PNGs: the cost under test is the number of files, not their size
+    img = Image.new("RGB", (64, 40), ((index * 37) % 256, (index * 91) % 256, (index * 53) % 256))
+    ImageDraw.Draw(img).text((2, 12), str(index), fill=(255, 255, 255))
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def make_repo(root: Path, seed_images: int) -> Path:
+    """
+    Creates root/origin.git (bare) and root/images (branch main, tracking
+    origin) holding seed_images committed images, and returns the images path.
+    """
+    origin = root / "origin.git"
+    images = root / "images"
+    _git(root, "init", "-q", "--bare", str(origin))
+    _git(root, "init", "-q", "-b", "main", str(images))
+    _git(images, "config", "user.email", "bench@shotput.invalid")
+    _git(images, "config", "user.name", "Shotput bench")
+    media = images / IMAGE_SUB_DIR
+    media.mkdir()
+    (images / "README.md").write_text("Shotput benchmark repository\n")
+    for i in range(seed_images):
+        # Names in the server's own <timestamp>_<id> scheme, spread over the past
+        stamp = time.strftime("%Y%m%d%H%M%S", time.localtime(time.time() - 3600 - i * 60))
+        (media / f"{stamp}_{i:08x}.png").write_bytes(_seed_image(i))
+    _git(images, "add", "-A")
+    _git(images, "commit", "-q", "-m", f"Seed {seed_images} images")
+    _git(images, "remote", "add", "origin", str(origin))
+    _git(images, "push", "-q", "origin", "main")
+    return images
+
+
+def clone_node(root: Path, index: int) -> Path:
+    """Clones root/origin.git for another node into root/node<index>/images and returns that path."""
+    images = root / f"node{index}" / "images"
+    images.parent.mkdir()
+    _git(root, "clone", "-q", "-b", "main", str(root / "origin.git"), str(images))
+    _git(images, "config", "user.email", f"bench-{index}@shotput.invalid")
+    _git(images, "config", "user.name", f"Shotput bench node {index}")
+    (images / IMAGE_SUB_DIR).mkdir(exist_ok=True)
+    return images
+
+
+def origin_uploads(root: Path) -> int:
+    """Images (not derivatives: those have a second dot) in origin's main branch."""
+    names = _git(root / "origin.git", "ls-tree", "--name-only", "main", f"{IMAGE_SUB_DIR}/").splitlines()
+    return sum(1 for name in names if name.count(".") == 1)
+
+
+def write_config(root: Path, images: Path, port: int, engine: str, overrides: Dict[str, object]):
+    config: Dict[str, dict] = {
+        "repository": {
+            "images_repo_path": str(images),
+            "image_sub_dir": IMAGE_SUB_DIR,
+            "git_auto_push": True,
+            "commit_engine": engine,
+        },
+        "server": {"port": port},
+        "static_cdn": {"user": "bench", "repo": "bench", "branch": "main"},
+    }
+    for dotted, value in overrides.items():
+        section, key = dotted.rsplit(".", 1)
+        table = config
+        for part in section.split("."):
+            table = table.setdefault(part, {})
+        table[key] = value
+    (root / "app").mkdir(exist_ok=True)
+    with open(root / "app" / "config.toml", "w") as f:
+        toml.dump(config, f)
+
+
+# --- Server process ---
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _children(pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; ppid follows the closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+            children += _children(int(entry))
+    return children
+
+
+def _peak_rss_kb(pid: int) -> Optional[int]:
+    """VmHWM (peak resident set) of a process, Linux only."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss(pid: int) -> Tuple[Optional[int], Optional[int]]:
+    """(server peak RSS, summed peak RSS of its worker processes) in KiB."""
+    server = _peak_rss_kb(pid)
+    if server is None:
+        return None, None
+    workers = [_peak_rss_kb(child) for child in _children(pid)]
+    return server, sum(w for w in workers if w)
+
+
+class Server:
+    """The Shotput server running in root (which holds app/config.toml)."""
+
+    def __init__(self, root: Path, port: int):
+        self.root = root
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.log = open(root / "server.log", "wb")
+        self.process = subprocess.Popen(
+            [sys.executable, str(SERVER_SCRIPT)], cwd=root, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+    async def wait_ready(self, client: httpx.AsyncClient, timeout: float):
+        """Waits for /health, then for the startup scans (the manifest reports completion)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited early, see {self.root / 'server.log'}")
+            try:
+                r = await client.get("/images", params={"limit": 1})
+                if r.status_code == 200 and r.json().get("complete"):
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.25)
+        raise RuntimeError(f"Server not ready after {timeout:.0f}s, see {self.root / 'server.log'}")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+# --- Load ---
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+async def drive(
+    clients: List[httpx.AsyncClient], payloads: List[Tuple[str, bytes, str]], concurrency: int
+) -> Tuple[List[float], int, float]:
+    """
+    Posts every payload with at most `concurrency` in flight, spreading the
+    in-flight uploads over the clients (one per node). Returns (latencies,
+    errors, wall time).
+    """
+    queue = iter(payloads)
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for name, data, content_type in queue:
+            start = time.perf_counter()
+            try:
+                r = await client.post("/upload_image/", files={"image_blob": (name, data, content_type)})
+                ok = r.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(clients[i % len(clients)]) for i in range(concurrency)])
+    return latencies, errors, time.perf_counter() - start
+
+
+async def settle(clients: List[httpx.AsyncClient], timeout: float = 120) -> int:
+    """
+    Waits until no node has unpushed commits (per /push_status).
+
+    Returns:
+        Rebases all nodes made so far.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        statuses = [(await client.get("/push_status")).json() for client in clients]
+        pushed = all(not s.get("enabled") or (s.get("ahead") == 0 and not s.get("pushing")) for s in statuses)
+        if pushed or time.monotonic() > deadline:
+            return sum(s.get("rebases") or 0 for s in statuses)
+        await asyncio.sleep(0.25)
+
+
+async def run_scenario(
+    repo_size: int,
+    concurrency_levels: List[int],
+    payloads: List[Tuple[str, bytes, str]],
+    requests_per_level: int,
+    engine: str,
+    overrides: Dict[str, object],
+    keep: bool,
+    ready_timeout: float,
+    nodes: int = 1,
+) -> List[dict]:
+    root = Path(tempfile.mkdtemp(prefix=f"shotput-bench-{repo_size}-"))
+    results = []
+    servers: List[Server] = []
+    try:
+        t = time.perf_counter()
+        images = make_repo(root, repo_size)
+        print(f"  seeded {repo_size} images in {time.perf_counter() - t:.1f}s ({root})")
+        node_repos = [(root, images)] + [(root / f"node{k}", clone_node(root, k)) for k in range(1, nodes)]
+        for node_root, node_images in node_repos:
+            port = _free_port()
+            write_config(node_root, node_images, port, engine, overrides)
+            servers.append(Server(node_root, port))
+        server = servers[0]
+        clients = [httpx.AsyncClient(base_url=s.base_url, timeout=300) for s in servers]
+        try:
+            for node_server, client in zip(servers, clients):
+                await node_server.wait_ready(client, ready_timeout)
+            await drive(clients, payloads[: 2 * nodes], nodes)  # Warm up worker processes
+            offset = 2 * nodes
+            uploaded = offset
+            # With several nodes, commits only meet on origin
+            commit_repo, commit_ref = (images, "HEAD") if nodes == 1 else (root / "origin.git", "main")
+            if nodes > 1:
+                await settle(clients)
+            for concurrency in concurrency_levels:
+                batch = payloads[offset : offset + requests_per_level]
+                offset += requests_per_level
+                commits_before = int(_git(commit_repo, "rev-list", "--count", commit_ref))
+                latencies, errors, wall = await drive(clients, batch, concurrency)
+                uploaded += len(latencies)
+                if nodes > 1:
+                    rebases = await settle(clients)
+                commits = int(_git(commit_repo, "rev-list", "--count", commit_ref)) - commits_before
+                server_rss, worker_rss = peak_rss(server.process.pid)
+                result = {
+                    "engine": engine,
+                    "repo_images": repo_size,
+                    "concurrency": concurrency,
+                    "uploads": len(latencies),
+                    "errors": errors,
+                    "p50_ms": percentile(latencies, 50) * 1000,
+                    "p95_ms": percentile(latencies, 95) * 1000,
+                    "p99_ms": percentile(latencies, 99) * 1000,
+                    "mean_ms": statistics.fmean(latencies) * 1000 if latencies else float("nan"),
+                    "throughput_per_s": len(latencies) / wall if wall else 0.0,
+                    "upload_mb_per_s": sum(len(p[1]) for p in batch) / wall / 1e6 if wall else 0.0,
+                    "commits_per_upload": commits / len(latencies) if latencies else float("nan"),
+                    "server_peak_rss_mb": server_rss / 1024 if server_rss else None,
+                    "workers_peak_rss_mb": worker_rss / 1024 if worker_rss is not None else None,
+                }
+                if nodes > 1:
+                    result["nodes"] = nodes
+                    result["rebases"] = rebases
+                    result["missing_on_origin"] = repo_size + uploaded - origin_uploads(root)
+                results.append(result)
+                print_row(result)
+        finally:
+            for client in clients:
+                await client.aclose()
+    finally:
+        for node_server in servers:
+            node_server.stop()
+        if keep:
+            print(f"  kept {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+async def time_startup(server: Server, client: httpx.AsyncClient, timeout: float) -> Tuple[float, float]:
+    """Seconds from spawning the server to its first /health response, and to the end of its startup scans."""
+    start = time.perf_counter()
+    first_health = None
+    while time.perf_counter() - start < timeout:
+        if server.process.poll() is not None:
+            raise RuntimeError(f"Server exited early, see {server.root / 'server.log'}")
+        try:
+            if first_health is None:
+                if (await client.get("/health")).status_code == 200:
+                    first_health = time.perf_counter() - start
+                    continue
+            else:
+                r = await client.get("/images", params={"limit": 1})
+                if r.status_code == 200 and r.json().get("complete"):
+                    return first_health, time.perf_counter() - start
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.005)
+    raise RuntimeError(f"Server not ready after {timeout:.0f}s, see {server.root / 'server.log'}")
+
+
+async def run_startup(
+    repo_size: int, runs: int, engine: str, overrides: Dict[str, object], keep: bool, ready_timeout: float
+) -> dict:
+    root = Path(tempfile.mkdtemp(prefix=f"shotput-bench-startup-{repo_size}-"))
+    health: List[float] = []
+    ready: List[float] = []
+    try:
+        images = make_repo(root, repo_size)
+        port = _free_port()
+        write_config(root, images, port, engine, overrides)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            for _ in range(runs):
+                server = Server(root, port)
+                try:
+                    first_health, scans_done = await time_startup(server, client, ready_timeout)
+                finally:
+                    server.stop()
+                health.append(first_health)
+                ready.append(scans_done)
+    finally:
+        if keep:
+            print(f"  kept {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    result = {
+        "engine": engine,
+        "repo_images": repo_size,
+        "runs": runs,
+        "health_p50_ms": percentile(health, 50) * 1000,
+        "health_min_ms": min(health) * 1000,
+        "health_max_ms": max(health) * 1000,
+        "ready_p50_ms": percentile(ready, 50) * 1000,
+    }
+    print(
+        f"{repo_size:>7} {runs:>4} {result['health_p50_ms']:>11.0f} {result['health_min_ms']:>10.0f}"
+        f" {result['health_max_ms']:>10.0f} {result['ready_p50_ms']:>10.0f}"
+    )
+    return result
+
+
+STARTUP_HEADER = f"{'images':>7} {'runs':>4} {'health p50':>11} {'min ms':>10} {'max ms':>10} {'ready p50':>10}"
+
+HEADER = (
+    f"{'images':>7} {'conc':>4} {'ok':>5} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    f" {'up/s':>7} {'MB/s':>6} {'commits/up':>10} {'rss MB':>7} {'workers MB':>10}"
+)
+
+
+def _fmt(value: Optional[float], spec: str) -> str:
+    return "n/a" if value is None else format(value, spec)
+
+
+def print_row(r: dict):
+    print(
+        f"{r['repo_images']:>7} {r['concurrency']:>4} {r['uploads']:>5} {r['errors']:>4}"
+        f" {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}"
+        f" {r['throughput_per_s']:>7.2f} {r['upload_mb_per_s']:>6.2f} {r['commits_per_upload']:>10.2f}"
+        f" {_fmt(r['server_peak_rss_mb'], '.0f'):>7} {_fmt(r['workers_peak_rss_mb'], '.0f'):>10}"
+    )
+    if "nodes" in r:
+        print(f"{'':>7} {r['nodes']} nodes: {r['rebases']} rebases so far, {r['missing_on_origin']} uploads missing on origin")
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _override(value: str) -> Tuple[str, object]:
+    """Parses section.key=<TOML value>, e.g. derivatives.formats=[] or ingest.cpu_workers=4."""
+    key, sep, raw = value.partition("=")
+    if not sep or "." not in key:
+        raise argparse.ArgumentTypeError(f"expected section.key=value, got {value!r}")
+    try:
+        parsed = toml.loads(f"v = {raw}")["v"]
+    except Exception:
+        parsed = raw  # Bare strings
+    return key.strip(), parsed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark Shotput uploads against a throwaway repository.")
+    parser.add_argument("--repo-sizes", type=_int_list, default=[0, 1000], help="seeded images per scenario, e.g. 0,1000,10000,30000")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8], help="concurrent uploads, e.g. 1,8,32")
+    parser.add_argument("--requests", type=int, default=40, help="uploads per concurrency level")
+    parser.add_argument("--formats", default="png,jpeg,gif", help="payload formats (png, jpeg, gif)")
+    parser.add_argument("--engine", choices=["plumbing", "index"], default="plumbing", help="commit_engine to benchmark")
+    parser.add_argument(
+        "--set", type=_override, action="append", default=[], metavar="SECTION.KEY=VALUE",
+        help="override a server config.toml setting (TOML value), repeatable",
+    )
+    parser.add_argument("--nodes", type=int, default=1, help="servers on separate clones of one origin")
+    parser.add_argument("--startup", type=int, default=0, metavar="RUNS", help="time RUNS cold starts instead of uploads")
+    parser.add_argument("--seed", type=int, default=1, help="payload and repository seed")
+    parser.add_argument("--ready-timeout", type=float, default=600, help="seconds to wait for startup scans")
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scenario directories (with server.log)")
+    args = parser.parse_args(argv)
+
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    unknown = set(formats) - set(MIME_TYPES)
+    if unknown:
+        parser.error(f"unknown formats: {', '.join(sorted(unknown))}")
+
+    if args.nodes < 1:
+        parser.error("--nodes must be at least 1")
+
+    overrides = dict(args.set)
+    if args.startup:
+        print(f"Timing {args.startup} cold starts per repository size (ms from spawn)\n")
+        print(STARTUP_HEADER)
+        results = [
+            asyncio.run(run_startup(size, args.startup, args.engine, overrides, args.keep, args.ready_timeout))
+            for size in args.repo_sizes
+        ]
+        if args.json:
+            args.json.write_text(json.dumps({"args": {k: str(v) for k, v in vars(args).items()}, "results": results}, indent=2))
+            print(f"\nWrote {args.json}")
+        return 0
+
+    total = 2 * args.nodes + args.requests * len(args.concurrency)
+    t = time.perf_counter()
+    payloads = make_payloads(total, formats, args.seed)
+    size_mb = sum(len(p[1]) for p in payloads) / 1e6
+    print(f"Generated {len(payloads)} payloads ({size_mb:.1f} MB, {', '.join(formats)}) in {time.perf_counter() - t:.1f}s")
+    print(f"Commit engine: {args.engine}")
+    for key, value in overrides.items():
+        print(f"  {key} = {value!r}")
+    print()
+    print(HEADER)
+
+    results = []
+    for repo_size in args.repo_sizes:
+        results += asyncio.run(
+            run_scenario(
+                repo_size,
+                args.concurrency,
+                payloads,
+                args.requests,
+                args.engine,
+                overrides,
+                args.keep,
+                args.ready_timeout,
+                args.nodes,
+            )
+        )
+
+    if args.json:
+        args.json.write_text(json.dumps({"args": {k: str(v) for k, v in vars(args).items()}, "results": results}, indent=2))
+        print(f"\nWrote {args.json}")
+    return 0 if all(r["errors"] == 0 and not r.get("missing_on_origin") for r in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,300 @@
+"""
+Single-writer coordination of git commits across worker processes.
+
+With several worker processes (`server.workers`, or `uvicorn --workers N`),
+every worker receives, validates and processes uploads itself, but exactly one
+of them, the writer, touches git. It holds an exclusive lock on
+<state>/git-writer.lock and serves commit requests on a Unix socket. Every
+request from another worker is first written to a spool directory:
+
+- all commits are made by one process, through its CommitCoalescer and git
+  thread, in the order the requests reach it;
+- an upload stored by a worker that dies before its commit is still
+  committed, since its spool entry stays behind;
+- when the writer dies its lock is released, another worker takes over and
+  commits everything left in the spool (oldest first) before new requests.
+
+A spool entry is removed once its commit succeeded, or by its worker once it
+learned that the commit failed. A retried request whose entry is gone was
+therefore committed by an earlier writer that died before replying.
+
+The writer commits its own uploads directly, without a spool entry, so a
+single process (always the writer) pays nothing for the spool.
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: a single process, always the writer
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# (success, message, commit SHA or None); success is None when the outcome is
+# not known yet: the upload stays spooled and a later writer commits it
+SubmitResult = Tuple[Optional[bool], str, Optional[str]]
+Submit = Callable[[List[Path], str], Awaitable[SubmitResult]]
+
+# Results of finished entries, for requests retried after a writer takeover
+RECENT_RESULTS = 4096
+
+
+class GitCoordinator:
+    """
+    Routes commits of this worker to the writer process, electing one as needed.
+
+    Args:
+        state_dir: Shared by all workers; holds the lock, the socket and the spool.
+        run_io: Runs a blocking call off the event loop (IngestPipeline.run_io).
+        become_writer: Called once when this worker becomes the writer; sets up
+            git (coalescer, pusher) and returns the submit function to commit with.
+        pending: Uploads waiting for a commit in the writer's coalescer.
+        takeover_interval: How often a non-writer checks whether the writer is gone.
+        request_timeout: How long a commit request waits for a writer to appear.
+    """
+
+    def __init__(
+        self,
+        state_dir: Path,
+        run_io: Callable[..., Awaitable],
+        become_writer: Callable[[], Awaitable[Submit]],
+        pending: Callable[[], int] = lambda: 0,
+        takeover_interval: float = 1.0,
+        request_timeout: float = 120.0,
+    ):
+        self.state_dir = state_dir
+        self.spool_dir = state_dir / "git-spool"
+        self.lock_path = state_dir / "git-writer.lock"
+        self.socket_path = _socket_path(state_dir)
+        self.run_io = run_io
+        self.become_writer = become_writer
+        self.writer_pending = pending
+        self.takeover_interval = takeover_interval
+        self.request_timeout = request_timeout
+
+        self.is_writer = False
+        self._commit: Optional[Submit] = None
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._task: "Optional[asyncio.Task[None]]" = None
+        self._writer_ready = asyncio.Event()
+        self._results: "OrderedDict[str, asyncio.Future[SubmitResult]]" = OrderedDict()
+        self._seq = itertools.count()
+        self._waiting = 0
+
+    def __len__(self) -> int:
+        """Uploads waiting for their commit (all of them, on the writer)."""
+        return self.writer_pending() if self._writer_ready.is_set() else self._waiting
+
+    async def start(self):
+        """
+        Becomes the writer if there is none, otherwise watches for the writer
+        to go away. The writer is set up (become_writer) in the background, so
+        the server starts answering before git is opened; commits wait for it.
+        """
+        await self.run_io(self.spool_dir.mkdir, parents=True, exist_ok=True)
+        if await self.run_io(self._try_lock):
+            self.is_writer = True
+            self._task = asyncio.get_running_loop().create_task(self._take_over())
+        else:
+            logger.info(f"Another process is the git writer; sending commits to {self.socket_path}")
+            self._task = asyncio.get_running_loop().create_task(self._watch_writer())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._server is not None:
+            self._server.close()
+            self.socket_path.unlink(missing_ok=True)
+        self._release_lock()
+
+    def _release_lock(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # Releases the lock for the next writer
+            self._lock_fd = None
+
+    def _try_lock(self) -> bool:
+        if fcntl is None:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._lock_fd = fd
+        return True
+
+    async def _watch_writer(self):
+        while True:
+            await asyncio.sleep(self.takeover_interval)
+            try:
+                if await self.run_io(self._try_lock):
+                    logger.warning("The git writer went away; this process takes over")
+                    await self._take_over()
+                    return
+            except Exception as e:
+                logger.error(f"Could not take over as the git writer: {e}")
+
+    async def _take_over(self):
+        self.is_writer = True
+        try:
+            self._commit = await self.become_writer()
+            await self.run_io(self.socket_path.unlink, missing_ok=True)  # Left by a writer that died
+            self._server = await asyncio.start_unix_server(self._serve, path=str(self.socket_path))
+        except Exception as e:
+            # Let another worker (or this one, on the next check) try again
+            logger.error(f"Could not set up this process as the git writer: {e}")
+            self.is_writer = False
+            self._release_lock()
+            self._task = asyncio.get_running_loop().create_task(self._watch_writer())
+            return
+        # Entries left behind by dead workers (or a dead writer) go first, in order
+        spooled = await self.run_io(lambda: sorted(p.name for p in self.spool_dir.glob("*.json")))
+        leftover = [name for name in spooled if name not in self._results]  # Not this process's own
+        if leftover:
+            logger.warning(f"Committing {len(leftover)} spooled uploads left by stopped workers")
+        for name in leftover:
+            self._start_entry(name)
+        self._writer_ready.set()
+        logger.info(f"This process (pid {os.getpid()}) is the git writer")
+
+    # --- Submitting ---
+
+    async def submit(self, paths: List[Path], message: str) -> SubmitResult:
+        """
+        Commits an upload's files through the writer; same contract as
+        CommitCoalescer.submit, except that success is None when it is not
+        known whether the files will be committed (see SubmitResult).
+        """
+        self._waiting += 1
+        try:
+            if self.is_writer:
+                return await self._commit_own(paths, message)
+            name = await self.run_io(self._spool, paths, message)
+            result = await self._request(name)
+            if result[0] is False:
+                # Known not committed: no later writer may commit the files the caller deletes
+                await self.run_io((self.spool_dir / name).unlink, missing_ok=True)
+            return result
+        finally:
+            self._waiting -= 1
+
+    async def _commit_own(self, paths: List[Path], message: str) -> SubmitResult:
+        try:
+            await asyncio.wait_for(self._writer_ready.wait(), self.request_timeout)
+        except asyncio.TimeoutError:
+            return False, "The git writer could not be set up in time.", None
+        return await self._commit(paths, message)
+
+    def _spool(self, paths: List[Path], message: str) -> str:
+        # Zero-padded nanoseconds first, so names sort in arrival order
+        name = f"{time.time_ns():020d}-{os.getpid()}-{next(self._seq)}.json"
+        tmp = self.spool_dir / f".{name}.tmp"
+        tmp.write_text(json.dumps({"paths": [str(p) for p in paths], "message": message}))
+        os.replace(tmp, self.spool_dir / name)
+        return name
+
+    async def _request(self, name: str) -> SubmitResult:
+        deadline = time.monotonic() + self.request_timeout
+        delay = 0.05
+        while True:
+            if self.is_writer:  # Took over while waiting
+                return await self._commit_entry(name)
+            try:
+                reader, writer = await asyncio.open_unix_connection(str(self.socket_path))
+                try:
+                    writer.write(json.dumps({"entry": name}).encode() + b"\n")
+                    await writer.drain()
+                    line = await reader.readline()
+                finally:
+                    writer.close()
+                if not line:
+                    raise ConnectionResetError("The git writer closed the connection")
+                reply = json.loads(line)
+                return reply["ok"], reply["message"], reply["sha"]
+            except (OSError, ValueError) as e:
+                # No writer right now (starting, or it died mid-request). The spool
+                # entry is safe; whoever takes over commits it or answers a retry.
+                if time.monotonic() > deadline:
+                    return None, f"No git writer process is available yet ({e}); the upload stays spooled.", None
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.takeover_interval)
+
+    # --- Writing (only in the writer) ---
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await reader.readline())
+            await self._writer_ready.wait()
+            ok, message, sha = await self._commit_entry(request["entry"])
+            writer.write(json.dumps({"ok": ok, "message": message, "sha": sha}).encode() + b"\n")
+            await writer.drain()
+        except Exception as e:
+            logger.warning(f"Git writer dropped a request: {e}")
+        finally:
+            writer.close()
+
+    def _start_entry(self, name: str) -> "asyncio.Future[SubmitResult]":
+        future = self._results.get(name)
+        if future is None:
+            future = asyncio.ensure_future(self._commit_spooled(name))
+            self._results[name] = future
+            while len(self._results) > RECENT_RESULTS and next(iter(self._results.values())).done():
+                self._results.popitem(last=False)
+        return future
+
+    async def _commit_entry(self, name: str) -> SubmitResult:
+        # Shielded: a client giving up must not cancel the commit others share
+        return await asyncio.shield(self._start_entry(name))
+
+    async def _commit_spooled(self, name: str) -> SubmitResult:
+        try:
+            await asyncio.wait_for(self._writer_ready.wait(), self.request_timeout)
+        except asyncio.TimeoutError:
+            return None, "The git writer could not be set up in time; the upload stays spooled.", None
+        path = self.spool_dir / name
+        try:
+            entry = json.loads(await self.run_io(path.read_text))
+        except FileNotFoundError:
+            # Entries are only removed after a successful commit (failures are
+            # removed by their worker, which then does not ask again)
+            return True, "Committed by a previous git writer.", None
+        paths = [Path(p) for p in entry["paths"]]
+        if not all(await asyncio.gather(*[self.run_io(p.exists) for p in paths])):
+            # The upload failed and its files were removed; nothing to commit
+            await self.run_io(path.unlink, missing_ok=True)
+            return False, "The upload's files no longer exist.", None
+        result = await self._commit(paths, entry["message"])
+        if result[0]:
+            await self.run_io(path.unlink, missing_ok=True)
+        return result
+
+    def status(self) -> Dict[str, object]:
+        writer_pid = None
+        try:
+            writer_pid = int(self.lock_path.read_text().strip() or 0) or None
+        except (OSError, ValueError):
+            pass
+        return {"pid": os.getpid(), "is_writer": self.is_writer, "writer_pid": writer_pid}
+
+
+def _socket_path(state_dir: Path) -> Path:
+    path = state_dir / "git-writer.sock"
+    if len(str(path.resolve())) < 100:  # sun_path is 108 bytes on Linux
+        return path
+    digest = hashlib.sha1(str(state_dir.resolve()).encode()).hexdigest()[:12]
+    return Path(tempfile.gettempdir()) / f"shotput-{digest}.sock"
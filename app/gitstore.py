@@ -0,0 +1,262 @@
+"""
+Plumbing-level git commits for Shotput.
+
+Instead of going through the working index (which GitPython reads and rewrites
+in full on every add), blobs are hashed straight into the object database, the
+new tree is built from the previous tree plus the added entries, and the branch
+ref is moved with a compare-and-swap `git update-ref`. Only the directories on
+the path of an added file are rewritten, so the cost of a commit no longer grows
+with the number of files in the repository's index.
+
+The same tree building replays local commits onto a remote tip that moved
+(rebase_onto): as long as both sides only add or change different files, as
+two Shotput instances adding uniquely named images to one repository do, no
+merge is needed.
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import io
+import logging
+import stat
+
+import git
+from git.objects.fun import tree_entries_from_data, tree_to_stream
+from gitdb.base import IStream
+
+from metrics import GIT_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+FILE_MODE = 0o100644
+TREE_MODE = 0o040000
+BLOB_MODES = (0o100644, 0o100755, 0o120000)
+
+# (binsha, mode, name) as used by GitPython's tree (de)serialization helpers
+TreeEntry = Tuple[bytes, int, str]
+
+
+def _tree_sort_key(entry: TreeEntry) -> bytes:
+    # git orders tree entries bytewise, comparing directories as if they ended in "/"
+    _, mode, name = entry
+    suffix = b"/" if stat.S_ISDIR(mode) else b""
+    return name.encode("utf-8") + suffix
+
+
+class RebaseConflict(Exception):
+    """Local commits that cannot be replayed onto the remote without a real merge."""
+
+
+class PlumbingCommitter:
+    """
+    Long-lived handle that commits files without touching the working index.
+
+    Args:
+        git_dir: Path to the repository. May be a bare repository, in which case
+            no working tree is required at all.
+        branch: Branch to commit to. Defaults to whatever HEAD points at.
+        sync_index: Also record committed paths in the index (via `git
+            update-index --cacheinfo`, which does not rehash anything) so a
+            working tree does not show them as deleted+untracked. Defaults to
+            True for non-bare repositories.
+    """
+
+    def __init__(
+        self,
+        git_dir: Path,
+        branch: Optional[str] = None,
+        sync_index: Optional[bool] = None,
+    ):
+        self.repo = git.Repo(git_dir)
+        self.ref = f"refs/heads/{branch}" if branch else self.repo.head.reference.path
+        self.sync_index = (not self.repo.bare) if sync_index is None else sync_index
+
+    @property
+    def branch(self) -> str:
+        return self.ref[len("refs/heads/") :]
+
+    def _read_tree(self, binsha: Optional[bytes]) -> List[TreeEntry]:
+        if binsha is None:
+            return []
+        return tree_entries_from_data(self.repo.odb.stream(binsha).read())
+
+    def _write_tree(self, entries: List[TreeEntry]) -> bytes:
+        buf = io.BytesIO()
+        tree_to_stream(sorted(entries, key=_tree_sort_key), buf.write)
+        data = buf.getvalue()
+        return self.repo.odb.store(IStream(b"tree", len(data), io.BytesIO(data))).binsha
+
+    def _build_tree(self, base: Optional[bytes], changes: Dict[str, Tuple[bytes, int]]) -> bytes:
+        """
+        Returns the binsha of `base` with `changes` ({relative path: (binsha, mode)}) applied.
+        """
+        entries = {name: (binsha, mode) for binsha, mode, name in self._read_tree(base)}
+
+        subdirs: Dict[str, Dict[str, Tuple[bytes, int]]] = {}
+        for path, entry in changes.items():
+            head, sep, rest = path.partition("/")
+            if sep:
+                subdirs.setdefault(head, {})[rest] = entry
+            else:
+                entries[path] = entry
+
+        for name, sub_changes in subdirs.items():
+            existing = entries.get(name)
+            sub_base = existing[0] if existing and stat.S_ISDIR(existing[1]) else None
+            entries[name] = (self._build_tree(sub_base, sub_changes), TREE_MODE)
+
+        return self._write_tree([(binsha, mode, name) for name, (binsha, mode) in entries.items()])
+
+    def hash_file(self, file_path: Path) -> bytes:
+        """Writes file_path into the object database as a blob and returns its binsha."""
+        size = file_path.stat().st_size
+        with open(file_path, "rb") as f:
+            return self.repo.odb.store(IStream(b"blob", size, f)).binsha
+
+    def _head_is_ref(self) -> bool:
+        try:
+            return self.repo.head.reference.path == self.ref
+        except TypeError:
+            return False  # Detached HEAD
+
+    def _current_commit(self) -> Optional[git.Commit]:
+        try:
+            return self.repo.commit(self.ref)
+        except (git.BadName, ValueError):
+            return None  # Unborn branch
+
+    def commit_files(
+        self, files: List[Tuple[str, Path]], message: str, max_attempts: int = 3
+    ) -> git.Commit:
+        """
+        Commits files on top of the branch tip.
+
+        Args:
+            files: (path inside the repository, path on disk) pairs.
+            message: The commit message.
+            max_attempts: How often to rebuild on a new tip if the ref moved
+                underneath us (e.g. someone committed in the working tree).
+
+        Returns:
+            The new commit, or the tip itself if it already has these files
+            with these contents.
+        """
+        # Blobs are hashed exactly once, however many times the tree is rebuilt
+        with GIT_STAGE_SECONDS.time(stage="add"):
+            changes = {
+                repo_path: (self.hash_file(disk_path), FILE_MODE) for repo_path, disk_path in files
+            }
+
+        with GIT_STAGE_SECONDS.time(stage="commit"):
+            return self._commit_changes(changes, message, max_attempts)
+
+    def _commit_changes(
+        self, changes: Dict[str, Tuple[bytes, int]], message: str, max_attempts: int
+    ) -> git.Commit:
+        for attempt in range(1, max_attempts + 1):
+            parent = self._current_commit()
+            tree_sha = self._build_tree(parent.tree.binsha if parent else None, changes)
+            if parent is not None and tree_sha == parent.tree.binsha:
+                # Already committed with these contents (e.g. a replayed request)
+                return parent
+            commit = git.Commit.create_from_tree(
+                self.repo,
+                git.Tree(self.repo, tree_sha),
+                message,
+                parent_commits=[parent] if parent else [],
+                head=False,
+            )
+            old = parent.hexsha if parent else "0" * 40
+            try:
+                reflog_message = f"commit: {message.splitlines()[0]}"
+                self.repo.git.update_ref("-m", reflog_message, self.ref, commit.hexsha, old)
+                break
+            except git.GitCommandError as e:
+                if attempt == max_attempts:
+                    raise
+                logger.warning(f"{self.ref} moved during commit (attempt {attempt}), retrying: {e.stderr}")
+
+        if self.sync_index and self._head_is_ref():
+            cacheinfo = []
+            for repo_path, (binsha, mode) in changes.items():
+                cacheinfo += ["--cacheinfo", f"{mode:o},{binsha.hex()},{repo_path}"]
+            self.repo.git.update_index("--add", *cacheinfo)
+
+        return commit
+
+    def _changed_paths(self, old: str, new: str) -> Dict[str, Tuple[bytes, int]]:
+        """{path: (binsha, mode)} of every file that differs between two commits (deletions have mode 0)."""
+        fields = self.repo.git.diff_tree("-r", "--no-renames", "-z", old, new).split("\0")
+        changes = {}
+        for meta, path in zip(fields[0::2], fields[1::2]):
+            _, new_mode, _, new_sha, _ = meta.lstrip(":").split(" ")
+            changes[path] = (bytes.fromhex(new_sha), int(new_mode, 8))
+        return changes
+
+    def rebase_onto(self, upstream: str) -> Tuple[Optional[str], int]:
+        """
+        Moves the branch onto `upstream` (usually the remote-tracking ref after
+        a fetch): fast-forwards if there are no local commits, otherwise
+        replays each local commit on top with its message and author. Nothing
+        is merged; commits that add or change files the remote changed too, or
+        that delete files, raise RebaseConflict and leave the branch alone.
+
+        Args:
+            upstream: Ref or SHA to rebase onto.
+
+        Returns:
+            (new branch tip or None if the branch was left alone, number of
+            local commits replayed).
+
+        Raises:
+            RebaseConflict: If a local commit cannot be replayed.
+            git.GitCommandError: If the branch moved meanwhile (retry) or git failed.
+        """
+        tip = self._current_commit()
+        remote = self.repo.commit(upstream)
+        if tip is None:
+            new, replayed = remote, []
+        else:
+            bases = self.repo.merge_base(tip, remote)
+            base = bases[0] if bases else None
+            if base is not None and base.binsha == remote.binsha:
+                return None, 0  # The remote has nothing we lack
+            if base is None:
+                raise RebaseConflict(f"{self.ref} and {upstream} have no common history")
+            replayed = list(self.repo.iter_commits(f"{base.hexsha}..{tip.hexsha}", reverse=True, topo_order=True))
+            remote_changes = self._changed_paths(base.hexsha, remote.hexsha) if replayed else {}
+            new = remote
+            for commit in replayed:
+                if len(commit.parents) != 1:
+                    raise RebaseConflict(f"{commit.hexsha[:12]} is a merge commit")
+                changes = self._changed_paths(commit.parents[0].hexsha, commit.hexsha)
+                for path, entry in changes.items():
+                    if entry[1] not in BLOB_MODES:
+                        raise RebaseConflict(f"{commit.hexsha[:12]} deletes or retypes {path}")
+                    if path in remote_changes and remote_changes[path] != entry:
+                        raise RebaseConflict(f"{path} was changed both locally ({commit.hexsha[:12]}) and on {upstream}")
+                new = git.Commit.create_from_tree(
+                    self.repo,
+                    git.Tree(self.repo, self._build_tree(new.tree.binsha, changes)),
+                    commit.message,
+                    parent_commits=[new],
+                    head=False,
+                    author=commit.author,
+                    author_date=commit.authored_datetime,
+                )
+
+        old = tip.hexsha if tip is not None else "0" * 40
+        action = f"rebase onto {upstream}" if replayed else f"fast-forward to {upstream}"
+        self.repo.git.update_ref("-m", action, self.ref, new.hexsha, old)
+        if self.sync_index and self._head_is_ref():
+            # Check out what the remote added; the local files are unchanged
+            try:
+                if tip is None:
+                    self.repo.git.read_tree("-m", "-u", new.hexsha)
+                else:
+                    self.repo.git.read_tree("-m", "-u", tip.hexsha, new.hexsha)
+            except git.GitCommandError as e:
+                logger.warning(f"Moved {self.ref} to {new.hexsha[:12]}, but could not update the working tree: {e.stderr}")
+        replayed_note = f" ({len(replayed)} local commits replayed)" if replayed else ""
+        logger.info(f"{action.capitalize()}: {self.ref} is now {new.hexsha[:12]}{replayed_note}")
+        return new.hexsha, len(replayed)
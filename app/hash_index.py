@@ -0,0 +1,163 @@
+"""
+Persistent content-hash index of the images under IMAGE_SUB_DIR.
+
+Maps the SHA-256 of every stored image to its file name so re-uploads of the
+same bytes can be answered without touching the image or git. The index lives
+in a small SQLite database that every worker process reads and adds to, so an
+upload stored by one worker is a duplicate for all of them; a lookup is one
+query on the sha256 index. The startup scan only hashes files whose size or
+mtime changed since the last run, and commits progress in batches, so an
+interrupted scan resumes where it left off.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Tuple
+import hashlib
+import itertools
+import logging
+import os
+import threading
+
+import statedb
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashIndex:
+    """
+    Content-hash index for one image directory.
+
+    Args:
+        db_path: SQLite database file (created if missing).
+        image_dir: Directory whose files are indexed (not recursive).
+        ignore: Predicate for file names the scan should skip (e.g. derivatives).
+    """
+
+    def __init__(
+        self, db_path: Path, image_dir: Path, ignore: Optional[Callable[[str], bool]] = None
+    ):
+        self.image_dir = image_dir
+        self.ignore = ignore
+        self._lock = threading.Lock()
+        self._db = statedb.connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " name TEXT PRIMARY KEY, sha256 TEXT NOT NULL,"
+            " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+        self._db.commit()
+        self.scan_complete = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def lookup(self, digest: str) -> Optional[str]:
+        """Returns the name of a stored file with this SHA-256, if any."""
+        with self._lock:
+            row = self._db.execute("SELECT name FROM files WHERE sha256 = ? LIMIT 1", (digest,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, name: str, digest: str, size: int, mtime_ns: int):
+        self.add_many([(name, digest, size, mtime_ns)])
+
+    def add_many(self, rows: Iterable[Tuple[str, str, int, int]]):
+        """Records (name, sha256, size, mtime_ns) rows in one transaction."""
+        rows = list(rows)
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files (name, sha256, size, mtime_ns) VALUES (?, ?, ?, ?)", rows
+            )
+            self._db.commit()
+
+    def add_file(self, path: Path, digest: Optional[str] = None):
+        """Records a file that was just written to image_dir, hashing it if needed."""
+        st = path.stat()
+        self.add(path.name, digest or sha256_file(path), st.st_size, st.st_mtime_ns)
+
+    def remove(self, name: str):
+        self.remove_many([name])
+
+    def remove_many(self, names: Iterable[str]):
+        names = list(names)
+        with self._lock:
+            self._db.executemany("DELETE FROM files WHERE name = ?", [(name,) for name in names])
+            self._db.commit()
+
+    def scan(self, max_workers: int = 4, batch_size: int = 256) -> Tuple[int, int]:
+        """
+        Brings the index in line with image_dir.
+
+        Files whose size and mtime match the recorded entry are skipped; the rest
+        are hashed on a thread pool (hashlib releases the GIL) and committed every
+        batch_size files. A batch is written only once it is hashed, so the
+        write transaction that other processes wait for stays short. Entries
+        for files that no longer exist are dropped.
+
+        Returns:
+            A tuple (files_seen: int, files_hashed: int).
+        """
+        if not self.image_dir.is_dir():
+            self.scan_complete = True
+            return 0, 0
+
+        # Only entries that existed before the scan may be pruned; uploads that
+        # land while the scan runs are added concurrently and must survive it.
+        with self._lock:
+            known = {
+                name: (size, mtime_ns)
+                for name, size, mtime_ns in self._db.execute("SELECT name, size, mtime_ns FROM files")
+            }
+        seen = set()
+        stale = []
+        with os.scandir(self.image_dir) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.startswith("."):
+                    continue
+                if self.ignore is not None and self.ignore(entry.name):
+                    continue
+                seen.add(entry.name)
+                st = entry.stat()
+                if known.get(entry.name) == (st.st_size, st.st_mtime_ns):
+                    continue
+                stale.append((entry.name, st.st_size, st.st_mtime_ns))
+
+        def hash_one(item):
+            name, size, mtime_ns = item
+            return name, sha256_file(self.image_dir / name), size, mtime_ns
+
+        hashed = 0
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="shotput-scan") as pool:
+            results = pool.map(hash_one, stale)
+            while True:
+                batch = list(itertools.islice(results, batch_size))
+                if not batch:
+                    break
+                self.add_many(batch)
+                hashed += len(batch)
+                logger.info(f"Hash index scan: {hashed}/{len(stale)} files hashed")
+
+        self.remove_many(set(known) - seen)
+
+        self.scan_complete = True
+        return len(seen), hashed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
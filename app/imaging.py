@@ -0,0 +1,629 @@
+"""
+CPU-bound image work for Shotput.
+
+Everything in this module may run inside the ingest process pool, so it must be
+importable without side effects and only take/return picklable values. Pillow
+and numpy are imported by the functions that use them, keeping the server's
+import (and cold start) free of both.
+"""
+
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Tuple
+import base64
+import functools
+import io
+import os
+import re
+import zlib
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+
+# --- Upload validation ---
+
+# Enough leading bytes for every signature sniff_image_type knows
+SNIFF_BYTES = 16
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+
+
+class ImageTooLarge(ValueError):
+    """The image header declares more pixels than Pillow is allowed to decode."""
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """
+    Identifies an image from its magic bytes.
+
+    Args:
+        head: At least the first SNIFF_BYTES bytes of the file.
+
+    Returns:
+        The extension the image is stored under (".heic" for HEIF files, which
+        prepare_image_file converts), or None if the bytes are not a known format.
+    """
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"avif", b"avis"):
+            return ".avif"
+        if brand in HEIF_BRANDS:
+            return ".heic"
+    return None
+
+
+def read_image_header(path: str) -> Tuple[str, int, int]:
+    """
+    Parses only the image header; no pixel data is decoded.
+
+    Returns:
+        A tuple (format: str, width: int, height: int).
+
+    Raises:
+        ImageTooLarge: If Pillow's decompression-bomb guard trips.
+        ValueError: If Pillow cannot identify the image.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as img:
+            return img.format, img.width, img.height
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from None
+    except Exception as e:
+        raise ValueError(str(e)) from None
+
+
+def _replace_file(path: Path, data: bytes):
+    """Writes data to a dot-prefixed sibling and renames it over path."""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def prepare_image_file(path: str, file_extension: str) -> str:
+    """
+    Converts a staged upload into the format it is stored in, in place.
+
+    HEIC/HEIF uploads are re-encoded as PNG; everything else is stored unchanged.
+
+    Args:
+        path: The staged upload, already validated by read_image_header.
+        file_extension: The extension from sniff_image_type.
+
+    Returns:
+        The extension the file should be stored under.
+
+    Raises:
+        ValueError: If the image cannot be decoded.
+    """
+    from PIL import Image
+
+    if file_extension != ".heic":
+        return file_extension
+    try:
+        with Image.open(path) as img:
+            out = io.BytesIO()
+            img.save(out, "PNG")
+        _replace_file(Path(path), out.getvalue())
+    except Exception as e:
+        # Re-raise as a plain ValueError so it always pickles across the pool boundary
+        raise ValueError(str(e)) from None
+    return ".png"
+
+
+# --- Perceptual hashing ---
+
+PERCEPTUAL_HASH_ALGORITHMS = ("dhash", "phash")
+
+
+@functools.lru_cache(maxsize=None)
+def _dct_matrix(n: int) -> "np.ndarray":
+    """Orthonormal DCT-II basis, so the 2D DCT of X is D @ X @ D.T."""
+    import numpy as np
+
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    d[0, :] = np.sqrt(1.0 / n)
+    return d
+
+
+def _bits_to_int(bits: "np.ndarray") -> int:
+    import numpy as np
+
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def _grayscale(img: "Image.Image", size: Tuple[int, int]) -> "np.ndarray":
+    # draft() lets JPEG decode straight at a reduced scale (a no-op for other
+    # formats); keeping 8x headroom leaves the final filtered resize in charge
+    # of the result, so re-encodes of the same image hash alike
+    import numpy as np
+    from PIL import Image
+
+    img.draft("L", (size[0] * 8, size[1] * 8))
+    small = img.convert("L").resize(size, Image.BILINEAR)
+    return np.asarray(small, dtype=np.float32)
+
+
+def dhash(img: "Image.Image", hash_size: int = 8) -> int:
+    """64-bit difference hash: sign of horizontal gradients over a 9x8 grayscale copy."""
+    g = _grayscale(img, (hash_size + 1, hash_size))
+    return _bits_to_int(g[:, 1:] > g[:, :-1])
+
+
+def phash(img: "Image.Image", hash_size: int = 8, highfreq_factor: int = 4) -> int:
+    """64-bit DCT hash: low-frequency DCT coefficients of a 32x32 copy against their median."""
+    import numpy as np
+
+    n = hash_size * highfreq_factor
+    g = _grayscale(img, (n, n))
+    d = _dct_matrix(n)
+    low = (d @ g @ d.T)[:hash_size, :hash_size]
+    # The DC term only reflects overall brightness, so leave it out of the median
+    median = np.median(low.ravel()[1:])
+    return _bits_to_int(low > median)
+
+
+def perceptual_hash_file(path: str, algorithm: str = "dhash") -> Optional[int]:
+    """Perceptual hash of an image file, or None if it is not a decodable image."""
+    from PIL import Image
+
+    try:
+        with Image.open(path) as img:
+            return phash(img) if algorithm == "phash" else dhash(img)
+    except Exception:
+        return None
+
+
+# --- Placeholders ---
+
+BLURHASH_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+# Side of the copy BlurHash is computed over; more pixels only add detail the
+# few components cannot show
+BLURHASH_SAMPLE_SIZE = 32
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(BLURHASH_CHARACTERS[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+
+def _srgb_to_linear(rgb: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    v = rgb.astype(np.float64) / 255
+    return np.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb(v: float) -> int:
+    v = min(1.0, max(0.0, v))
+    return int(v * 12.92 * 255 + 0.5) if v <= 0.0031308 else int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(rgb: "np.ndarray", x_components: int = 4, y_components: int = 3) -> str:
+    """
+    Encodes an RGB pixel array as a BlurHash (https://blurha.sh).
+
+    All components come out of one tensor contraction of the linear-light
+    pixels with the cosine bases, instead of a pixel loop per component.
+
+    Args:
+        rgb: uint8 array of shape (height, width, 3), ideally a small copy.
+        x_components, y_components: Horizontal and vertical detail, 1 to 9.
+    """
+    import numpy as np
+
+    height, width = rgb.shape[:2]
+    linear = _srgb_to_linear(rgb)
+    basis_x = np.cos(np.pi * np.arange(x_components)[:, None] * np.arange(width)[None, :] / width)
+    basis_y = np.cos(np.pi * np.arange(y_components)[:, None] * np.arange(height)[None, :] / height)
+    # factors[j, i] = mean over pixels of basis_y[j, y] * basis_x[i, x] * linear[y, x]
+    factors = np.einsum("jy,ix,yxc->jic", basis_y, basis_x, linear) / (width * height)
+    factors[1:] *= 2
+    factors[0, 1:] *= 2
+    factors = factors.reshape(-1, 3)
+    dc, ac = factors[0], factors[1:]
+
+    parts = [_base83((x_components - 1) + (y_components - 1) * 9, 1)]
+    if len(ac):
+        quantised_max = int(max(0, min(82, np.floor(np.abs(ac).max() * 166 - 0.5))))
+        maximum = (quantised_max + 1) / 166
+        parts.append(_base83(quantised_max, 1))
+    else:
+        maximum = 1.0
+        parts.append(_base83(0, 1))
+    r, g, b = (_linear_to_srgb(float(v)) for v in dc)
+    parts.append(_base83((r << 16) + (g << 8) + b, 4))
+    if len(ac):
+        scaled = ac / maximum
+        quantised = np.clip(np.floor(np.sign(scaled) * np.sqrt(np.abs(scaled)) * 9 + 9.5), 0, 18).astype(int)
+        parts.extend(_base83(int(q[0] * 361 + q[1] * 19 + q[2]), 2) for q in quantised)
+    return "".join(parts)
+
+
+def _shrink(img: "Image.Image", side: int, resample: int) -> "Image.Image":
+    """img scaled so its longer side is at most `side`."""
+    scale = side / max(img.size)
+    if scale >= 1:
+        return img
+    return img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), resample)
+
+
+def placeholder_file(
+    path: str, components: Tuple[int, int] = (4, 3), lqip_size: int = 16, lqip_quality: int = 40
+) -> Tuple[int, int, Optional[str], Optional[str]]:
+    """
+    Computes what a page needs to lay out and preview an image before it loads.
+
+    The image is decoded once, at a reduced scale where the format allows
+    (JPEG), and shrunk to a few dozen pixels; both placeholders come from that
+    copy. Transparent areas are flattened onto white.
+
+    Args:
+        path: The stored image.
+        components: BlurHash (x, y) components; (0, 0) skips the BlurHash.
+        lqip_size: Longest side of the LQIP in pixels; 0 skips it.
+        lqip_quality: WebP quality of the LQIP.
+
+    Returns:
+        A tuple (width: int, height: int, blurhash: str or None,
+        lqip: data: URI of a tiny WebP or None). The dimensions are the
+        displayed ones, after EXIF orientation.
+
+    Raises:
+        ValueError: If the image cannot be decoded.
+    """
+    import numpy as np
+    from PIL import Image, ImageOps, features
+
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):  # EXIF orientation swaps the axes
+                width, height = height, width
+            sample = max(BLURHASH_SAMPLE_SIZE, lqip_size)
+            img.draft("RGB", (sample * 8, sample * 8))
+            img = ImageOps.exif_transpose(img)
+            if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            else:
+                img = img.convert("RGB")
+            img = _shrink(img, sample, Image.BOX)
+    except Exception as e:
+        raise ValueError(str(e)) from None
+
+    hash_ = None
+    if components[0] > 0 and components[1] > 0:
+        hash_ = blurhash(np.asarray(_shrink(img, BLURHASH_SAMPLE_SIZE, Image.BOX)), *components)
+
+    lqip = None
+    if lqip_size > 0 and features.check("webp"):
+        out = io.BytesIO()
+        _shrink(img, lqip_size, Image.LANCZOS).save(out, "WEBP", quality=lqip_quality, method=6)
+        lqip = "data:image/webp;base64," + base64.b64encode(out.getvalue()).decode("ascii")
+    return width, height, hash_, lqip
+
+
+# --- Lossless PNG optimization ---
+
+# Encoder settings tried on every PNG; the smallest output wins. Pillow picks
+# row filters per zlib strategy (adaptive per-row filtering for its default
+# Z_FILTERED, none for Z_RLE), so trying strategies is also how filters are
+# chosen. Z_RLE is nearly free and wins on flat UI screenshots; a level 9
+# Z_DEFAULT_STRATEGY pass doubled the time for well under 1% on blog-media.
+PNG_ENCODER_TRIALS = (
+    {"optimize": True},
+    {"compress_level": 9, "compress_type": zlib.Z_RLE},
+)
+PNG_OPTIMIZABLE_MODES = ("1", "L", "LA", "P", "RGB", "RGBA")
+
+
+def _pixels_rgba(img: "Image.Image") -> "np.ndarray":
+    import numpy as np
+
+    return np.asarray(img.convert("RGBA"))
+
+
+def _reduce_png_mode(img: "Image.Image") -> "Image.Image":
+    """
+    Returns the smallest pixel format that represents img exactly.
+
+    Drops fully opaque alpha channels, turns images with at most 256 distinct
+    colours into palette images (carrying alpha in the palette), and stores
+    RGB images whose channels are all equal as grayscale.
+    """
+    import numpy as np
+    from PIL import Image
+
+    if img.mode in ("RGBA", "LA"):
+        alpha = img.getchannel("A")
+        if alpha.getextrema() == (255, 255):
+            img = img.convert("RGB" if img.mode == "RGBA" else "L")
+
+    if img.mode not in ("RGB", "RGBA"):
+        return img
+
+    # getcolors() is C and bails out early once there are too many colours
+    if img.getcolors(256) is not None:
+        arr = np.asarray(img)
+        channels = arr.shape[2]
+        colors, inverse = np.unique(arr.reshape(-1, channels), axis=0, return_inverse=True)
+        indexed = Image.fromarray(
+            inverse.reshape(arr.shape[:2]).astype(np.uint8), "P"
+        )
+        indexed.putpalette(colors.astype(np.uint8).tobytes(), img.mode)
+        return indexed
+
+    if img.mode == "RGB":
+        arr = np.asarray(img)
+        if np.array_equal(arr[..., 0], arr[..., 1]) and np.array_equal(arr[..., 1], arr[..., 2]):
+            return img.convert("L")
+
+    return img
+
+
+def optimize_png(data: bytes) -> bytes:
+    """
+    Losslessly recompresses PNG bytes.
+
+    Reduces the pixel format where the colours allow it (see _reduce_png_mode),
+    picks the lowest palette bit depth, encodes with each of
+    PNG_ENCODER_TRIALS at maximum zlib effort and strips ancillary chunks (text, time, EXIF, pHYs).
+    The ICC profile and transparency are kept. The result is decoded and
+    compared pixel for pixel against the input before it is used.
+
+    Returns:
+        The optimized bytes, or `data` unchanged if the input is not a still
+        PNG this can handle or nothing smaller was produced.
+    """
+    import numpy as np
+    from PIL import Image
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.format != "PNG" or getattr(img, "is_animated", False):
+            return data
+        if img.mode not in PNG_OPTIMIZABLE_MODES:
+            return data  # 16-bit and other exotic modes would not survive a round trip
+        gamma = img.info.get("gamma")
+        if gamma is not None and abs(gamma - 1 / 2.2) > 0.001 and "icc_profile" not in img.info:
+            return data  # Pillow cannot write gAMA back, and it changes rendering here
+        img.load()
+
+        reduced = _reduce_png_mode(img)
+        params = {}
+        if img.info.get("icc_profile"):
+            params["icc_profile"] = img.info["icc_profile"]
+        if reduced.mode == "P":
+            colors = len(reduced.getcolors(256) or ())
+            for bits in (1, 2, 4):
+                if 0 < colors <= 1 << bits:
+                    params["bits"] = bits
+                    break
+
+        best = data
+        for trial in PNG_ENCODER_TRIALS:
+            out = io.BytesIO()
+            reduced.save(out, "PNG", **trial, **params)
+            if out.tell() < len(best):
+                best = out.getvalue()
+
+        if best is not data:
+            with Image.open(io.BytesIO(best)) as check:
+                if not np.array_equal(_pixels_rgba(check), _pixels_rgba(img)):
+                    return data
+        return best
+    except Exception:
+        return data
+
+
+def optimize_png_file(path: str) -> Tuple[int, int]:
+    """
+    Runs optimize_png on a file, replacing it only if the result is smaller.
+
+    Returns:
+        A tuple (bytes_before: int, bytes_after: int).
+    """
+    src = Path(path)
+    data = src.read_bytes()
+    optimized = optimize_png(data)
+    if len(optimized) >= len(data):
+        return len(data), len(data)
+    _replace_file(src, optimized)
+    return len(data), len(optimized)
+
+
+# --- Responsive derivatives ---
+
+# format key -> (Pillow format, MIME type)
+DERIVATIVE_FORMATS = {
+    "avif": ("AVIF", "image/avif"),
+    "webp": ("WEBP", "image/webp"),
+}
+# Derivatives live next to their original as <stem>.w<width>.<format>
+DERIVATIVE_NAME_RE = re.compile(r"\.w(\d+)\.(webp|avif)$")
+
+
+def derivative_name(image_name: str, width: int, fmt: str) -> str:
+    stem = image_name.rsplit(".", 1)[0]
+    return f"{stem}.w{width}.{fmt}"
+
+
+def is_derivative_name(name: str) -> bool:
+    return DERIVATIVE_NAME_RE.search(name) is not None
+
+
+def derivative_widths(original_width: int, widths: List[int]) -> List[int]:
+    """Configured widths below the original's, plus the original width itself (never upscale)."""
+    planned = sorted({w for w in widths if 0 < w < original_width})
+    planned.append(original_width)
+    return planned
+
+
+def supported_derivative_formats(formats: List[str]) -> List[str]:
+    """The requested formats this Pillow build can encode."""
+    from PIL import features
+
+    return [
+        fmt
+        for fmt in formats
+        if fmt in DERIVATIVE_FORMATS and features.check(DERIVATIVE_FORMATS[fmt][0].lower())
+    ]
+
+
+def image_info(path: str) -> Tuple[int, int, bool]:
+    """Reads only the image header: (width, height, is_animated)."""
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.width, img.height, bool(getattr(img, "is_animated", False))
+
+
+def write_derivative(src: str, dst: str, width: int, fmt: str, quality: int) -> Tuple[int, int, int]:
+    """
+    Encodes a resized copy of src to dst.
+
+    The file is written under a dot-prefixed temporary name and renamed into
+    place, so directory scans never see a partial derivative.
+
+    Returns:
+        A tuple (width: int, height: int, bytes: int) of the written file.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as img:
+        if width < img.width:
+            # JPEG can decode at a reduced scale straight away
+            img.draft(img.mode, (width, img.height * width // img.width))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            has_alpha = img.mode in ("LA", "PA") or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha else "RGB")
+        if width < img.width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+
+        dst_path = Path(dst)
+        tmp_path = dst_path.with_name(f".{dst_path.name}.tmp")
+        try:
+            img.save(tmp_path, DERIVATIVE_FORMATS[fmt][0], quality=quality)
+            os.replace(tmp_path, dst_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return img.width, img.height, dst_path.stat().st_size
+
+
+# --- On-demand renders ---
+
+# format key -> (Pillow format, MIME type)
+RENDER_FORMATS = {
+    "avif": ("AVIF", "image/avif"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+# Source extension -> render format used when no fmt is requested
+RENDER_SOURCE_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".gif": "png", ".webp": "webp", ".avif": "avif"}
+
+
+def render_geometry(
+    source_width: int, source_height: int, width: int, height: int
+) -> Tuple[Tuple[int, int], Optional[Tuple[int, int, int, int]]]:
+    """
+    Works out the resize (and crop) for a render request.
+
+    A width or height alone scales the image proportionally. Both together
+    scale it to cover that box and centre-crop to it, the usual shape for
+    thumbnails and OG cards. Nothing is upscaled: boxes larger than the
+    source are shrunk, keeping their aspect ratio, until they fit.
+
+    Returns:
+        A tuple (resize_to: (w, h), crop_box: (left, top, right, bottom) or None).
+    """
+    if width and height:
+        shrink = min(1.0, source_width / width, source_height / height)
+        width, height = max(1, int(width * shrink)), max(1, int(height * shrink))
+        scale = max(width / source_width, height / source_height)
+        scaled = (
+            min(source_width, max(width, round(source_width * scale))),
+            min(source_height, max(height, round(source_height * scale))),
+        )
+        left, top = (scaled[0] - width) // 2, (scaled[1] - height) // 2
+        return scaled, (left, top, left + width, top + height)
+    if width:
+        width = min(width, source_width)
+        return (width, max(1, round(source_height * width / source_width))), None
+    if height:
+        height = min(height, source_height)
+        return (max(1, round(source_width * height / source_height)), height), None
+    return (source_width, source_height), None
+
+
+def render_variant(src: str, width: int, height: int, fmt: str, quality: int) -> bytes:
+    """
+    Resizes (see render_geometry) and encodes src for /img. Animated images
+    render their first frame.
+
+    Returns:
+        The encoded bytes.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as img:
+        source_width, source_height = img.size
+        if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):  # EXIF orientation swaps the axes
+            source_width, source_height = source_height, source_width
+        size, crop = render_geometry(source_width, source_height, width, height)
+        # Decode JPEGs at a reduced scale, still at least as large as needed on both axes
+        img.draft(img.mode, (max(size), max(size)))
+        img = ImageOps.exif_transpose(img)
+
+        pil_format = RENDER_FORMATS[fmt][0]
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        if pil_format == "JPEG":
+            if has_alpha:
+                rgba = img.convert("RGBA")
+                flat = Image.new("RGB", rgba.size, (255, 255, 255))
+                flat.paste(rgba, mask=rgba.getchannel("A"))
+                img = flat
+            else:
+                img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if has_alpha else "RGB")
+
+        if img.size != size:
+            img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        if crop is not None:
+            img = img.crop(crop)
+
+        out = io.BytesIO()
+        if pil_format == "PNG":
+            img.save(out, pil_format, optimize=True)
+        else:
+            img.save(out, pil_format, quality=quality)
+        return out.getvalue()
+
+
+def supported_render_formats(formats: List[str]) -> List[str]:
+    """The requested render formats this Pillow build can encode."""
+    from PIL import features
+
+    return [
+        fmt
+        for fmt in formats
+        if fmt in RENDER_FORMATS and (fmt not in DERIVATIVE_FORMATS or features.check(fmt))
+    ]
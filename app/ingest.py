@@ -0,0 +1,309 @@
+"""
+Upload ingestion pipeline for Shotput.
+
+Keeps blocking work off the event loop: disk I/O runs on a bounded thread pool,
+git operations run on a single dedicated thread (so commits never race on
+.git/index.lock), and CPU-heavy image work runs on a process pool. Uploads are
+streamed to disk in fixed-size chunks and validated from their header before
+anything is decoded (stage_upload).
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Optional, Set, Tuple
+import asyncio
+import functools
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+
+from imaging import SNIFF_BYTES, ImageTooLarge, read_image_header, sniff_image_type
+from metrics import UPLOAD_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadRejected(Exception):
+    """An upload that failed validation, with the HTTP status to answer it with."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class StagedUpload:
+    """An upload streamed to a temporary file and validated from its header."""
+
+    path: Path  # Dot-prefixed temporary file next to where the image will be stored
+    sha256: str
+    size: int
+    extension: str
+    width: int
+    height: int
+
+
+def stage_upload(src: BinaryIO, directory: Path, max_bytes: int = 0, max_pixels: int = 0) -> StagedUpload:
+    """
+    Streams an upload into a temporary file in `directory`, hashing it on the way.
+
+    Only UPLOAD_CHUNK_SIZE bytes are held in memory at a time. The format is
+    sniffed from the first chunk's magic bytes (so non-images are rejected
+    before the rest is copied), the byte limit is enforced while copying, and
+    the dimensions come from the header alone, so the pixel limit is checked
+    before anything is decoded. The caller renames the file into place (or
+    deletes it); on any error it is removed here.
+
+    Args:
+        src: Readable binary file object, e.g. UploadFile.file.
+        directory: Where to stage; the final name should be on the same filesystem.
+        max_bytes: Largest accepted upload in bytes (0 disables the check).
+        max_pixels: Largest accepted width * height (0 disables the check).
+
+    Raises:
+        UploadRejected: 413 for uploads over a limit, 415 for unknown formats
+            and 400 for files whose header cannot be parsed.
+    """
+    tmp_path = directory / f".upload-{uuid.uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    extension = None
+    try:
+        with UPLOAD_STAGE_SECONDS.time(stage="receive"), open(tmp_path, "wb") as out:
+            while True:
+                chunk = src.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if extension is None:
+                    extension = check_image_type(chunk)
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadRejected(413, f"Upload exceeds the limit of {max_bytes} bytes.")
+                digest.update(chunk)
+                out.write(chunk)
+        if extension is None:
+            raise UploadRejected(400, "Empty upload.")
+        width, height = validate_image_header(tmp_path, max_pixels)
+        return StagedUpload(tmp_path, digest.hexdigest(), size, extension, width, height)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def check_image_type(head: bytes) -> str:
+    """
+    The file extension for an upload starting with `head` (at least SNIFF_BYTES
+    bytes, unless the upload is shorter).
+
+    Raises:
+        UploadRejected: 415 if it is not a supported image format.
+    """
+    extension = sniff_image_type(head[:SNIFF_BYTES])
+    if extension is None:
+        raise UploadRejected(415, "Unsupported file type. Upload a PNG, JPEG, GIF, WebP, AVIF or HEIC image.")
+    return extension
+
+
+def validate_image_header(path: Path, max_pixels: int = 0) -> Tuple[int, int]:
+    """
+    Reads the dimensions of a fully received upload from its header alone.
+
+    Returns:
+        (width, height)
+
+    Raises:
+        UploadRejected: 413 over the pixel limit, 400 for unparseable headers.
+    """
+    try:
+        with UPLOAD_STAGE_SECONDS.time(stage="validate"):
+            _, width, height = read_image_header(str(path))
+    except ImageTooLarge as e:
+        raise UploadRejected(413, f"Image has too many pixels: {e}")
+    except ValueError as e:
+        raise UploadRejected(400, f"Invalid or unsupported image file: {e}")
+    if max_pixels and width * height > max_pixels:
+        raise UploadRejected(
+            413, f"Image is {width}x{height}, more than the limit of {max_pixels} pixels."
+        )
+    return width, height
+
+
+@dataclass
+class Job:
+    """State of an asynchronous upload, as reported by /jobs/{id}."""
+
+    job_id: str
+    status: str = "queued"  # queued -> running -> done | failed
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "status_code": self.status_code,
+        }
+
+
+class JobRegistry:
+    """
+    Bounded in-memory registry of upload jobs.
+
+    Once more than max_jobs are tracked, the oldest finished jobs are forgotten.
+    Jobs that are still queued or running are never evicted.
+    """
+
+    def __init__(self, max_jobs: int = 1000):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def create(self) -> Job:
+        job = Job(job_id=uuid.uuid4().hex)
+        self._jobs[job.job_id] = job
+        self._evict()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def _evict(self):
+        if len(self._jobs) <= self.max_jobs:
+            return
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id].status in ("done", "failed"):
+                del self._jobs[job_id]
+
+
+class IngestPipeline:
+    """
+    Bounded worker pools used by the upload path.
+
+    Args:
+        io_workers: Threads for blocking file I/O.
+        cpu_workers: Processes for CPU-heavy image work (0 means os.cpu_count()).
+        max_jobs: How many async upload jobs to remember for /jobs/{id}.
+    """
+
+    def __init__(self, io_workers: int = 4, cpu_workers: int = 2, max_jobs: int = 1000):
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=max(1, io_workers), thread_name_prefix="shotput-io"
+        )
+        # A single thread serializes every git operation made by this process
+        self.git_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="shotput-git"
+        )
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.cpu_executor = self._new_cpu_executor()
+        self.jobs = JobRegistry(max_jobs)
+        self._tasks: Set["asyncio.Task[Any]"] = set()
+
+    def _new_cpu_executor(self) -> ProcessPoolExecutor:
+        # "spawn" avoids forking a process that already runs the event loop and
+        # worker threads; workers only need to import the imaging module.
+        return ProcessPoolExecutor(
+            max_workers=self.cpu_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    async def _run(self, executor, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    async def run_io(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        return await self._run(self.io_executor, fn, *args, **kwargs)
+
+    async def run_git(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        return await self._run(self.git_executor, fn, *args, **kwargs)
+
+    async def run_cpu(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs fn in the image worker processes.
+
+        A worker that dies (killed by the OOM killer, a crash in a decoder)
+        breaks the whole pool, and every later call would fail. The broken
+        pool is replaced and the call is retried once; a second failure is
+        raised, so an image that kills its worker every time is not retried
+        forever.
+
+        Raises:
+            BrokenProcessPool: The worker died again on the retry.
+        """
+        executor = self.cpu_executor
+        try:
+            return await self._run(executor, fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # Calls that shared the broken pool all land here; replace it once
+            if self.cpu_executor is executor:
+                logger.warning("An image worker process died; restarting the worker pool")
+                self.cpu_executor = self._new_cpu_executor()
+                executor.shutdown(wait=False, cancel_futures=True)
+            return await self._run(self.cpu_executor, fn, *args, **kwargs)
+
+    def submit_job(
+        self,
+        work: Callable[[], Awaitable[Dict[str, Any]]],
+        error_info: Callable[[BaseException], Tuple[int, str]],
+    ) -> Job:
+        """
+        Runs work() in the background and tracks it as a Job.
+
+        Args:
+            work: Coroutine factory producing the JSON result of the upload.
+            error_info: Maps an exception raised by work() to (status_code, detail).
+        """
+        job = self.jobs.create()
+
+        async def runner():
+            job.status = "running"
+            try:
+                job.result = await work()
+                job.status = "done"
+                job.status_code = 200
+            except Exception as e:
+                job.status = "failed"
+                job.status_code, job.error = error_info(e)
+                logger.error(f"Upload job {job.job_id} failed: {job.error}")
+            finally:
+                job.finished_at = time.time()
+
+        task = asyncio.get_running_loop().create_task(runner())
+        # Keep a strong reference until the task finishes
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Tasks waiting for a free worker in each pool (read by /metrics)."""
+        cpu_tasks = len(getattr(self.cpu_executor, "_pending_work_items", ()))
+        return {
+            "io": self.io_executor._work_queue.qsize(),
+            "git": self.git_executor._work_queue.qsize(),
+            "cpu": max(0, cpu_tasks - self.cpu_executor._max_workers),
+        }
+
+    def shutdown(self):
+        # Drops queued image work but waits for what the worker processes are
+        # running; without waiting they outlive the server as orphans, still busy
+        self.cpu_executor.shutdown(wait=True, cancel_futures=True)
+        self.io_executor.shutdown(wait=True)
+        self.git_executor.shutdown(wait=True)
@@ -0,0 +1,321 @@
+"""
+Persistent manifest of the images under IMAGE_SUB_DIR.
+
+One SQLite row per stored image (bytes, dimensions, format, SHA-256 of the
+stored file, upload time, the commit that added it and its placeholders), so
+listing and browsing are indexed queries instead of directory walks and image
+decodes. Uploads add their row directly; the startup bootstrap only reads the
+headers of files whose size or mtime changed, and takes upload times and
+commit SHAs from a single `git log` pass over the image directory. Placeholders
+(BlurHash and LQIP) are only computed at upload, so rows added by the
+bootstrap have none.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import base64
+import itertools
+import logging
+import os
+import threading
+
+import git
+
+from hash_index import sha256_file
+from imaging import read_image_header
+import statedb
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif"}
+COLUMNS = ("name", "bytes", "width", "height", "format", "sha256", "uploaded_at", "commit_sha", "blurhash", "lqip")
+
+
+def encode_cursor(uploaded_at: float, name: str) -> str:
+    return base64.urlsafe_b64encode(f"{uploaded_at!r}|{name}".encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Raises ValueError for cursors this module did not produce."""
+    try:
+        uploaded_at, name = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+        return float(uploaded_at), name
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from None
+
+
+def upload_time_from_name(name: str) -> Optional[float]:
+    """Upload time encoded in Shotput's <YYYYmmddHHMMSS>_<id> names, if present."""
+    try:
+        return datetime.strptime(name[:14], "%Y%m%d%H%M%S").timestamp()
+    except ValueError:
+        return None
+
+
+def git_added_files(git_dir: Path, ref: str, rel_dir: str) -> Dict[str, Tuple[str, float]]:
+    """
+    Maps every file ever added under rel_dir on ref to (commit SHA, commit time)
+    of the commit that first added it, in one `git log` pass.
+    """
+    repo = git.Repo(git_dir)
+    try:
+        output = repo.git.log(
+            ref, "--format=%x00%H %ct", "--name-only", "--diff-filter=A", "--no-renames", "--", rel_dir
+        )
+    except git.GitCommandError:
+        return {}  # Unborn branch
+    added: Dict[str, Tuple[str, float]] = {}
+    commit = None
+    for line in output.splitlines():
+        if line.startswith("\x00"):
+            sha, timestamp = line[1:].split()
+            commit = (sha, float(timestamp))
+        elif line and commit is not None:
+            # Newest first, so the oldest add (the upload) wins
+            added[line.rsplit("/", 1)[-1]] = commit
+    return added
+
+
+class MediaManifest:
+    """
+    Manifest of one image directory.
+
+    Args:
+        db_path: SQLite database file (created if missing).
+        image_dir: Directory whose images are listed (not recursive).
+        ignore: Predicate for file names to leave out (e.g. derivatives).
+    """
+
+    def __init__(
+        self, db_path: Path, image_dir: Path, ignore: Optional[Callable[[str], bool]] = None
+    ):
+        self.image_dir = image_dir
+        self.ignore = ignore
+        self._lock = threading.Lock()
+        self._db = statedb.connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " name TEXT PRIMARY KEY, bytes INTEGER NOT NULL,"
+            " width INTEGER, height INTEGER, format TEXT, sha256 TEXT NOT NULL,"
+            " uploaded_at REAL NOT NULL, commit_sha TEXT, mtime_ns INTEGER NOT NULL,"
+            " blurhash TEXT, lqip TEXT)"
+        )
+        # Manifests created before placeholders existed
+        existing = {row[1] for row in self._db.execute("PRAGMA table_info(images)")}
+        for column in ("blurhash", "lqip"):
+            if column not in existing:
+                self._db.execute(f"ALTER TABLE images ADD COLUMN {column} TEXT")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS images_by_upload ON images (uploaded_at DESC, name DESC)"
+        )
+        # The bootstrap runs in one worker process; the others read its state here
+        self._db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    @property
+    def bootstrap_complete(self) -> bool:
+        """Whether the last bootstrap, in whichever process ran it, finished."""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM state WHERE key = 'bootstrap'").fetchone()
+        return row is not None and row[0] == "complete"
+
+    def _set_bootstrap_state(self, value: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('bootstrap', ?)", (value,))
+            self._db.commit()
+
+    def add(
+        self,
+        name: str,
+        size: int,
+        width: Optional[int],
+        height: Optional[int],
+        image_format: Optional[str],
+        sha256: str,
+        uploaded_at: float,
+        commit_sha: Optional[str],
+        mtime_ns: int,
+        blurhash: Optional[str] = None,
+        lqip: Optional[str] = None,
+    ):
+        self.add_many(
+            [(name, size, width, height, image_format, sha256, uploaded_at, commit_sha, mtime_ns, blurhash, lqip)]
+        )
+
+    def add_many(self, rows: Iterable[tuple]):
+        """Records rows in one transaction; each row holds the arguments of add() in order."""
+        rows = list(rows)
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO images"
+                " (name, bytes, width, height, format, sha256, uploaded_at, commit_sha, mtime_ns, blurhash, lqip)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+
+    def add_file(
+        self, path: Path, uploaded_at: float, commit_sha: Optional[str], placeholder: Optional[dict] = None
+    ):
+        """
+        Records a file that was just stored and committed; reads only its header.
+
+        Args:
+            placeholder: The upload's width, height (as displayed, taking
+                precedence over the header's), blurhash and lqip, if computed.
+        """
+        st = path.stat()
+        try:
+            image_format, width, height = read_image_header(str(path))
+        except ValueError:
+            image_format, width, height = None, None, None
+        placeholder = placeholder or {}
+        self.add(
+            path.name, st.st_size, placeholder.get("width", width), placeholder.get("height", height),
+            image_format, sha256_file(path), uploaded_at, commit_sha, st.st_mtime_ns,
+            blurhash=placeholder.get("blurhash"), lqip=placeholder.get("lqip"),
+        )
+
+    def remove(self, name: str):
+        self.remove_many([name])
+
+    def remove_many(self, names: Iterable[str]):
+        names = list(names)
+        with self._lock:
+            self._db.executemany("DELETE FROM images WHERE name = ?", [(name,) for name in names])
+            self._db.commit()
+
+    def get(self, name: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM images WHERE name = ?", (name,)
+            ).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def page(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """
+        Lists images newest first, with keyset pagination on (uploaded_at, name),
+        so every page is an index range scan however deep it is.
+
+        Returns:
+            A tuple (images: List[dict], next_cursor: Optional[str]).
+
+        Raises:
+            ValueError: If cursor is malformed.
+        """
+        query = f"SELECT {', '.join(COLUMNS)} FROM images"
+        params: list = []
+        if cursor:
+            query += " WHERE (uploaded_at, name) < (?, ?)"
+            params += list(decode_cursor(cursor))
+        query += " ORDER BY uploaded_at DESC, name DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        images = [dict(zip(COLUMNS, row)) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = images[-1]
+            next_cursor = encode_cursor(last["uploaded_at"], last["name"])
+        return images, next_cursor
+
+    def bootstrap(
+        self,
+        git_dir: Optional[Path] = None,
+        ref: str = "HEAD",
+        rel_dir: str = "",
+        max_workers: int = 4,
+        batch_size: int = 512,
+    ) -> Tuple[int, int]:
+        """
+        Brings the manifest in line with image_dir.
+
+        Files whose size and mtime match their row are skipped. For the rest
+        the header and SHA-256 are read on a thread pool, and the upload time
+        and commit come from the commit that added the file (falling back to
+        the time in the file name, then the mtime, for files not in git yet).
+        Rows of files that no longer exist are dropped. Progress is committed
+        every batch_size files, each batch in one transaction once all of it
+        has been read.
+
+        Args:
+            git_dir: Repository to read history from (None skips git).
+            ref: Branch the images are committed to.
+            rel_dir: image_dir relative to the repository root.
+
+        Returns:
+            A tuple (files_seen: int, files_indexed: int).
+        """
+        if not self.image_dir.is_dir():
+            self._set_bootstrap_state("complete")
+            return 0, 0
+
+        self._set_bootstrap_state("running")
+        with self._lock:
+            known = {
+                name: (size, mtime_ns)
+                for name, size, mtime_ns in self._db.execute("SELECT name, bytes, mtime_ns FROM images")
+            }
+        seen = set()
+        stale = []
+        with os.scandir(self.image_dir) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.startswith("."):
+                    continue
+                if self.ignore is not None and self.ignore(entry.name):
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                seen.add(entry.name)
+                st = entry.stat()
+                if known.get(entry.name) == (st.st_size, st.st_mtime_ns):
+                    continue
+                stale.append((entry.name, st.st_size, st.st_mtime_ns, st.st_mtime))
+
+        added = {}
+        if stale and git_dir is not None:
+            try:
+                added = git_added_files(git_dir, ref, rel_dir)
+            except Exception as e:
+                logger.warning(f"Could not read upload history from git: {e}")
+
+        def describe(item):
+            name, size, mtime_ns, mtime = item
+            path = self.image_dir / name
+            try:
+                image_format, width, height = read_image_header(str(path))
+            except ValueError:
+                image_format, width, height = None, None, None
+            commit_sha, uploaded_at = added.get(name, (None, None))
+            if uploaded_at is None:
+                uploaded_at = upload_time_from_name(name) or mtime
+            return (
+                name, size, width, height, image_format, sha256_file(path), uploaded_at, commit_sha, mtime_ns,
+                None, None,  # Placeholders are only computed at upload
+            )
+
+        indexed = 0
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="shotput-manifest") as pool:
+            rows = pool.map(describe, stale)
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                self.add_many(batch)
+                indexed += len(batch)
+                logger.info(f"Manifest bootstrap: {indexed}/{len(stale)} images indexed")
+
+        self.remove_many(set(known) - seen)
+
+        self._set_bootstrap_state("complete")
+        return len(seen), indexed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,281 @@
+"""
+Prometheus-style metrics for Shotput, without a client library.
+
+Counters, gauges and histograms keep plain numbers behind one lock per metric
+and are only formatted when /metrics is scraped, so recording a value on the
+upload path costs a dict lookup, a bisect and a few additions. Gauges that
+describe state held elsewhere (queue lengths) are read through a callback at
+scrape time instead of being updated on the hot path.
+
+The metrics of the upload path are module-level objects, so any module can
+record into them without plumbing a registry around.
+"""
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upload stages take from sub-millisecond (hash lookups) to tens of seconds (slow pushes)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """The metric's sample lines in the text exposition format."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {} if labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+    ):
+        """
+        Args:
+            function: Computes the values at scrape time instead of set/inc/dec,
+                as {label values: value} (use () as the key without labels).
+        """
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {} if labelnames else {(): 0}
+        self.function = function
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels: str) -> Iterator[None]:
+        """Counts the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self) -> List[str]:
+        if self.function is not None:
+            try:
+                values = dict(self.function())
+            except Exception:
+                values = {}  # The source is gone (e.g. during shutdown); skip the samples
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+            for key, v in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._data: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        self._observe(self._key(labels), value)
+
+    def _observe(self, key: LabelValues, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                data = self._data[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            data[0][index] += 1
+            data[1][0] += value
+
+    def time(self, **labels: str) -> "_Timer":
+        """Context manager observing the wall time of the block, whether or not it raises."""
+        return _Timer(self, self._key(labels))
+
+    def count(self, **labels: str) -> int:
+        data = self._data.get(self._key(labels))
+        return sum(data[0]) if data else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._data.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    # A plain class rather than @contextmanager: no generator per timed block
+    __slots__ = ("histogram", "key", "start")
+
+    def __init__(self, histogram: Histogram, key: LabelValues):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.histogram._observe(self.key, time.perf_counter() - self.start)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """The Prometheus text exposition format of every metric."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Upload path ---
+
+UPLOAD_STAGE_SECONDS = Histogram(
+    "shotput_upload_stage_seconds",
+    "Time spent in each stage of an upload.",
+    ["stage"],
+)
+UPLOADS = Counter(
+    "shotput_uploads_total",
+    "Uploads by outcome (stored, duplicate, rejected, failed).",
+    ["outcome"],
+)
+UPLOAD_BYTES = Counter("shotput_upload_bytes_total", "Bytes received in uploads that passed validation.")
+STORED_BYTES = Counter("shotput_stored_bytes_total", "Bytes written to the image directory (originals and derivatives).")
+DEDUP_HITS = Counter(
+    "shotput_dedup_hits_total",
+    "Uploads answered with an existing image (index: already stored, inflight: identical concurrent upload).",
+    ["source"],
+)
+UPLOADS_IN_FLIGHT = Gauge("shotput_uploads_in_flight", "Uploads being processed right now.")
+UPLOADS_SHED = Counter(
+    "shotput_uploads_shed_total",
+    "Uploads refused by admission control, by limit (decodes, commits, bytes: 503; rate: 429).",
+    ["reason"],
+)
+# Read at scrape time; the server sets their functions on startup
+UPLOADS_QUEUED = Gauge("shotput_uploads_queued", "Stored uploads waiting for their commit.")
+WORKER_QUEUE_DEPTH = Gauge(
+    "shotput_worker_queue_depth", "Tasks waiting for a free worker, by pool (io, git, cpu).", ["pool"]
+)
+
+# --- Git ---
+
+GIT_STAGE_SECONDS = Histogram(
+    "shotput_git_stage_seconds",
+    "Time spent in each git operation (add: hashing files into objects, commit, push, fetch, rebase).",
+    ["stage"],
+)
+COMMITS = Counter("shotput_commits_total", "Commits written, by result.", ["result"])
+COMMIT_BATCH_UPLOADS = Histogram(
+    "shotput_commit_batch_uploads",
+    "Uploads grouped into each commit.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+PUSHES = Counter("shotput_pushes_total", "Pushes, by result (ok, failed, rejected).", ["result"])
+REBASES = Counter(
+    "shotput_rebases_total",
+    "Local commits moved onto a remote that got ahead, by result (ok, conflict, failed).",
+    ["result"],
+)
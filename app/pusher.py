@@ -0,0 +1,409 @@
+"""
+Background pushing for Shotput.
+
+Uploads only wait for the local commit. The BackgroundPusher is told about
+every commit and pushes the branch from its own thread: pushes are debounced
+(a burst of commits becomes one push), failures and rejections are retried
+with exponential backoff, and the outcome is kept for /push_status instead of
+being folded into an upload's message string.
+
+Ahead/behind counts are taken against refs/remotes/<remote>/<branch>, which is
+moved after every successful push and refreshed with a fetch when a push is
+rejected, so they are correct for bare repositories without fetch refspecs too.
+
+When several Shotput instances push to one remote, a rejected push is followed
+by a rebase of the local commits onto the fetched remote branch (see
+PlumbingCommitter.rebase_onto) and another push, a few times with a short
+jittered backoff. A periodic fetch keeps the local branch close to the remote
+so that this is rarely needed. A push round and a periodic fetch-and-rebase
+never overlap: a rebase that moved the branch during a push would leave the
+tracking ref claiming the remote has commits it never received.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+import asyncio
+import logging
+import random
+import time
+
+import git
+
+from gitstore import RebaseConflict
+from metrics import GIT_STAGE_SECONDS, PUSHES, REBASES
+
+logger = logging.getLogger(__name__)
+
+# Markers in `git push` output for a push the remote refused because it has
+# commits we do not (as opposed to a network or auth failure). "cannot lock
+# ref" is another writer's push landing while ours was in flight.
+REJECTION_MARKERS = ("[rejected]", "non-fast-forward", "fetch first", "stale info", "cannot lock ref")
+
+
+def _git_output(e: git.GitCommandError) -> str:
+    # GitPython wraps the streams as "\n  stderr: '...'"
+    for stream in (e.stderr, e.stdout):
+        text = (stream or "").strip()
+        for prefix in ("stderr: '", "stdout: '"):
+            if text.startswith(prefix) and text.endswith("'"):
+                text = text[len(prefix) : -1].strip()
+        if text:
+            return text
+    return str(e)
+
+
+class PushFailed(Exception):
+    """A push that did not update the remote branch."""
+
+    def __init__(self, message: str, rejected: bool = False):
+        super().__init__(message)
+        self.rejected = rejected
+
+
+class BackgroundPusher:
+    """
+    Pushes one branch to a remote in the background.
+
+    Args:
+        git_dir: The repository (bare or not) that commits are written to.
+        remote: Remote to push to.
+        branch: Branch to push. Defaults to whatever HEAD points at.
+        debounce_ms: Push once no commit has arrived for this long...
+        max_delay_ms: ...or once the oldest unpushed commit is this old.
+        retry_initial_s: Delay before the first retry of a failed push.
+        retry_max_s: Cap of the exponential backoff.
+        rebase: Async callable (upstream ref) -> (new tip or None, commits
+            replayed) that moves the local commits onto the remote branch, run
+            where commits are made (PlumbingCommitter.rebase_onto on the git
+            thread). Without it, rejected pushes are only retried.
+        rebase_attempts: Rebases (and pushes) per push round before falling
+            back to the backoff of failed pushes.
+        fetch_interval_s: Fetch (and rebase onto) the remote branch this often;
+            0 only fetches after a rejected push.
+    """
+
+    def __init__(
+        self,
+        git_dir: Path,
+        remote: str = "origin",
+        branch: Optional[str] = None,
+        debounce_ms: int = 1000,
+        max_delay_ms: int = 10000,
+        retry_initial_s: float = 2.0,
+        retry_max_s: float = 300.0,
+        rebase: Optional[Callable[[str], Awaitable[Tuple[Optional[str], int]]]] = None,
+        rebase_attempts: int = 5,
+        fetch_interval_s: float = 0,
+    ):
+        self.git_dir = git_dir
+        self.remote = remote
+        self.debounce = max(0, debounce_ms) / 1000
+        self.max_delay = max(self.debounce, max_delay_ms / 1000)
+        self.retry_initial = max(0.1, retry_initial_s)
+        self.retry_max = max(self.retry_initial, retry_max_s)
+        self.rebase = rebase
+        self.rebase_attempts = max(0, rebase_attempts)
+        self.fetch_interval = max(0, fetch_interval_s)
+
+        repo = git.Repo(git_dir)
+        self.ref = f"refs/heads/{branch}" if branch else repo.head.reference.path
+        repo.close()
+        self.tracking_ref = f"refs/remotes/{remote}/{self.branch}"
+
+        # All pushes and fetches run on this thread, never on the git commit thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shotput-push")
+        self._repo: Optional[git.Repo] = None  # Only touched on the push thread
+        self._wakeup = asyncio.Event()
+        # Held by a whole push round (pushes and rebases) or periodic fetch and rebase
+        self._lock = asyncio.Lock()
+        self._task: "Optional[asyncio.Task[None]]" = None
+        self._fetch_task: "Optional[asyncio.Task[None]]" = None
+        self._first_pending: Optional[float] = None
+        self._last_commit: Optional[float] = None
+
+        self.pushing = False
+        self.pushes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_push_at: Optional[float] = None  # Last successful push (wall clock)
+        self.last_pushed_sha: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.last_error_at: Optional[float] = None
+        self.next_retry_at: Optional[float] = None
+        self.rebases = 0
+        self.last_rebase_at: Optional[float] = None
+        self.last_fetch_at: Optional[float] = None
+
+    @property
+    def branch(self) -> str:
+        return self.ref[len("refs/heads/") :]
+
+    def start(self):
+        """Starts the push loop; commits made before a restart are pushed right away."""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        if self.fetch_interval:
+            self._fetch_task = asyncio.get_running_loop().create_task(self._fetch_loop())
+        self._first_pending = self._last_commit = time.monotonic() - self.max_delay
+        self._wakeup.set()
+
+    def notify(self, commit_sha: Optional[str] = None):
+        """Called after every local commit; schedules a (debounced) push."""
+        now = time.monotonic()
+        if self._first_pending is None:
+            self._first_pending = now
+        self._last_commit = now
+        self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+
+            # Debounce: wait for a quiet period, bounded by max_delay
+            while True:
+                now = time.monotonic()
+                wait = min(
+                    self._last_commit + self.debounce - now,
+                    self._first_pending + self.max_delay - now,
+                )
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            # Only now: commits notified while debouncing are part of this push
+            self._wakeup.clear()
+            self._first_pending = None
+            self.pushing = True
+            try:
+                async with self._lock:
+                    sha = await self._push_rebasing()
+                    moved = sha is not None and await loop.run_in_executor(self._executor, self._tip) != sha
+            except Exception as e:
+                self.pushing = False
+                self._record_failure(e)
+                delay = min(self.retry_initial * 2 ** (self.consecutive_failures - 1), self.retry_max)
+                delay *= random.uniform(0.8, 1.2)  # Keep several servers from retrying in lockstep
+                self.next_retry_at = time.time() + delay
+                logger.warning(
+                    f"Push of {self.branch} to {self.remote} failed "
+                    f"({self.consecutive_failures} in a row), retrying in {delay:.1f}s: {self.last_error}"
+                )
+                await asyncio.sleep(delay)
+                self.next_retry_at = None
+                if self._first_pending is None:
+                    self._first_pending = self._last_commit = time.monotonic() - self.max_delay
+                self._wakeup.set()
+                continue
+
+            self.pushing = False
+            self.consecutive_failures = 0
+            if sha is not None:
+                self.pushes += 1
+                self.last_push_at = time.time()
+                self.last_pushed_sha = sha
+                logger.info(f"Pushed {self.branch} to {self.remote} at {sha[:12]}")
+                if moved:
+                    self.notify()  # Committed or rebased onto while pushing
+
+    async def _push_rebasing(self) -> Optional[str]:
+        """
+        Pushes; while the remote rejects the push for being ahead, rebases onto
+        it (the rejected push fetched it) and pushes again.
+
+        Raises:
+            PushFailed: As _push, once rebase_attempts are used up or when the
+                local commits conflict with the remote's.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.rebase_attempts + 1):
+            if attempt > 1:
+                # Another instance is pushing right now too; do not retry in lockstep
+                await asyncio.sleep(min(0.1 * 2 ** (attempt - 1), 2.0) * random.uniform(0.5, 1.5))
+            try:
+                return await loop.run_in_executor(self._executor, self._push)
+            except PushFailed as e:
+                if not e.rejected or self.rebase is None or attempt == self.rebase_attempts:
+                    raise
+            logger.info(f"Push of {self.branch} rejected, rebasing onto {self.tracking_ref} (attempt {attempt + 1})")
+            await self._rebase()
+        return None
+
+    async def _rebase(self) -> bool:
+        """
+        Moves the local commits onto the fetched remote branch.
+
+        Returns:
+            Whether the local branch moved.
+
+        Raises:
+            PushFailed: If they conflict with the remote's commits. Other
+                failures (e.g. a commit landing meanwhile) are only logged; the
+                next push or fetch tries again.
+        """
+        try:
+            with GIT_STAGE_SECONDS.time(stage="rebase"):
+                new_tip, replayed = await self.rebase(self.tracking_ref)
+        except RebaseConflict as e:
+            REBASES.inc(result="conflict")
+            raise PushFailed(f"Cannot rebase {self.branch} onto {self.tracking_ref} without a merge: {e}", rejected=True) from None
+        except Exception as e:
+            REBASES.inc(result="failed")
+            logger.warning(f"Rebase of {self.branch} onto {self.tracking_ref} failed: {e}")
+            return False
+        if new_tip is None:
+            return False
+        REBASES.inc(result="ok")
+        self.rebases += 1
+        self.last_rebase_at = time.time()
+        return True
+
+    async def _fetch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.fetch_interval * random.uniform(0.9, 1.1))
+            if self._lock.locked():
+                continue  # A push in flight fetches by itself if it needs to
+            try:
+                async with self._lock:
+                    behind = await loop.run_in_executor(self._executor, self._fetch_behind)
+                    if behind and self.rebase is not None and await self._rebase():
+                        self.notify()  # The rebased commits still have to be pushed
+            except Exception as e:
+                logger.warning(f"Periodic fetch from {self.remote} failed: {e}")
+
+    def _fetch_behind(self) -> int:
+        """Fetches the remote branch; returns how many commits the local branch lacks."""
+        if not self._fetch():
+            return 0
+        return self.ahead_behind()[1] or 0
+
+    def _record_failure(self, e: Exception):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = str(e)
+        self.last_error_at = time.time()
+
+    def _git(self) -> git.Repo:
+        if self._repo is None:
+            self._repo = git.Repo(self.git_dir)
+        return self._repo
+
+    def _tip(self) -> str:
+        return self._git().git.rev_parse("--verify", "-q", self.ref)
+
+    def _push(self) -> Optional[str]:
+        """
+        Pushes the branch tip if the remote does not have it yet.
+
+        Returns:
+            The pushed commit SHA, or None if there was nothing to push.
+
+        Raises:
+            PushFailed: If the push failed (rejected=True if the remote is ahead).
+        """
+        repo = self._git()
+        tip = self._tip()
+        try:
+            tracked = repo.git.rev_parse("--verify", "-q", self.tracking_ref)
+        except git.GitCommandError:
+            tracked = None
+        if tip == tracked:
+            return None
+        try:
+            with GIT_STAGE_SECONDS.time(stage="push"):
+                # The SHA read above, not the ref: a commit landing meanwhile is not
+                # in what the tracking ref records as pushed
+                repo.git.push("--porcelain", self.remote, f"{tip}:{self.ref}")
+        except git.GitCommandError as e:
+            output = f"{e.stdout}\n{e.stderr}"
+            rejected = any(marker in output for marker in REJECTION_MARKERS)
+            PUSHES.inc(result="rejected" if rejected else "failed")
+            if rejected:
+                # Learn how far behind we are and what to rebase onto
+                self._fetch()
+            detail = _git_output(e)
+            raise PushFailed(
+                f"Push rejected by {self.remote} (the remote has commits this repository does not): {detail}"
+                if rejected
+                else f"Push to {self.remote} failed: {detail}",
+                rejected=rejected,
+            ) from None
+        PUSHES.inc(result="ok")
+        repo.git.update_ref("-m", f"push to {self.remote}", self.tracking_ref, tip)
+        return tip
+
+    def _fetch(self) -> bool:
+        try:
+            with GIT_STAGE_SECONDS.time(stage="fetch"):
+                self._git().git.fetch(self.remote, f"+{self.ref}:{self.tracking_ref}")
+        except git.GitCommandError as e:
+            logger.warning(f"Fetch from {self.remote} failed: {_git_output(e)}")
+            return False
+        self.last_fetch_at = time.time()
+        return True
+
+    def ahead_behind(self) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Counts commits on the branch the remote does not have, and the reverse,
+        as of the last push or fetch. Blocking; runs its own git process.
+        """
+        g = git.Git(str(self.git_dir))
+        try:
+            g.rev_parse("--verify", "-q", self.tracking_ref)
+        except git.GitCommandError:
+            try:
+                return int(g.rev_list("--count", self.ref)), None
+            except git.GitCommandError:
+                return 0, None  # Unborn branch
+        behind, ahead = g.rev_list("--left-right", "--count", f"{self.tracking_ref}...{self.ref}").split()
+        return int(ahead), int(behind)
+
+    def status(self) -> dict:
+        """Push state for /push_status (blocking: counts commits with git)."""
+        try:
+            ahead, behind = self.ahead_behind()
+        except Exception as e:
+            logger.warning(f"Could not count unpushed commits: {e}")
+            ahead, behind = None, None
+        return {
+            "enabled": True,
+            "remote": self.remote,
+            "branch": self.branch,
+            "ahead": ahead,
+            "behind": behind,
+            "pushing": self.pushing,
+            "pushes": self.pushes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_push_at": self.last_push_at,
+            "last_pushed_sha": self.last_pushed_sha,
+            "last_error": self.last_error,
+            "last_error_at": self.last_error_at,
+            "next_retry_at": self.next_retry_at,
+            "rebases": self.rebases,
+            "last_rebase_at": self.last_rebase_at,
+            "last_fetch_at": self.last_fetch_at,
+        }
+
+    async def close(self, timeout: float = 10.0):
+        """Stops the loop and makes one last attempt to push what is pending."""
+        if self._fetch_task is not None:
+            self._fetch_task.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        loop = asyncio.get_running_loop()
+
+        async def final_push():
+            async with self._lock:
+                return await loop.run_in_executor(self._executor, self._push)
+
+        try:
+            await asyncio.wait_for(final_push(), timeout)
+        except Exception as e:
+            logger.warning(f"Final push before shutdown did not complete: {e}")
+        self._executor.shutdown(wait=False)
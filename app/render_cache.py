@@ -0,0 +1,185 @@
+"""
+Two-tier cache for images rendered on demand by /img/{name}.
+
+Small encodes are kept in an in-memory LRU bounded by total bytes; every encode
+is also written to a directory bounded by total bytes, evicting the least
+recently used files first. Neither tier is ever committed to git. The disk tier
+survives restarts: existing files are picked up (oldest access first) on startup.
+
+A RenderCache is owned by one process. With several workers, each claims its
+own subdirectory (see claim_worker_dir), so the byte budgets apply per worker.
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import hashlib
+import itertools
+import logging
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: a single process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Lock file descriptors of the directories this process claimed; kept open for
+# the process lifetime, so the lock is released only when the process exits
+_claimed: Dict[Path, Tuple[Path, int]] = {}
+
+
+def claim_worker_dir(parent: Path) -> Path:
+    """
+    Claims a cache directory under `parent` that no other running process uses.
+
+    Workers take the lowest free slot (parent/worker-0, worker-1, ...) by
+    locking its lock file, so a restarted worker picks up a cache a previous
+    worker left behind. Repeated calls in one process return the same directory.
+    """
+    if parent in _claimed:
+        return _claimed[parent][0]
+    parent.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        return parent / "worker-0"
+    for slot in itertools.count():
+        fd = os.open(parent / f"worker-{slot}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            continue
+        cache_dir = parent / f"worker-{slot}"
+        _claimed[parent] = (cache_dir, fd)
+        return cache_dir
+
+
+class RenderCache:
+    """
+    Byte-bounded memory + disk cache of encoded images.
+
+    Args:
+        cache_dir: Directory for the disk tier (created if missing).
+        max_disk_bytes: Total size of the disk tier.
+        max_memory_bytes: Total size of the memory tier.
+        max_memory_item_bytes: Larger entries are only kept on disk.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_disk_bytes: int,
+        max_memory_bytes: int,
+        max_memory_item_bytes: int,
+    ):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.max_memory_item_bytes = max_memory_item_bytes
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()  # file name -> size, LRU first
+        self._disk_bytes = 0
+
+        entries = []
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith("."):
+                    st = entry.stat()
+                    entries.append((st.st_atime, entry.name, st.st_size))
+        for _, file_name, size in sorted(entries):
+            self._disk[file_name] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def __len__(self) -> int:
+        return len(self._disk)
+
+    @staticmethod
+    def _file_name(key: str) -> str:
+        ext = key.rsplit(".", 1)[-1]
+        return f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.{ext}"
+
+    def get(self, key: str) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        Looks key up in memory, then on disk.
+
+        A disk hit is read here rather than handed out as a path: a concurrent
+        put() may evict the file before a response streams it, and bytes that
+        were read stay valid. A file that is already gone is a miss.
+
+        Returns:
+            (data, "memory" or "disk") for a hit, or (None, None) for a miss.
+        """
+        file_name = self._file_name(key)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data, "memory"
+            if file_name not in self._disk:
+                return None, None
+            self._disk.move_to_end(file_name)
+        try:
+            return (self.cache_dir / file_name).read_bytes(), "disk"
+        except FileNotFoundError:
+            with self._lock:
+                size = self._disk.pop(file_name, None)
+                if size is not None:
+                    self._disk_bytes -= size
+            return None, None
+
+    def put(self, key: str, data: bytes) -> Path:
+        """Stores an encode in both tiers (memory only if it is small enough)."""
+        file_name = self._file_name(key)
+        path = self.cache_dir / file_name
+        tmp_path = path.with_name(f".{file_name}.tmp")
+        try:
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        with self._lock:
+            previous = self._disk.pop(file_name, None)
+            if previous is not None:
+                self._disk_bytes -= previous
+            self._disk[file_name] = len(data)
+            self._disk_bytes += len(data)
+            if len(data) <= self.max_memory_item_bytes:
+                if key in self._memory:
+                    self._memory_bytes -= len(self._memory.pop(key))
+                self._memory[key] = data
+                self._memory_bytes += len(data)
+                while self._memory_bytes > self.max_memory_bytes and self._memory:
+                    _, evicted = self._memory.popitem(last=False)
+                    self._memory_bytes -= len(evicted)
+        self._evict_disk()
+        return path
+
+    def _evict_disk(self):
+        while True:
+            with self._lock:
+                if self._disk_bytes <= self.max_disk_bytes or len(self._disk) <= 1:
+                    return
+                file_name, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+            try:
+                (self.cache_dir / file_name).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not evict {file_name} from the render cache: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
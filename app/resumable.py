@@ -0,0 +1,354 @@
+"""
+Resumable uploads for Shotput, following the tus 1.0 core protocol.
+
+A client creates an upload with its total length (POST), sends the bytes in
+any number of PATCH requests that each start at the offset the server already
+has (HEAD reports it after a dropped connection), and finalizes it. Bytes are
+appended to a dot-prefixed staging file next to the images and hashed as they
+arrive, so finalizing only has to read the image header before the file takes
+the normal upload path.
+
+A JSON sidecar per upload keeps uploads resumable across restarts (the partial
+file is rehashed once when the server starts) and lets any worker process pick
+up an upload another one started: requests hold an exclusive lock on the
+staging file, and a worker that finds more bytes than it hashed rehashes.
+Uploads that receive no bytes for `expire_s` are deleted.
+"""
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: a single process, the in-process busy flag suffices
+    fcntl = None
+
+from imaging import SNIFF_BYTES
+from ingest import UPLOAD_CHUNK_SIZE, StagedUpload, UploadRejected, check_image_type, validate_image_header
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,termination,expiration"
+
+_PREFIX = ".resumable-"
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+@dataclass
+class ResumableUpload:
+    upload_id: str
+    length: int
+    path: Path  # Staging file; becomes the StagedUpload's path when finalized
+    metadata: str = ""  # The client's Upload-Metadata header, echoed back by HEAD
+    created_at: float = field(default_factory=time.time)
+    offset: int = 0
+    updated_at: float = field(default_factory=time.time)
+    extension: Optional[str] = None
+    busy: bool = False  # A PATCH or finalize is in progress (only touched on the event loop)
+    lock_fd: Optional[int] = field(default=None, repr=False)  # Held while busy, against other processes
+    digest: Any = field(default_factory=hashlib.sha256, repr=False)
+
+    @property
+    def sidecar(self) -> Path:
+        return self.path.with_suffix(".json")
+
+
+class ResumableUploads:
+    """
+    Registry of unfinished resumable uploads and their staging files.
+
+    Every method except get() touches the disk; call them off the event loop.
+
+    Args:
+        directory: Where to stage; must be on the filesystem the images are stored on.
+        max_bytes: Largest accepted Upload-Length (0 disables the check).
+        max_pixels: Largest accepted width * height (0 disables the check).
+        expire_s: Delete uploads that received no bytes for this long.
+        max_uploads: Most unfinished uploads at a time (0 means no limit).
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int = 0,
+        max_pixels: int = 0,
+        expire_s: float = 86400,
+        max_uploads: int = 100,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.expire_s = expire_s
+        self.max_uploads = max_uploads
+        self._uploads: Dict[str, ResumableUpload] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._uploads)
+
+    def expires_at(self, upload: ResumableUpload) -> float:
+        return upload.updated_at + self.expire_s
+
+    def get(self, upload_id: str) -> Optional[ResumableUpload]:
+        """
+        The unfinished upload with this ID, or None if it is unknown to this
+        process or expired (see load() for uploads of other processes).
+        """
+        upload = self._uploads.get(upload_id)
+        if upload is None or (not upload.busy and self.expires_at(upload) < time.time()):
+            return None
+        return upload
+
+    def load(self, upload_id: str) -> Optional[ResumableUpload]:
+        """Picks up an upload created by another worker process (or a previous run), if it exists."""
+        if not _UPLOAD_ID.match(upload_id):
+            return None
+        upload = self._read(self.directory / f"{_PREFIX}{upload_id}.json", time.time())
+        if upload is None:
+            return None
+        with self._lock:
+            return self._uploads.setdefault(upload_id, upload)
+
+    def acquire(self, upload: ResumableUpload):
+        """
+        Locks the staging file against other worker processes for one request
+        and catches up with bytes they appended since this process last saw it.
+
+        Raises:
+            UploadRejected: 404 if the upload was finished or deleted
+                elsewhere, 409 if another process is writing to it.
+        """
+        try:
+            fd = os.open(upload.path, os.O_RDWR)
+        except FileNotFoundError:
+            with self._lock:
+                self._uploads.pop(upload.upload_id, None)
+            raise UploadRejected(404, "Upload not found (it may have expired).")
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                raise UploadRejected(409, "Another request is writing to this upload.")
+        upload.lock_fd = fd
+        try:
+            if not upload.sidecar.exists():  # Finished or discarded before we got the lock
+                raise UploadRejected(404, "Upload not found (it may have expired).")
+            st = os.fstat(fd)
+            if st.st_size != upload.offset:
+                self._rehash(upload)
+                upload.updated_at = st.st_mtime
+        except BaseException:
+            self.release(upload)
+            raise
+
+    def sync(self, upload: ResumableUpload):
+        """
+        Catches up with bytes other worker processes appended, without locking
+        (for HEAD). Call it only while this process is not writing to the upload.
+
+        Raises:
+            UploadRejected: 404 if the upload was finished or deleted elsewhere.
+        """
+        try:
+            st = upload.path.stat()
+            if not upload.sidecar.exists():
+                raise FileNotFoundError(upload.sidecar)
+            if st.st_size != upload.offset:
+                self._rehash(upload)
+                upload.updated_at = st.st_mtime
+        except FileNotFoundError:
+            with self._lock:
+                self._uploads.pop(upload.upload_id, None)
+            raise UploadRejected(404, "Upload not found (it may have expired).")
+
+    def release(self, upload: ResumableUpload):
+        if upload.lock_fd is not None:
+            os.close(upload.lock_fd)
+            upload.lock_fd = None
+
+    def create(self, length: int, metadata: str = "") -> ResumableUpload:
+        """
+        Starts an upload of `length` bytes with an empty staging file.
+
+        Raises:
+            UploadRejected: 413 over the byte limit, 400 for an empty upload,
+                429 when too many uploads are unfinished.
+        """
+        if length <= 0:
+            raise UploadRejected(400, "Upload-Length must be a positive number of bytes.")
+        if self.max_bytes and length > self.max_bytes:
+            raise UploadRejected(413, f"Upload exceeds the limit of {self.max_bytes} bytes.")
+        self.expire()
+        with self._lock:
+            if self.max_uploads and len(self._uploads) >= self.max_uploads:
+                raise UploadRejected(429, "Too many unfinished uploads; finish or delete some first.")
+            upload_id = uuid.uuid4().hex
+            upload = ResumableUpload(upload_id, length, self.directory / f"{_PREFIX}{upload_id}.tmp", metadata)
+            self._uploads[upload_id] = upload
+        try:
+            upload.path.touch()
+            upload.sidecar.write_text(
+                json.dumps({"length": length, "metadata": metadata, "created_at": upload.created_at})
+            )
+        except BaseException:
+            self.discard(upload)
+            raise
+        return upload
+
+    def append(self, upload: ResumableUpload, data: bytes):
+        """
+        Appends bytes at the upload's current offset and hashes them.
+
+        The format is checked as soon as the first SNIFF_BYTES bytes are in,
+        so a non-image is refused after its first chunk.
+
+        Raises:
+            UploadRejected: 413 if the bytes run past Upload-Length (nothing is
+                written), 415 if the upload turns out not to be an image.
+        """
+        if upload.offset + len(data) > upload.length:
+            raise UploadRejected(
+                413, f"The upload was declared as {upload.length} bytes; these bytes would end at {upload.offset + len(data)}."
+            )
+        with open(upload.path, "r+b") as out:
+            out.seek(upload.offset)
+            out.write(data)
+            out.truncate()
+        upload.digest.update(data)
+        upload.offset += len(data)
+        upload.updated_at = time.time()
+        self._sniff(upload)
+
+    def _sniff(self, upload: ResumableUpload):
+        if upload.extension is None and upload.offset >= min(SNIFF_BYTES, upload.length):
+            with open(upload.path, "rb") as f:
+                upload.extension = check_image_type(f.read(SNIFF_BYTES))
+
+    def finish(self, upload: ResumableUpload) -> StagedUpload:
+        """
+        Validates a complete upload and hands its staging file over as a StagedUpload.
+
+        The upload leaves the registry either way; on rejection its files are deleted.
+
+        Raises:
+            UploadRejected: As stage_upload does for the same file.
+        """
+        try:
+            self._sniff(upload)
+            width, height = validate_image_header(upload.path, self.max_pixels)
+        except BaseException:
+            self.discard(upload)
+            raise
+        with self._lock:
+            self._uploads.pop(upload.upload_id, None)
+        upload.sidecar.unlink(missing_ok=True)
+        self.release(upload)
+        return StagedUpload(upload.path, upload.digest.hexdigest(), upload.length, upload.extension, width, height)
+
+    def discard(self, upload: ResumableUpload):
+        """Forgets an upload and deletes its files."""
+        with self._lock:
+            self._uploads.pop(upload.upload_id, None)
+        upload.sidecar.unlink(missing_ok=True)
+        upload.path.unlink(missing_ok=True)
+        self.release(upload)
+
+    def expire(self) -> int:
+        """Deletes uploads idle for longer than expire_s. Returns how many."""
+        now = time.time()
+        with self._lock:
+            expired = [u for u in self._uploads.values() if not u.busy and self.expires_at(u) < now]
+        count = 0
+        for upload in expired:
+            try:
+                mtime = upload.path.stat().st_mtime
+            except FileNotFoundError:
+                mtime = 0  # Finished or deleted by another worker process
+            if mtime + self.expire_s >= now:
+                upload.updated_at = mtime  # Another worker process has been writing to it
+                continue
+            self.discard(upload)
+            count += 1
+        if count:
+            logger.info(f"Expired {count} abandoned resumable uploads")
+        return count
+
+    def recover(self) -> int:
+        """
+        Reloads the unfinished uploads of a previous run, rehashing their
+        received bytes, and deletes expired or orphaned staging files.
+
+        Returns:
+            How many uploads can be resumed.
+        """
+        now = time.time()
+        recovered: List[ResumableUpload] = []
+        for sidecar in self.directory.glob(f"{_PREFIX}*.json"):
+            upload = self._read(sidecar, now)
+            if upload is not None:
+                recovered.append(upload)
+        with self._lock:
+            for upload in recovered:
+                self._uploads.setdefault(upload.upload_id, upload)
+        # Staging files whose sidecar is gone can never be resumed
+        for path in self.directory.glob(f"{_PREFIX}*.tmp"):
+            if path.stem[len(_PREFIX) :] not in self._uploads:
+                try:
+                    if now - path.stat().st_mtime > 60:
+                        path.unlink()
+                except OSError:
+                    pass
+        return len(recovered)
+
+    def _read(self, sidecar: Path, now: float) -> Optional[ResumableUpload]:
+        """Loads an upload from its sidecar and staging file; expired or broken ones are deleted."""
+        upload_id = sidecar.stem[len(_PREFIX) :]
+        path = sidecar.with_suffix(".tmp")
+        try:
+            info = json.loads(sidecar.read_text())
+            st = path.stat()
+        except FileNotFoundError:
+            return None  # Finished or deleted meanwhile (possibly by another process)
+        except (OSError, ValueError):
+            sidecar.unlink(missing_ok=True)
+            path.unlink(missing_ok=True)
+            return None
+        upload = ResumableUpload(
+            upload_id,
+            int(info["length"]),
+            path,
+            info.get("metadata", ""),
+            created_at=info.get("created_at", st.st_mtime),
+            updated_at=st.st_mtime,
+        )
+        if self.expires_at(upload) < now or st.st_size > upload.length:
+            self.discard(upload)
+            return None
+        try:
+            self._rehash(upload)
+        except FileNotFoundError:
+            return None
+        except UploadRejected:
+            self.discard(upload)
+            return None
+        return upload
+
+    def _rehash(self, upload: ResumableUpload):
+        upload.digest = hashlib.sha256()
+        upload.offset = 0
+        with open(upload.path, "rb") as f:
+            while chunk := f.read(UPLOAD_CHUNK_SIZE):
+                upload.digest.update(chunk)
+                upload.offset += len(chunk)
+        self._sniff(upload)
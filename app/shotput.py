@@ -1,5 +1,5 @@
 # /// script
-# requires-python = ">=3.8"
+# requires-python = ">=3.9"
 # dependencies = [
 #     "fastapi",
 #     "uvicorn[standard]",
@@ -7,36 +7,104 @@
 #     "Pillow",
 #     "GitPython",
 #     "toml",
+#     "numpy",
+#     "brotli",
 # ]
 # ///
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
 from fastapi.responses import (
+    FileResponse,
     JSONResponse,
     HTMLResponse,
     Response,
 )  # Added HTMLResponse, Response
+from starlette.requests import ClientDisconnect
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
-import toml
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import functools
+import math
+import os
+import random
+import stat
+import time
 from datetime import datetime
 import logging
-import git
 import uuid
-from PIL import Image
-import io
-import uvicorn  # Added uvicorn
-
-# Configure basic logging to output to stderr, which Docker captures
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler()  # Ensures output to stderr
-    ],
+
+from hash_index import HashIndex, sha256_bytes, sha256_file
+from imaging import (
+    DERIVATIVE_FORMATS as DERIVATIVE_FORMATS_INFO,
+    PERCEPTUAL_HASH_ALGORITHMS,
+    RENDER_FORMATS,
+    RENDER_SOURCE_FORMATS,
+    derivative_name,
+    derivative_widths,
+    image_info,
+    is_derivative_name,
+    optimize_png_file,
+    perceptual_hash_file,
+    placeholder_file,
+    prepare_image_file,
+    render_variant,
+    supported_derivative_formats,
+    supported_render_formats,
+    write_derivative,
+)
+from ingest import UPLOAD_CHUNK_SIZE, IngestPipeline, StagedUpload, UploadRejected, stage_upload
+from admission import Admission, AdmissionController, Overloaded, RateLimiter
+from assets import AssetStore, etag_matches
+from metrics import (
+    COMMIT_BATCH_UPLOADS,
+    COMMITS,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    DEDUP_HITS,
+    GIT_STAGE_SECONDS,
+    PUSHES,
+    REBASES,
+    REGISTRY,
+    STORED_BYTES,
+    UPLOAD_BYTES,
+    UPLOAD_STAGE_SECONDS,
+    UPLOADS,
+    UPLOADS_IN_FLIGHT,
+    UPLOADS_QUEUED,
+    UPLOADS_SHED,
+    WORKER_QUEUE_DEPTH,
 )
+from coordinator import GitCoordinator
+from storage import BACKENDS, FilesystemStorage, GitStorage, S3Storage, StorageBackend
+from resumable import TUS_EXTENSIONS, TUS_VERSION, ResumableUpload, ResumableUploads
+from render_cache import RenderCache, claim_worker_dir
+import statedb
+
+if TYPE_CHECKING:
+    # GitPython and numpy add a noticeable share of the import time; these are
+    # imported where first used, on worker threads once the server is up
+    import git
+    from gitstore import PlumbingCommitter
+    from manifest import MediaManifest
+    from pusher import BackgroundPusher
+    from similar_index import PerceptualIndex
+
 logger = logging.getLogger(__name__)
 
 
+def configure_logging():
+    """Logs to stderr, which Docker captures. Called by create_app, not on import."""
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.StreamHandler()  # Ensures output to stderr
+        ],
+    )
+
+
 def commit_and_push_image(
     repo_path: Path, image_file_path: Path, commit_message: str, auto_push: bool = False
 ):
@@ -49,7 +117,27 @@ def commit_and_push_image(
         commit_message: The commit message.
 
     Returns:
-        A tuple (success: bool, message: str).
+        A tuple (success: bool, message: str, commit_sha: Optional[str]).
+    """
+    return commit_and_push_images(repo_path, [image_file_path], commit_message, auto_push)
+
+
+def commit_and_push_images(
+    repo_path: Path,
+    image_file_paths: List[Path],
+    commit_message: str,
+    auto_push: bool = False,
+):
+    """
+    Adds several images in a single commit and (optionally) pushes once.
+
+    Args:
+        repo_path: The local path to the Git repository.
+        image_file_paths: Paths to the image files within the repository.
+        commit_message: The commit message.
+
+    Returns:
+        A tuple (success: bool, message: str, commit_sha: Optional[str]).
     """
     try:
         # Ensure repo_path is a valid directory
@@ -57,240 +145,892 @@ def commit_and_push_image(
             return (
                 False,
                 f"Repository path {repo_path} does not exist or is not a directory.",
+                None,
             )
 
+        import git
+
         # Initialize the repository object
         try:
             repo = git.Repo(repo_path)
         except git.InvalidGitRepositoryError:
-            return False, f"Path {repo_path} is not a valid Git repository."
+            return False, f"Path {repo_path} is not a valid Git repository.", None
         except Exception as e:
-            return False, f"Error initializing Git repository at {repo_path}: {str(e)}"
+            return False, f"Error initializing Git repository at {repo_path}: {str(e)}", None
 
-        # Ensure the image file is within the repository
-        # image_file_path should be relative to the repo_path for git add
-        try:
-            relative_image_path = image_file_path.relative_to(repo_path)
-        except ValueError:
-            return (
-                False,
-                f"Image file {image_file_path} is not within the repository path {repo_path}.",
-            )
+        relative_image_paths = []
+        for image_file_path in image_file_paths:
+            # Ensure the image file is within the repository
+            # image_file_path should be relative to the repo_path for git add
+            try:
+                relative_image_paths.append(image_file_path.relative_to(repo_path))
+            except ValueError:
+                return (
+                    False,
+                    f"Image file {image_file_path} is not within the repository path {repo_path}.",
+                    None,
+                )
 
-        # Check if the file exists before adding
-        if not image_file_path.exists():
-            return False, f"Image file {image_file_path} does not exist."
+            # Check if the file exists before adding
+            if not image_file_path.exists():
+                return False, f"Image file {image_file_path} does not exist.", None
 
-        # Add the image file to the staging area
-        repo.index.add([str(relative_image_path)])
+        # Add the image files to the staging area
+        with GIT_STAGE_SECONDS.time(stage="add"):
+            repo.index.add([str(p) for p in relative_image_paths])
 
         # Commit the changes
-        repo.index.commit(commit_message)
+        with GIT_STAGE_SECONDS.time(stage="commit"):
+            commit = repo.index.commit(commit_message)
 
         push_message = ""
+        commit_sha = commit.hexsha
         if auto_push:
-            try:
-                # Attempt to push to the default remote (usually 'origin') and current branch
-                # Ensure your environment is configured for passwordless push (e.g., SSH keys)
-                # or Git credential helper.
-                logger.debug(
-                    f"Attempting to push. Remote 'origin' details: {repo.remote(name='origin').url}"
+            push_message = _push_to_origin(repo)
+            commit_sha = repo.head.commit.hexsha  # Differs if the push rebased it
+
+        committed = ", ".join(f"'{p}'" for p in relative_image_paths)
+        noun = "Image" if len(relative_image_paths) == 1 else "Images"
+        return (
+            True,
+            f"{noun} {committed} committed successfully{push_message}.",
+            commit_sha,
+        )
+
+    except Exception as e:
+        # Log the exception for debugging
+        print(f"Error during Git operation: {e}")
+        return False, f"An error occurred during Git operation: {str(e)}", None
+
+
+def _push_to_origin(repo: "git.Repo", committer: Optional["PlumbingCommitter"] = None) -> str:
+    """
+    Pushes the current branch to 'origin'. With push_rebase, a push rejected
+    because another instance pushed first is followed by a fetch, a rebase of
+    the local commits onto origin's branch and another push, up to
+    push_rebase_attempts times.
+
+    Args:
+        repo: The repository to push.
+        committer: The committer that commits to repo, which rebases reuse.
+            Without one (index engine), one is opened at the first rejection
+            and kept for the remaining attempts.
+
+    Returns:
+        A message fragment describing the push outcome, appended to the commit message.
+    """
+    from gitstore import PlumbingCommitter, RebaseConflict
+
+    attempts = GIT_PUSH_REBASE_ATTEMPTS if GIT_PUSH_REBASE else 0
+    for attempt in range(attempts + 1):
+        if attempt > 1:
+            # The other instance may be pushing right now as well; avoid lockstep
+            time.sleep(min(0.1 * 2 ** (attempt - 1), 2.0) * random.uniform(0.5, 1.5))
+        push_message, rejected = _push_once(repo)
+        if not rejected or attempt == attempts:
+            return push_message
+        try:
+            if committer is None:
+                committer = PlumbingCommitter(
+                    Path(repo.working_tree_dir or repo.git_dir), repo.head.reference.name
+                )
+            _rebase_onto_origin(committer)
+        except RebaseConflict as e:
+            REBASES.inc(result="conflict")
+            logger.error(f"Cannot rebase onto origin without a merge: {e}")
+            return f"{push_message} Could not rebase onto origin: {e}"
+        except Exception as e:
+            REBASES.inc(result="failed")
+            logger.warning(f"Rebase onto origin failed (attempt {attempt + 1}): {e}")
+    return push_message
+
+
+def _rebase_onto_origin(committer: "PlumbingCommitter"):
+    """Fetches origin's copy of the committer's branch and rebases the local commits onto it."""
+    tracking_ref = f"refs/remotes/origin/{committer.branch}"
+    with GIT_STAGE_SECONDS.time(stage="fetch"):
+        committer.repo.git.fetch("origin", f"+{committer.ref}:{tracking_ref}")
+    with GIT_STAGE_SECONDS.time(stage="rebase"):
+        new_tip, replayed = committer.rebase_onto(tracking_ref)
+    if new_tip is not None:
+        REBASES.inc(result="ok")
+        logger.info(f"Rebased {replayed} local commits onto {tracking_ref}; pushing again.")
+
+
+def _push_once(repo: "git.Repo") -> Tuple[str, bool]:
+    """
+    One push of the current branch to 'origin'.
+
+    Returns:
+        (message fragment describing the outcome, whether origin rejected the
+        push for having commits this repository does not).
+    """
+    import git
+    from pusher import REJECTION_MARKERS
+
+    push_message = ""
+    rejected = False
+    try:
+        # Attempt to push to the default remote (usually 'origin') and current branch
+        # Ensure your environment is configured for passwordless push (e.g., SSH keys)
+        # or Git credential helper.
+        logger.debug(
+            f"Attempting to push. Remote 'origin' details: {repo.remote(name='origin').url}"
+        )
+        origin = repo.remote(name="origin")
+        logger.debug(
+            f"Executing origin.push() for branch {repo.head.reference.name}"
+        )
+
+        # It's good to specify the refspec for clarity and to ensure you're pushing the current branch
+        # to its corresponding remote branch, or a specific one if needed.
+        # Example: repo.head.reference.name could be 'main'
+        refspec = f"{repo.head.reference.name}:{repo.head.reference.name}"
+        logger.debug(f"Using refspec: {refspec}")
+        with GIT_STAGE_SECONDS.time(stage="push"):
+            push_infos = origin.push(refspec=refspec)
+
+        logger.debug(f"push_infos raw: {push_infos}")
+
+        # Detailed check of push_infos
+        push_failed = False
+        error_summaries = []
+        for p_info in push_infos:
+            logger.debug(
+                f"PushInfo item: flags={p_info.flags}, summary='{p_info.summary}', error='{getattr(p_info, 'error', None)}'"
+            )
+            if p_info.flags & (
+                git.remote.PushInfo.ERROR | git.remote.PushInfo.REJECTED
+            ):
+                push_failed = True
+                rejected = rejected or bool(p_info.flags & git.remote.PushInfo.REJECTED)
+                error_summaries.append(p_info.summary)
+            # You might want to check for other flags too, e.g., if it's not UP_TO_DATE or FAST_FORWARD
+            # and not an error, what is it?
+
+        if push_failed:
+            PUSHES.inc(result="rejected" if rejected else "failed")
+            push_message = f" Commit successful, but push failed: {'; '.join(error_summaries)}"
+            logger.error(
+                f"Push failed. Summaries: {'; '.join(error_summaries)}"
+            )
+        elif not push_infos:  # If push_infos is empty, it might indicate nothing was pushed or an issue
+            push_message = " Commit successful, but push command returned no information (may indicate no changes to push or an issue)."
+            logger.warning(
+                "origin.push() returned empty list. Push may not have occurred."
+            )
+        else:  # If not failed and not empty, assume success for now based on original logic
+            all_ok = all(
+                p_info.flags
+                & (
+                    git.remote.PushInfo.UP_TO_DATE
+                    | git.remote.PushInfo.FAST_FORWARD
+                    | git.remote.PushInfo.NEW_TAG
+                    | git.remote.PushInfo.NEW_HEAD
                 )
-                origin = repo.remote(name="origin")
-                logger.debug(
-                    f"Executing origin.push() for branch {repo.head.reference.name}"
+                for p_info in push_infos
+                if not (
+                    p_info.flags
+                    & (git.remote.PushInfo.ERROR | git.remote.PushInfo.REJECTED)
+                )
+            )
+            if all_ok and any(
+                p_info.flags
+                & (
+                    git.remote.PushInfo.FAST_FORWARD
+                    | git.remote.PushInfo.NEW_HEAD
+                )
+                for p_info in push_infos
+            ):  # Check if something actually changed
+                PUSHES.inc(result="ok")
+                push_message = " and pushed successfully to remote."
+                logger.info("Push successful.")
+            elif all(
+                p_info.flags & git.remote.PushInfo.UP_TO_DATE
+                for p_info in push_infos
+            ):
+                push_message = " and remote is already up-to-date."
+                logger.info("Push successful (remote up-to-date).")
+            else:
+                push_message = f" Commit successful, but push status is unclear: {[(pi.flags, pi.summary) for pi in push_infos]}"
+                logger.warning(
+                    f"Push status unclear. push_infos: {[(pi.flags, pi.summary) for pi in push_infos]}"
                 )
 
-                # It's good to specify the refspec for clarity and to ensure you're pushing the current branch
-                # to its corresponding remote branch, or a specific one if needed.
-                # Example: repo.head.reference.name could be 'main'
-                refspec = f"{repo.head.reference.name}:{repo.head.reference.name}"
-                logger.debug(f"Using refspec: {refspec}")
-                push_infos = origin.push(refspec=refspec)
-
-                logger.debug(f"push_infos raw: {push_infos}")
-
-                # Detailed check of push_infos
-                push_failed = False
-                error_summaries = []
-                for p_info in push_infos:
-                    logger.debug(
-                        f"PushInfo item: flags={p_info.flags}, summary='{p_info.summary}', error='{getattr(p_info, 'error', None)}'"
-                    )
-                    if p_info.flags & (
-                        git.remote.PushInfo.ERROR | git.remote.PushInfo.REJECTED
-                    ):
-                        push_failed = True
-                        error_summaries.append(p_info.summary)
-                    # You might want to check for other flags too, e.g., if it's not UP_TO_DATE or FAST_FORWARD
-                    # and not an error, what is it?
-
-                if push_failed:
-                    push_message = f" Commit successful, but push failed: {'; '.join(error_summaries)}"
-                    logger.error(
-                        f"Push failed. Summaries: {'; '.join(error_summaries)}"
-                    )
-                elif not push_infos:  # If push_infos is empty, it might indicate nothing was pushed or an issue
-                    push_message = " Commit successful, but push command returned no information (may indicate no changes to push or an issue)."
-                    logger.warning(
-                        "origin.push() returned empty list. Push may not have occurred."
-                    )
-                else:  # If not failed and not empty, assume success for now based on original logic
-                    all_ok = all(
-                        p_info.flags
-                        & (
-                            git.remote.PushInfo.UP_TO_DATE
-                            | git.remote.PushInfo.FAST_FORWARD
-                            | git.remote.PushInfo.NEW_TAG
-                            | git.remote.PushInfo.NEW_HEAD
-                        )
-                        for p_info in push_infos
-                        if not (
-                            p_info.flags
-                            & (git.remote.PushInfo.ERROR | git.remote.PushInfo.REJECTED)
-                        )
-                    )
-                    if all_ok and any(
-                        p_info.flags
-                        & (
-                            git.remote.PushInfo.FAST_FORWARD
-                            | git.remote.PushInfo.NEW_HEAD
-                        )
-                        for p_info in push_infos
-                    ):  # Check if something actually changed
-                        push_message = " and pushed successfully to remote."
-                        logger.info("Push successful.")
-                    elif all(
-                        p_info.flags & git.remote.PushInfo.UP_TO_DATE
-                        for p_info in push_infos
-                    ):
-                        push_message = " and remote is already up-to-date."
-                        logger.info("Push successful (remote up-to-date).")
-                    else:
-                        push_message = f" Commit successful, but push status is unclear: {[(pi.flags, pi.summary) for pi in push_infos]}"
-                        logger.warning(
-                            f"Push status unclear. push_infos: {[(pi.flags, pi.summary) for pi in push_infos]}"
-                        )
-
-            except git.GitCommandError as e:
-                push_message = f" Commit successful, but push failed with GitCommandError: {str(e)}"
-                logger.error(
-                    f"GitCommandError during push: command='{e.command}', status={e.status}, stderr='{e.stderr}', stdout='{e.stdout}'"
+    except git.GitCommandError as e:
+        rejected = any(marker in f"{e.stdout}\n{e.stderr}" for marker in REJECTION_MARKERS)
+        PUSHES.inc(result="rejected" if rejected else "failed")
+        push_message = f" Commit successful, but push failed with GitCommandError: {str(e)}"
+        logger.error(
+            f"GitCommandError during push: command='{e.command}', status={e.status}, stderr='{e.stderr}', stdout='{e.stdout}'"
+        )
+    except Exception as e:
+        push_message = f" Commit successful, but an unexpected error occurred during push: {str(e)}"
+        logger.error(f"Exception during push: {str(e)}", exc_info=True)
+
+    return push_message, rejected
+
+
+def commit_and_push_images_plumbing(
+    committer: "PlumbingCommitter",
+    repo_path: Path,
+    image_file_paths: List[Path],
+    commit_message: str,
+    auto_push: bool = False,
+):
+    """
+    Same contract as commit_and_push_images, but commits through a long-lived
+    PlumbingCommitter (blob/tree/ref writes) instead of the working index.
+
+    Args:
+        committer: The committer holding the repository handle.
+        repo_path: Root that image paths are made relative to; with a bare
+            repository this is just the local directory the images were written to.
+        image_file_paths: Paths to the image files.
+        commit_message: The commit message.
+
+    Returns:
+        A tuple (success: bool, message: str, commit_sha: Optional[str]).
+    """
+    try:
+        files = []
+        for image_file_path in image_file_paths:
+            try:
+                relative_image_path = image_file_path.relative_to(repo_path)
+            except ValueError:
+                return (
+                    False,
+                    f"Image file {image_file_path} is not within the repository path {repo_path}.",
+                    None,
                 )
-            except Exception as e:
-                push_message = f" Commit successful, but an unexpected error occurred during push: {str(e)}"
-                logger.error(f"Exception during push: {str(e)}", exc_info=True)
+            if not image_file_path.exists():
+                return False, f"Image file {image_file_path} does not exist.", None
+            files.append((relative_image_path.as_posix(), image_file_path))
 
+        commit = committer.commit_files(files, commit_message)
+        logger.debug(f"Created commit {commit.hexsha} on {committer.ref}")
+
+        push_message = ""
+        commit_sha = commit.hexsha
+        if auto_push:
+            push_message = _push_to_origin(committer.repo, committer)
+            commit_sha = committer.repo.commit(committer.ref).hexsha  # Differs if the push rebased it
+
+        committed = ", ".join(f"'{p}'" for p, _ in files)
+        noun = "Image" if len(files) == 1 else "Images"
         return (
             True,
-            f"Image '{relative_image_path}' committed successfully{push_message}.",
+            f"{noun} {committed} committed successfully{push_message}.",
+            commit_sha,
         )
 
     except Exception as e:
-        # Log the exception for debugging
-        print(f"Error during Git operation: {e}")
-        return False, f"An error occurred during Git operation: {str(e)}"
+        logger.error(f"Error during Git operation: {e}", exc_info=True)
+        return False, f"An error occurred during Git operation: {str(e)}", None
 
 
-if __name__ == "__main__":
-    # Example usage (for testing this script directly)
-    # This requires a test git repository to be set up.
-    print("This is a utility module for Git operations. It's meant to be imported.")
-    # TEST_REPO_PATH = Path("/tmp/my_test_images_repo") # Create this repo for testing
-    # TEST_REPO_PATH.mkdir(parents=True, exist_ok=True)
-    # if not (TEST_REPO_PATH / ".git").exists():
-    #     git.Repo.init(TEST_REPO_PATH)
-    #     (TEST_REPO_PATH / "static").mkdir(exist_ok=True)
-    #     print(f"Initialized test git repo at {TEST_REPO_PATH}")
-
-    # # Create a dummy image file
-    # dummy_image_name = "test_image.png"
-    # dummy_image_path_abs = TEST_REPO_PATH / "static" / dummy_image_name
-    # with open(dummy_image_path_abs, "w") as f:
-    #     f.write("dummy image content")
-    # print(f"Created dummy image: {dummy_image_path_abs}")
-
-    # success, message = commit_and_push_image(
-    #     repo_path=TEST_REPO_PATH,
-    #     image_file_path=dummy_image_path_abs,
-    #     commit_message="Test commit for dropper clone utils"
-    # )
-    # print(f"Commit success: {success}, Message: {message}")
-
-    # # To test again, you might need to remove the dummy file or change its content
-    # # dummy_image_path_abs.unlink(missing_ok=True)
+class CommitCoalescer:
+    """
+    Groups uploads that arrive close together into a single commit and push.
+
+    Each upload awaits submit(); the first upload of a burst opens a window of
+    window_ms (or until max_batch uploads are waiting), then every waiting
+    upload is written as one commit via commit_fn. Uploads that
+    arrive while that commit/push is in flight are already older than the
+    window and go out together in the next commit, so throughput grows with
+    the burst size instead of being capped by push latency.
+
+    Args:
+        commit_fn: Blocking callable (image_file_paths, commit_message) ->
+            (success, message, commit_sha), e.g. a partial of commit_and_push_images.
+        run_git: Runs a blocking callable on the git worker, e.g. IngestPipeline.run_git.
+        window_ms: How long to wait for more uploads after the first one arrives.
+        max_batch: Maximum number of uploads per commit.
+        on_commit: Called with the SHA of every successful commit, e.g.
+            BackgroundPusher.notify.
+    """
+
+    def __init__(
+        self,
+        commit_fn: Callable[[List[Path], str], Tuple[bool, str, Optional[str]]],
+        run_git: Callable[..., Awaitable[Any]],
+        window_ms: int = 200,
+        max_batch: int = 32,
+        on_commit: Optional[Callable[[str], None]] = None,
+    ):
+        self.commit_fn = commit_fn
+        self.run_git = run_git
+        self.on_commit = on_commit
+        self.window = max(0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self._pending: List[
+            Tuple[List[Path], str, float, "asyncio.Future[Tuple[bool, str, Optional[str]]]"]
+        ] = []
+        self._batch_full = asyncio.Event()
+        self._flusher: "asyncio.Task[None]" = None
+
+    def __len__(self) -> int:
+        """Uploads waiting for their commit."""
+        return len(self._pending)
+
+    async def submit(
+        self, image_file_paths: List[Path], commit_message: str
+    ) -> Tuple[bool, str, Optional[str]]:
+        """
+        Queues an upload's files (the image and any derivatives) for the next
+        grouped commit and waits for it to land. An upload's files are never
+        split across commits.
+
+        Returns:
+            The (success, message, commit_sha) tuple of the commit that included the image.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((image_file_paths, commit_message, time.monotonic(), future))
+        if len(self._pending) >= self.max_batch:
+            self._batch_full.set()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        return await future
+
+    async def _flush_loop(self):
+        while self._pending:
+            # The window is measured from the oldest waiting upload
+            remaining = self.window - (time.monotonic() - self._pending[0][2])
+            if remaining > 0 and len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            self._batch_full.clear()
+
+            batch = self._pending[: self.max_batch]
+            del self._pending[: self.max_batch]
+            if len(self._pending) >= self.max_batch:
+                self._batch_full.set()
+
+            if len(batch) == 1:
+                commit_message = batch[0][1]
+            else:
+                commit_message = f"Add {len(batch)} images via Shotput\n\n" + "\n".join(
+                    message for _, message, _, _ in batch
+                )
+
+            try:
+                result = await self.run_git(
+                    self.commit_fn,
+                    [path for paths, _, _, _ in batch for path in paths],
+                    commit_message,
+                )
+            except Exception as e:
+                result = (False, f"An error occurred during Git operation: {str(e)}", None)
+            logger.debug(f"Grouped commit of {len(batch)} image(s): {result}")
+            COMMITS.inc(result="ok" if result[0] else "failed")
+            COMMIT_BATCH_UPLOADS.observe(len(batch))
+            if result[0] and self.on_commit is not None:
+                self.on_commit(result[2])
+
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_result(result)
+
+
+class BatchCommit:
+    """
+    Puts the files of one multi-file upload into a single commit.
+
+    Every upload of the batch holds a ticket. Tickets that reach the commit
+    step submit their files and wait; once every ticket has either submitted
+    or been released (duplicates, failures, uploads waiting on an identical
+    in-flight upload), all submitted files go to the storage backend as one
+    entry, so with git the batch lands in one commit however long its slowest
+    image takes.
+
+    Args:
+        backend: The StorageBackend the combined files are submitted to.
+        size: Number of tickets that will be handed out.
+    """
+
+    def __init__(self, backend: "StorageBackend", size: int):
+        self.backend = backend
+        self._waiting = size
+        self._entries: List[Tuple[List[Path], str]] = []
+        self._result: "asyncio.Future[Tuple[bool, str, Optional[str]]]" = (
+            asyncio.get_running_loop().create_future()
+        )
+
+    def ticket(self) -> "BatchTicket":
+        return BatchTicket(self)
+
+    async def _submit(
+        self, image_file_paths: List[Path], commit_message: str
+    ) -> Tuple[bool, str, Optional[str]]:
+        self._entries.append((image_file_paths, commit_message))
+        self._arrive()
+        return await asyncio.shield(self._result)
+
+    def _arrive(self):
+        self._waiting -= 1
+        if self._waiting == 0:
+            asyncio.get_running_loop().create_task(self._flush())
+
+    async def _flush(self):
+        if not self._entries:
+            self._result.set_result((True, "Nothing to commit.", None))
+            return
+        if len(self._entries) == 1:
+            commit_message = self._entries[0][1]
+        else:
+            commit_message = f"Add {len(self._entries)} images via Shotput\n\n" + "\n".join(
+                message for _, message in self._entries
+            )
+        try:
+            result = await self.backend.submit(
+                [path for paths, _ in self._entries for path in paths], commit_message
+            )
+        except Exception as e:
+            result = (False, f"An error occurred during Git operation: {str(e)}", None)
+        self._result.set_result(result)
+
+
+class BatchTicket:
+    """One upload's place in a BatchCommit; used where StorageBackend.submit would be."""
+
+    def __init__(self, batch: BatchCommit):
+        self.batch = batch
+        self._used = False
+
+    async def submit(
+        self, image_file_paths: List[Path], commit_message: str
+    ) -> Tuple[bool, str, Optional[str]]:
+        if self._used:
+            # Released earlier (e.g. it waited on an identical upload that then
+            # failed), so the batch may already be committed: commit on its own
+            return await self.batch.backend.submit(image_file_paths, commit_message)
+        self._used = True
+        return await self.batch._submit(image_file_paths, commit_message)
+
+    def release(self):
+        """Tells the batch this upload has nothing (more) to commit with it."""
+        if not self._used:
+            self._used = True
+            self.batch._arrive()
 
 
 # --- Configuration ---
 CONFIG_FILE_PATH = Path("app/config.toml")
+FAVICON_PATH = Path(__file__).with_name("static") / "favicon.ico"
+# What stage_upload accepts, for clients to filter on
+ACCEPTED_UPLOAD_TYPES = ["image/png", "image/jpeg", "image/gif", "image/webp", "image/avif", "image/heic", "image/heif"]
 
 # Default configuration values
 DEFAULT_IMAGES_REPO_PATH_STR = "."  # Assuming app runs in the root of the image repo
 DEFAULT_IMAGE_SUB_DIR = "blog-media"
 DEFAULT_GIT_AUTO_PUSH = False
+DEFAULT_GIT_COMMIT_WINDOW_MS = 200
+DEFAULT_GIT_COMMIT_MAX_BATCH = 32
+DEFAULT_GIT_COMMIT_ENGINE = "plumbing"  # or "index" for the repo.index.add path
+DEFAULT_GIT_DIR = ""  # Empty means images_repo_path itself is the repository
+DEFAULT_GIT_BACKGROUND_PUSH = True
+DEFAULT_GIT_PUSH_DEBOUNCE_MS = 1000
+DEFAULT_GIT_PUSH_MAX_DELAY_MS = 10000
+DEFAULT_GIT_PUSH_RETRY_INITIAL_S = 2
+DEFAULT_GIT_PUSH_RETRY_MAX_S = 300
+DEFAULT_GIT_PUSH_REBASE = True
+DEFAULT_GIT_PUSH_REBASE_ATTEMPTS = 5
+DEFAULT_GIT_FETCH_INTERVAL_S = 60
 DEFAULT_STATIC_IO_USER = "your_github_username"  # Placeholder
 DEFAULT_STATIC_IO_REPO = "your_images_repo_name"  # Placeholder
 DEFAULT_STATIC_IO_BRANCH = "main"
 DEFAULT_APP_PORT = 8000
+DEFAULT_APP_WORKERS = 1
+DEFAULT_INGEST_IO_WORKERS = 4
+DEFAULT_INGEST_CPU_WORKERS = 2
+DEFAULT_INGEST_ASYNC_UPLOADS = False
+DEFAULT_INGEST_MAX_JOBS = 1000
+DEFAULT_STATE_DIR = ""  # Empty means <images_repo_path>/.shotput
+DEFAULT_DEDUP_ENABLED = True
+DEFAULT_DEDUP_SCAN_WORKERS = 4
+DEFAULT_SIMILAR_ENABLED = True
+DEFAULT_SIMILAR_ALGORITHM = "dhash"
+DEFAULT_SIMILAR_WARN_ON_UPLOAD = True
+DEFAULT_SIMILAR_WARN_DISTANCE = 6
+DEFAULT_SIMILAR_MAX_DISTANCE = 16
+DEFAULT_OPTIMIZE_PNG = True
+DEFAULT_DERIVATIVE_WIDTHS = [480, 960, 1600]
+DEFAULT_DERIVATIVE_FORMATS = ["avif", "webp"]
+DEFAULT_DERIVATIVE_QUALITY = {"avif": 60, "webp": 80}
+DEFAULT_PLACEHOLDERS_ENABLED = True
+DEFAULT_PLACEHOLDER_BLURHASH_COMPONENTS = [4, 3]  # [x, y]; [0, 0] disables the BlurHash
+DEFAULT_PLACEHOLDER_LQIP_SIZE = 16  # Longest side in pixels; 0 disables the LQIP
+DEFAULT_PLACEHOLDER_LQIP_QUALITY = 40
+DEFAULT_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+DEFAULT_MAX_IMAGE_PIXELS = 50_000_000
+DEFAULT_MAX_BATCH_FILES = 50
+DEFAULT_MANIFEST_ENABLED = True
+DEFAULT_RENDER_ENABLED = True
+DEFAULT_RENDER_WIDTHS = [160, 320, 480, 640, 800, 960, 1200, 1600, 1920]
+DEFAULT_RENDER_HEIGHTS = [160, 320, 480, 630, 800, 1080]
+DEFAULT_RENDER_FORMATS = ["avif", "webp", "jpeg", "png"]
+DEFAULT_RENDER_QUALITIES = [50, 60, 70, 80, 90]
+DEFAULT_RENDER_QUALITY = 80
+DEFAULT_RENDER_MEMORY_CACHE_MB = 64
+DEFAULT_RENDER_MEMORY_ITEM_MAX_KB = 512
+DEFAULT_RENDER_DISK_CACHE_MB = 1024
+DEFAULT_CLIENT_DOWNSCALE = True  # Offer browser-side downscaling in the UI
+DEFAULT_CLIENT_DOWNSCALE_DEFAULT = False  # Whether it starts switched on
+DEFAULT_CLIENT_MAX_DIMENSION = 2560
+DEFAULT_CLIENT_FORMATS = ["webp", "png"]
+DEFAULT_CLIENT_QUALITY = 90
+DEFAULT_STORAGE_BACKEND = "git"  # or "filesystem" or "s3"
+DEFAULT_STORAGE_BASE_URL = ""  # filesystem: empty means Shotput's /media URLs
+DEFAULT_S3_BUCKET = ""
+DEFAULT_S3_PREFIX = DEFAULT_IMAGE_SUB_DIR
+DEFAULT_S3_ENDPOINT_URL = ""  # Empty means AWS
+DEFAULT_S3_REGION = ""
+DEFAULT_S3_PUBLIC_BASE_URL = ""
+DEFAULT_S3_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_S3_MAX_CONCURRENCY = 16  # Upload threads (and connections) of the s3 backend
+DEFAULT_RESUMABLE_ENABLED = True
+DEFAULT_RESUMABLE_EXPIRE_S = 86400  # Delete uploads idle for a day
+DEFAULT_RESUMABLE_MAX_UPLOADS = 100
+DEFAULT_RESUMABLE_CLIENT_CHUNK_MB = 8  # The UI sends files larger than this in chunks of this size
+DEFAULT_ADMISSION_MAX_DECODES = 64
+DEFAULT_ADMISSION_MAX_QUEUED_COMMITS = 256
+DEFAULT_ADMISSION_MAX_INFLIGHT_MB = 1024
+DEFAULT_ADMISSION_RETRY_AFTER_S = 2
+DEFAULT_ADMISSION_RATE_LIMIT_PER_S = 0  # Per-client token bucket; 0 disables
+DEFAULT_ADMISSION_RATE_LIMIT_BURST = 20
+DEFAULT_ADMISSION_TRUST_FORWARDED_FOR = False
+DEFAULT_ADMISSION_HEALTH_503_WHEN_SATURATED = True
+
+
+def load_config(path: Path) -> Dict[str, Any]:
+    """
+    Reads the TOML configuration. Only reads: a missing file means the
+    defaults, and the template is written by create_app.
+    """
+    if not path.exists():
+        return {}
+    import toml
 
-# Load configuration from TOML file
-config = {}
-if CONFIG_FILE_PATH.exists():
     try:
-        config = toml.load(CONFIG_FILE_PATH)
+        return toml.load(path)
     except toml.TomlDecodeError as e:
-        print(f"Error decoding {CONFIG_FILE_PATH}: {e}. Using default configurations.")
-        config = {}
-else:
-    print(
-        f"{CONFIG_FILE_PATH} not found. Using default configurations and creating a template."
-    )
-    # Create a template config file if it doesn't exist
+        logger.error(f"Error decoding {path}: {e}. Using default configurations.")
+        return {}
+
+
+def write_template_config(path: Path):
+    """Writes a config file listing every setting with its default, for the user to edit."""
+    import toml
+
     template_config = {
         "title": "Shotput Configuration",
         "repository": {
             "images_repo_path": DEFAULT_IMAGES_REPO_PATH_STR,
             "image_sub_dir": DEFAULT_IMAGE_SUB_DIR,
             "git_auto_push": DEFAULT_GIT_AUTO_PUSH,
+            "commit_window_ms": DEFAULT_GIT_COMMIT_WINDOW_MS,
+            "commit_max_batch": DEFAULT_GIT_COMMIT_MAX_BATCH,
+            "commit_engine": DEFAULT_GIT_COMMIT_ENGINE,
+            "git_dir": DEFAULT_GIT_DIR,
+            "background_push": DEFAULT_GIT_BACKGROUND_PUSH,
+            "push_debounce_ms": DEFAULT_GIT_PUSH_DEBOUNCE_MS,
+            "push_max_delay_ms": DEFAULT_GIT_PUSH_MAX_DELAY_MS,
+            "push_retry_initial_s": DEFAULT_GIT_PUSH_RETRY_INITIAL_S,
+            "push_retry_max_s": DEFAULT_GIT_PUSH_RETRY_MAX_S,
+            "push_rebase": DEFAULT_GIT_PUSH_REBASE,
+            "push_rebase_attempts": DEFAULT_GIT_PUSH_REBASE_ATTEMPTS,
+            "fetch_interval_s": DEFAULT_GIT_FETCH_INTERVAL_S,
         },
         "static_cdn": {
             "user": DEFAULT_STATIC_IO_USER,
             "repo": DEFAULT_STATIC_IO_REPO,
             "branch": DEFAULT_STATIC_IO_BRANCH,
         },
+        "storage": {
+            "backend": DEFAULT_STORAGE_BACKEND,
+            "filesystem": {
+                "base_url": DEFAULT_STORAGE_BASE_URL,
+            },
+            "s3": {
+                "bucket": DEFAULT_S3_BUCKET,
+                "prefix": DEFAULT_S3_PREFIX,
+                "endpoint_url": DEFAULT_S3_ENDPOINT_URL,
+                "region": DEFAULT_S3_REGION,
+                "public_base_url": DEFAULT_S3_PUBLIC_BASE_URL,
+                "cache_control": DEFAULT_S3_CACHE_CONTROL,
+                "max_concurrency": DEFAULT_S3_MAX_CONCURRENCY,
+            },
+        },
+        "ingest": {
+            "io_workers": DEFAULT_INGEST_IO_WORKERS,
+            "cpu_workers": DEFAULT_INGEST_CPU_WORKERS,
+            "async_uploads": DEFAULT_INGEST_ASYNC_UPLOADS,
+            "max_jobs": DEFAULT_INGEST_MAX_JOBS,
+        },
+        "state": {
+            "dir": DEFAULT_STATE_DIR,
+        },
+        "dedup": {
+            "enabled": DEFAULT_DEDUP_ENABLED,
+            "scan_workers": DEFAULT_DEDUP_SCAN_WORKERS,
+        },
+        "similar": {
+            "enabled": DEFAULT_SIMILAR_ENABLED,
+            "algorithm": DEFAULT_SIMILAR_ALGORITHM,
+            "warn_on_upload": DEFAULT_SIMILAR_WARN_ON_UPLOAD,
+            "warn_distance": DEFAULT_SIMILAR_WARN_DISTANCE,
+            "max_distance": DEFAULT_SIMILAR_MAX_DISTANCE,
+        },
+        "optimize": {
+            "png": DEFAULT_OPTIMIZE_PNG,
+        },
+        "derivatives": {
+            "widths": DEFAULT_DERIVATIVE_WIDTHS,
+            "formats": DEFAULT_DERIVATIVE_FORMATS,
+            "quality": DEFAULT_DERIVATIVE_QUALITY,
+        },
+        "placeholders": {
+            "enabled": DEFAULT_PLACEHOLDERS_ENABLED,
+            "blurhash_components": DEFAULT_PLACEHOLDER_BLURHASH_COMPONENTS,
+            "lqip_size": DEFAULT_PLACEHOLDER_LQIP_SIZE,
+            "lqip_quality": DEFAULT_PLACEHOLDER_LQIP_QUALITY,
+        },
+        "limits": {
+            "max_upload_bytes": DEFAULT_MAX_UPLOAD_BYTES,
+            "max_image_pixels": DEFAULT_MAX_IMAGE_PIXELS,
+            "max_batch_files": DEFAULT_MAX_BATCH_FILES,
+        },
+        "manifest": {
+            "enabled": DEFAULT_MANIFEST_ENABLED,
+        },
+        "render": {
+            "enabled": DEFAULT_RENDER_ENABLED,
+            "widths": DEFAULT_RENDER_WIDTHS,
+            "heights": DEFAULT_RENDER_HEIGHTS,
+            "formats": DEFAULT_RENDER_FORMATS,
+            "qualities": DEFAULT_RENDER_QUALITIES,
+            "default_quality": DEFAULT_RENDER_QUALITY,
+            "memory_cache_mb": DEFAULT_RENDER_MEMORY_CACHE_MB,
+            "memory_item_max_kb": DEFAULT_RENDER_MEMORY_ITEM_MAX_KB,
+            "disk_cache_mb": DEFAULT_RENDER_DISK_CACHE_MB,
+        },
+        "client": {
+            "downscale": DEFAULT_CLIENT_DOWNSCALE,
+            "downscale_default": DEFAULT_CLIENT_DOWNSCALE_DEFAULT,
+            "max_dimension": DEFAULT_CLIENT_MAX_DIMENSION,
+            "formats": DEFAULT_CLIENT_FORMATS,
+            "quality": DEFAULT_CLIENT_QUALITY,
+        },
+        "resumable": {
+            "enabled": DEFAULT_RESUMABLE_ENABLED,
+            "expire_s": DEFAULT_RESUMABLE_EXPIRE_S,
+            "max_uploads": DEFAULT_RESUMABLE_MAX_UPLOADS,
+            "client_chunk_mb": DEFAULT_RESUMABLE_CLIENT_CHUNK_MB,
+        },
+        "admission": {
+            "max_decodes": DEFAULT_ADMISSION_MAX_DECODES,
+            "max_queued_commits": DEFAULT_ADMISSION_MAX_QUEUED_COMMITS,
+            "max_inflight_mb": DEFAULT_ADMISSION_MAX_INFLIGHT_MB,
+            "retry_after_s": DEFAULT_ADMISSION_RETRY_AFTER_S,
+            "rate_limit_per_s": DEFAULT_ADMISSION_RATE_LIMIT_PER_S,
+            "rate_limit_burst": DEFAULT_ADMISSION_RATE_LIMIT_BURST,
+            "trust_forwarded_for": DEFAULT_ADMISSION_TRUST_FORWARDED_FOR,
+            "health_503_when_saturated": DEFAULT_ADMISSION_HEALTH_503_WHEN_SATURATED,
+        },
     }
     try:
-        with open(CONFIG_FILE_PATH, "w") as f:
+        with open(path, "w") as f:
             toml.dump(template_config, f)
-        print(
-            f"Created a template config file at {CONFIG_FILE_PATH}. Please review and update it."
-        )
+        logger.info(f"Created a template config file at {path}. Please review and update it.")
     except Exception as e:
         print(f"Could not create template config file: {e}")
 
-# Get values from config, falling back to defaults
-repo_config = config.get("repository", {})
-cdn_config = config.get("static_cdn", {})
-server_config = config.get("server", {})
 
-IMAGES_REPO_PATH_STR = repo_config.get("images_repo_path", DEFAULT_IMAGES_REPO_PATH_STR)
-IMAGES_REPO_PATH = Path(IMAGES_REPO_PATH_STR)
-IMAGE_SUB_DIR = repo_config.get("image_sub_dir", DEFAULT_IMAGE_SUB_DIR)
-GIT_AUTO_PUSH = repo_config.get("git_auto_push", DEFAULT_GIT_AUTO_PUSH)
+def apply_config(config: Dict[str, Any]):
+    """
+    Sets the module's settings (IMAGES_REPO_PATH, STORAGE_BACKEND, ...) from a
+    parsed config, falling back to the defaults. Called by create_app (and the
+    command-line tools) rather than on import, so importing this module reads
+    no files and loads neither Pillow nor toml.
+    """
+    global IMAGES_REPO_PATH_STR, IMAGES_REPO_PATH, IMAGE_SUB_DIR, GIT_AUTO_PUSH
+    global GIT_COMMIT_WINDOW_MS, GIT_COMMIT_MAX_BATCH, GIT_COMMIT_ENGINE, GIT_DIR_STR, GIT_DIR
+    global GIT_BACKGROUND_PUSH, GIT_PUSH_DEBOUNCE_MS, GIT_PUSH_MAX_DELAY_MS
+    global GIT_PUSH_RETRY_INITIAL_S, GIT_PUSH_RETRY_MAX_S, GIT_PUSH_REBASE
+    global GIT_PUSH_REBASE_ATTEMPTS, GIT_FETCH_INTERVAL_S, STATIC_IO_USER, STATIC_IO_REPO
+    global STATIC_IO_BRANCH, STORAGE_BACKEND, STORAGE_BASE_URL, S3_BUCKET, S3_PREFIX
+    global S3_ENDPOINT_URL, S3_REGION, S3_PUBLIC_BASE_URL, S3_CACHE_CONTROL, S3_ACCESS_KEY_ID
+    global S3_SECRET_ACCESS_KEY, S3_MAX_CONCURRENCY, APP_PORT, APP_WORKERS
+    global INGEST_IO_WORKERS, INGEST_CPU_WORKERS
+    global INGEST_ASYNC_UPLOADS, INGEST_MAX_JOBS, STATE_DIR_STR, STATE_DIR, DEDUP_ENABLED
+    global DEDUP_SCAN_WORKERS, SIMILAR_ENABLED, SIMILAR_ALGORITHM, SIMILAR_WARN_ON_UPLOAD
+    global SIMILAR_WARN_DISTANCE, SIMILAR_MAX_DISTANCE, OPTIMIZE_PNG, DERIVATIVE_WIDTHS
+    global DERIVATIVE_FORMATS, DERIVATIVE_QUALITY, PLACEHOLDERS_ENABLED
+    global PLACEHOLDER_BLURHASH_COMPONENTS, PLACEHOLDER_LQIP_SIZE, PLACEHOLDER_LQIP_QUALITY
+    global MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS, MAX_BATCH_FILES, MANIFEST_ENABLED, RENDER_ENABLED
+    global RENDER_WIDTHS, RENDER_HEIGHTS, RENDER_FORMATS_ALLOWED, RENDER_QUALITIES, RENDER_QUALITY
+    global RENDER_MEMORY_CACHE_MB, RENDER_MEMORY_ITEM_MAX_KB, RENDER_DISK_CACHE_MB
+    global CLIENT_DOWNSCALE, CLIENT_DOWNSCALE_DEFAULT, CLIENT_MAX_DIMENSION, CLIENT_FORMATS
+    global CLIENT_QUALITY, RESUMABLE_ENABLED, RESUMABLE_EXPIRE_S, RESUMABLE_MAX_UPLOADS
+    global RESUMABLE_CLIENT_CHUNK_MB, ADMISSION_MAX_DECODES, ADMISSION_MAX_QUEUED_COMMITS
+    global ADMISSION_MAX_INFLIGHT_MB, ADMISSION_RETRY_AFTER_S, ADMISSION_RATE_LIMIT_PER_S
+    global ADMISSION_RATE_LIMIT_BURST, ADMISSION_TRUST_FORWARDED_FOR
+    global ADMISSION_HEALTH_503_WHEN_SATURATED
+
+    # Get values from config, falling back to defaults
+    repo_config = config.get("repository", {})
+    cdn_config = config.get("static_cdn", {})
+    storage_config = config.get("storage", {})
+    server_config = config.get("server", {})
+    ingest_config = config.get("ingest", {})
+    state_config = config.get("state", {})
+    dedup_config = config.get("dedup", {})
+    similar_config = config.get("similar", {})
+    optimize_config = config.get("optimize", {})
+    derivatives_config = config.get("derivatives", {})
+    placeholders_config = config.get("placeholders", {})
+    limits_config = config.get("limits", {})
+    manifest_config = config.get("manifest", {})
+    render_config = config.get("render", {})
+    client_config = config.get("client", {})
+    resumable_config = config.get("resumable", {})
+    admission_config = config.get("admission", {})
+
+    IMAGES_REPO_PATH_STR = repo_config.get("images_repo_path", DEFAULT_IMAGES_REPO_PATH_STR)
+    IMAGES_REPO_PATH = Path(IMAGES_REPO_PATH_STR)
+    IMAGE_SUB_DIR = repo_config.get("image_sub_dir", DEFAULT_IMAGE_SUB_DIR)
+    GIT_AUTO_PUSH = repo_config.get("git_auto_push", DEFAULT_GIT_AUTO_PUSH)
+    GIT_COMMIT_WINDOW_MS = repo_config.get("commit_window_ms", DEFAULT_GIT_COMMIT_WINDOW_MS)
+    GIT_COMMIT_MAX_BATCH = repo_config.get("commit_max_batch", DEFAULT_GIT_COMMIT_MAX_BATCH)
+    GIT_COMMIT_ENGINE = repo_config.get("commit_engine", DEFAULT_GIT_COMMIT_ENGINE)
+    GIT_DIR_STR = repo_config.get("git_dir", DEFAULT_GIT_DIR)
+    GIT_DIR = Path(GIT_DIR_STR) if GIT_DIR_STR else IMAGES_REPO_PATH
+    GIT_BACKGROUND_PUSH = repo_config.get("background_push", DEFAULT_GIT_BACKGROUND_PUSH)
+    GIT_PUSH_DEBOUNCE_MS = repo_config.get("push_debounce_ms", DEFAULT_GIT_PUSH_DEBOUNCE_MS)
+    GIT_PUSH_MAX_DELAY_MS = repo_config.get("push_max_delay_ms", DEFAULT_GIT_PUSH_MAX_DELAY_MS)
+    GIT_PUSH_RETRY_INITIAL_S = repo_config.get("push_retry_initial_s", DEFAULT_GIT_PUSH_RETRY_INITIAL_S)
+    GIT_PUSH_RETRY_MAX_S = repo_config.get("push_retry_max_s", DEFAULT_GIT_PUSH_RETRY_MAX_S)
+    GIT_PUSH_REBASE = repo_config.get("push_rebase", DEFAULT_GIT_PUSH_REBASE)
+    GIT_PUSH_REBASE_ATTEMPTS = repo_config.get("push_rebase_attempts", DEFAULT_GIT_PUSH_REBASE_ATTEMPTS)
+    GIT_FETCH_INTERVAL_S = repo_config.get("fetch_interval_s", DEFAULT_GIT_FETCH_INTERVAL_S)
+
+    STATIC_IO_USER = cdn_config.get("user", DEFAULT_STATIC_IO_USER)
+    STATIC_IO_REPO = cdn_config.get("repo", DEFAULT_STATIC_IO_REPO)
+    STATIC_IO_BRANCH = cdn_config.get("branch", DEFAULT_STATIC_IO_BRANCH)
+
+    STORAGE_BACKEND = storage_config.get("backend", DEFAULT_STORAGE_BACKEND)
+    if STORAGE_BACKEND not in BACKENDS:
+        logger.warning(f"Unknown storage backend '{STORAGE_BACKEND}'. Using 'git'.")
+        STORAGE_BACKEND = "git"
+    STORAGE_BASE_URL = storage_config.get("filesystem", {}).get("base_url", DEFAULT_STORAGE_BASE_URL)
+    s3_config = storage_config.get("s3", {})
+    S3_BUCKET = s3_config.get("bucket", DEFAULT_S3_BUCKET)
+    S3_PREFIX = s3_config.get("prefix", DEFAULT_S3_PREFIX)
+    S3_ENDPOINT_URL = s3_config.get("endpoint_url", DEFAULT_S3_ENDPOINT_URL)
+    S3_REGION = s3_config.get("region", DEFAULT_S3_REGION)
+    S3_PUBLIC_BASE_URL = s3_config.get("public_base_url", DEFAULT_S3_PUBLIC_BASE_URL)
+    S3_CACHE_CONTROL = s3_config.get("cache_control", DEFAULT_S3_CACHE_CONTROL)
+    S3_MAX_CONCURRENCY = s3_config.get("max_concurrency", DEFAULT_S3_MAX_CONCURRENCY)
+    # Usually left to the AWS environment variables or shared config instead
+    S3_ACCESS_KEY_ID = s3_config.get("access_key_id", "")
+    S3_SECRET_ACCESS_KEY = s3_config.get("secret_access_key", "")
+
+    # Server configuration
+    APP_PORT = server_config.get("port", DEFAULT_APP_PORT)
+    APP_WORKERS = server_config.get("workers", DEFAULT_APP_WORKERS)
+
+    # Ingest pipeline configuration
+    INGEST_IO_WORKERS = ingest_config.get("io_workers", DEFAULT_INGEST_IO_WORKERS)
+    INGEST_CPU_WORKERS = ingest_config.get("cpu_workers", DEFAULT_INGEST_CPU_WORKERS)
+    INGEST_ASYNC_UPLOADS = ingest_config.get("async_uploads", DEFAULT_INGEST_ASYNC_UPLOADS)
+    INGEST_MAX_JOBS = ingest_config.get("max_jobs", DEFAULT_INGEST_MAX_JOBS)
+
+    # Local state (indexes, caches); never committed
+    STATE_DIR_STR = state_config.get("dir", DEFAULT_STATE_DIR)
+    STATE_DIR = Path(STATE_DIR_STR) if STATE_DIR_STR else IMAGES_REPO_PATH / ".shotput"
+
+    # Content-hash deduplication of uploads
+    DEDUP_ENABLED = dedup_config.get("enabled", DEFAULT_DEDUP_ENABLED)
+    DEDUP_SCAN_WORKERS = dedup_config.get("scan_workers", DEFAULT_DEDUP_SCAN_WORKERS)
+
+    # Perceptual near-duplicate detection
+    SIMILAR_ENABLED = similar_config.get("enabled", DEFAULT_SIMILAR_ENABLED)
+    SIMILAR_ALGORITHM = similar_config.get("algorithm", DEFAULT_SIMILAR_ALGORITHM)
+    SIMILAR_WARN_ON_UPLOAD = similar_config.get("warn_on_upload", DEFAULT_SIMILAR_WARN_ON_UPLOAD)
+    SIMILAR_WARN_DISTANCE = similar_config.get("warn_distance", DEFAULT_SIMILAR_WARN_DISTANCE)
+    SIMILAR_MAX_DISTANCE = similar_config.get("max_distance", DEFAULT_SIMILAR_MAX_DISTANCE)
+
+    # Lossless optimization of uploads
+    OPTIMIZE_PNG = optimize_config.get("png", DEFAULT_OPTIMIZE_PNG)
+
+    # Responsive WebP/AVIF derivatives; formats this Pillow build cannot encode are dropped
+    DERIVATIVE_WIDTHS = derivatives_config.get("widths", DEFAULT_DERIVATIVE_WIDTHS)
+    DERIVATIVE_FORMATS = supported_derivative_formats(
+        derivatives_config.get("formats", DEFAULT_DERIVATIVE_FORMATS)
+    )
+    DERIVATIVE_QUALITY = {**DEFAULT_DERIVATIVE_QUALITY, **derivatives_config.get("quality", {})}
+    PLACEHOLDERS_ENABLED = placeholders_config.get("enabled", DEFAULT_PLACEHOLDERS_ENABLED)
+    PLACEHOLDER_BLURHASH_COMPONENTS = tuple(
+        placeholders_config.get("blurhash_components", DEFAULT_PLACEHOLDER_BLURHASH_COMPONENTS)
+    )
+    PLACEHOLDER_LQIP_SIZE = placeholders_config.get("lqip_size", DEFAULT_PLACEHOLDER_LQIP_SIZE)
+    PLACEHOLDER_LQIP_QUALITY = placeholders_config.get("lqip_quality", DEFAULT_PLACEHOLDER_LQIP_QUALITY)
+
+    # Upload limits, enforced while streaming and from the image header (0 disables)
+    MAX_UPLOAD_BYTES = limits_config.get("max_upload_bytes", DEFAULT_MAX_UPLOAD_BYTES)
+    MAX_IMAGE_PIXELS = limits_config.get("max_image_pixels", DEFAULT_MAX_IMAGE_PIXELS)
+    MAX_BATCH_FILES = limits_config.get("max_batch_files", DEFAULT_MAX_BATCH_FILES)
+
+    # Media manifest behind /images and /gallery
+    MANIFEST_ENABLED = manifest_config.get("enabled", DEFAULT_MANIFEST_ENABLED)
+
+    # On-demand renders (/img/{name}); only allowlisted parameters are accepted
+    RENDER_ENABLED = render_config.get("enabled", DEFAULT_RENDER_ENABLED)
+    RENDER_WIDTHS = set(render_config.get("widths", DEFAULT_RENDER_WIDTHS))
+    RENDER_HEIGHTS = set(render_config.get("heights", DEFAULT_RENDER_HEIGHTS))
+    RENDER_FORMATS_ALLOWED = supported_render_formats(render_config.get("formats", DEFAULT_RENDER_FORMATS))
+    RENDER_QUALITIES = set(render_config.get("qualities", DEFAULT_RENDER_QUALITIES))
+    RENDER_QUALITY = render_config.get("default_quality", DEFAULT_RENDER_QUALITY)
+    RENDER_MEMORY_CACHE_MB = render_config.get("memory_cache_mb", DEFAULT_RENDER_MEMORY_CACHE_MB)
+    RENDER_MEMORY_ITEM_MAX_KB = render_config.get("memory_item_max_kb", DEFAULT_RENDER_MEMORY_ITEM_MAX_KB)
+    RENDER_DISK_CACHE_MB = render_config.get("disk_cache_mb", DEFAULT_RENDER_DISK_CACHE_MB)
+    CLIENT_DOWNSCALE = client_config.get("downscale", DEFAULT_CLIENT_DOWNSCALE)
+    CLIENT_DOWNSCALE_DEFAULT = client_config.get("downscale_default", DEFAULT_CLIENT_DOWNSCALE_DEFAULT)
+    CLIENT_MAX_DIMENSION = client_config.get("max_dimension", DEFAULT_CLIENT_MAX_DIMENSION)
+    CLIENT_FORMATS = [
+        fmt for fmt in client_config.get("formats", DEFAULT_CLIENT_FORMATS) if fmt in ("webp", "png", "jpeg")
+    ]
+    CLIENT_QUALITY = client_config.get("quality", DEFAULT_CLIENT_QUALITY)
+    RESUMABLE_ENABLED = resumable_config.get("enabled", DEFAULT_RESUMABLE_ENABLED)
+    RESUMABLE_EXPIRE_S = resumable_config.get("expire_s", DEFAULT_RESUMABLE_EXPIRE_S)
+    RESUMABLE_MAX_UPLOADS = resumable_config.get("max_uploads", DEFAULT_RESUMABLE_MAX_UPLOADS)
+    RESUMABLE_CLIENT_CHUNK_MB = resumable_config.get("client_chunk_mb", DEFAULT_RESUMABLE_CLIENT_CHUNK_MB)
+    ADMISSION_MAX_DECODES = admission_config.get("max_decodes", DEFAULT_ADMISSION_MAX_DECODES)
+    ADMISSION_MAX_QUEUED_COMMITS = admission_config.get("max_queued_commits", DEFAULT_ADMISSION_MAX_QUEUED_COMMITS)
+    ADMISSION_MAX_INFLIGHT_MB = admission_config.get("max_inflight_mb", DEFAULT_ADMISSION_MAX_INFLIGHT_MB)
+    ADMISSION_RETRY_AFTER_S = admission_config.get("retry_after_s", DEFAULT_ADMISSION_RETRY_AFTER_S)
+    ADMISSION_RATE_LIMIT_PER_S = admission_config.get("rate_limit_per_s", DEFAULT_ADMISSION_RATE_LIMIT_PER_S)
+    ADMISSION_RATE_LIMIT_BURST = admission_config.get("rate_limit_burst", DEFAULT_ADMISSION_RATE_LIMIT_BURST)
+    ADMISSION_TRUST_FORWARDED_FOR = admission_config.get("trust_forwarded_for", DEFAULT_ADMISSION_TRUST_FORWARDED_FOR)
+    ADMISSION_HEALTH_503_WHEN_SATURATED = admission_config.get(
+        "health_503_when_saturated", DEFAULT_ADMISSION_HEALTH_503_WHEN_SATURATED
+    )
 
-STATIC_IO_USER = cdn_config.get("user", DEFAULT_STATIC_IO_USER)
-STATIC_IO_REPO = cdn_config.get("repo", DEFAULT_STATIC_IO_REPO)
-STATIC_IO_BRANCH = cdn_config.get("branch", DEFAULT_STATIC_IO_BRANCH)
+    if SIMILAR_ALGORITHM not in PERCEPTUAL_HASH_ALGORITHMS:
+        logger.warning(
+            f"Invalid similar.algorithm '{SIMILAR_ALGORITHM}'. Using default '{DEFAULT_SIMILAR_ALGORITHM}'."
+        )
+        SIMILAR_ALGORITHM = DEFAULT_SIMILAR_ALGORITHM
 
-# Server configuration
-APP_PORT = server_config.get("port", DEFAULT_APP_PORT)
+    # Ensure IMAGE_SUB_DIR is not empty and is a valid relative path component
+    if not IMAGE_SUB_DIR or any(c in IMAGE_SUB_DIR for c in ["/", "\\", ".."]):
+        print(
+            f"Warning: Invalid IMAGE_SUB_DIR '{IMAGE_SUB_DIR}'. Using default '{DEFAULT_IMAGE_SUB_DIR}'."
+        )
+        IMAGE_SUB_DIR = DEFAULT_IMAGE_SUB_DIR
 
-# Ensure IMAGE_SUB_DIR is not empty and is a valid relative path component
-if not IMAGE_SUB_DIR or any(c in IMAGE_SUB_DIR for c in ["/", "\\", ".."]):
-    print(
-        f"Warning: Invalid IMAGE_SUB_DIR '{IMAGE_SUB_DIR}'. Using default '{DEFAULT_IMAGE_SUB_DIR}'."
-    )
-    IMAGE_SUB_DIR = DEFAULT_IMAGE_SUB_DIR
 
 # --- End Configuration ---
 
@@ -300,6 +1040,7 @@ INDEX_HTML_CONTENT = """
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <link rel="icon" href="/favicon.ico" sizes="any">
     <link rel="icon" href="data:image/svg+xml,<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 16 16' fill='%2366ccff'><path d='M.5 9.9a.5.5 0 0 1 .5.5v2.5a1 1 0 0 0 1 1h12a1 1 0 0 0 1-1v-2.5a.5.5 0 0 1 1 0v2.5a2 2 0 0 1-2 2H2a2 2 0 0 1-2-2v-2.5a.5.5 0 0 1 .5-.5z'/><path d='M7.646 11.854a.5.5 0 0 0 .708 0l3-3a.5.5 0 0 0-.708-.708L8.5 10.293V1.5a.5.5 0 0 0-1 0v8.793L5.354 8.146a.5.5 0 1 0-.708.708l3 3z'/></svg>" type="image/svg+xml">
     <title>Shotput - Put your screenshots wherever you want</title>
     <style>
@@ -331,6 +1072,17 @@ INDEX_HTML_CONTENT = """
             font-size: 2.8em; /* Slightly larger heading */
             text-shadow: 0 0 12px rgba(102, 204, 255, 0.6); /* Enhanced text glow */
         }
+        .gallery-link a {
+            color: #66ccff;
+            font-size: 0.95em;
+        }
+        .upload-option {
+            display: block;
+            margin-top: 12px;
+            color: #c0c0c0;
+            font-size: 0.9em;
+            cursor: pointer;
+        }
         .tagline {
             color: #c0c0c0; /* Light grey, slightly dimmer than main text */
             font-size: 1.1em;
@@ -403,6 +1155,36 @@ INDEX_HTML_CONTENT = """
             text-decoration: underline;
             color: #99ddff; /* Lighter blue on hover */
         }
+        .file-list {
+            list-style: none;
+            margin: 0 0 10px 0;
+            padding: 0;
+        }
+        .file-row {
+            display: flex;
+            align-items: center;
+            gap: 10px;
+            padding: 6px 0;
+            border-bottom: 1px solid rgba(102, 204, 255, 0.15);
+            font-size: 0.9em;
+        }
+        .file-row .file-name {
+            flex: 1;
+            overflow: hidden;
+            text-overflow: ellipsis;
+            white-space: nowrap;
+        }
+        .file-row progress {
+            width: 100px;
+            accent-color: #66ccff;
+        }
+        .file-row .file-status {
+            flex: 1;
+            text-align: right;
+        }
+        .file-row.error .file-status {
+            color: #ff6b6b;
+        }
         #copyButton {
             background-color: #66ccff; /* Accent color */
             color: #0f0c29; /* Dark text for contrast on light blue button */
@@ -481,21 +1263,31 @@ INDEX_HTML_CONTENT = """
     <div class="container">
         <h1>Shotput</h1>
         <p class="tagline">Put your screenshots wherever you want</p>
+        <p class="gallery-link"><a href="/gallery">Browse uploads</a></p>
         <div id="pasteArea" tabindex="0">
             <p>Drop files or paste (Ctrl+V / Cmd+V)</p>
             <p><small>(Click to select file)</small></p>
             <img id="preview" src="#" alt="Image preview" style="display:none;"/>
         </div>
-        <input type="file" id="fileInput" accept="image/*" style="display:none;">
+        <input type="file" id="fileInput" accept="image/*" multiple style="display:none;">
+        <label id="downscaleOption" class="upload-option" style="display:none;">
+            <input type="checkbox" id="downscaleToggle">
+            Shrink large images in the browser before uploading (max <span id="downscaleMax"></span>px)
+        </label>
         <div class="loader" id="loader"></div>
         <div id="result" class="result-container" style="display:none;">
             <p><strong>CDN Link:</strong> <a id="cdnLink" href="#" target="_blank"></a> <button id="copyCdnButton" class="copy-link-btn">Copy</button></p>
             <p><strong>Markdown:</strong> <code id="markdownLink"></code> <button id="copyMarkdownButton" class="copy-link-btn">Copy</button></p>
+            <p id="pictureRow" style="display:none;"><strong>HTML:</strong> <code id="pictureHtml"></code> <button id="copyPictureButton" class="copy-link-btn">Copy</button></p>
+        </div>
+        <div id="batchResult" class="result-container" style="display:none;">
+            <ul id="fileList" class="file-list"></ul>
+            <button id="copyAllButton" class="copy-link-btn">Copy all Markdown</button>
         </div>
         <div id="statusMessage" class="status-message"></div>
     </div>
 
-    <script src="script.js"></script>
+    <script src="/script.js"></script>
 </body>
 </html>
 """
@@ -511,8 +1303,101 @@ document.addEventListener('DOMContentLoaded', () => {
     const markdownLink = document.getElementById('markdownLink');
     const copyCdnButton = document.getElementById('copyCdnButton');
     const copyMarkdownButton = document.getElementById('copyMarkdownButton');
+    const pictureRow = document.getElementById('pictureRow');
+    const pictureHtml = document.getElementById('pictureHtml');
+    const copyPictureButton = document.getElementById('copyPictureButton');
     const statusMessage = document.getElementById('statusMessage');
     const loader = document.getElementById('loader');
+    const batchResult = document.getElementById('batchResult');
+    const fileList = document.getElementById('fileList');
+    const copyAllButton = document.getElementById('copyAllButton');
+    const downscaleOption = document.getElementById('downscaleOption');
+    const downscaleToggle = document.getElementById('downscaleToggle');
+    const downscaleMax = document.getElementById('downscaleMax');
+
+    // Limits and downscaling settings from /config; uploads work without them
+    let serverConfig = null;
+    let downscaleWorker = null;
+    let nextPrepareId = 0;
+    const pendingPrepares = new Map();
+
+    fetch('/config')
+        .then(response => response.ok ? response.json() : null)
+        .then(config => {
+            serverConfig = config;
+            const downscale = config && config.downscale;
+            if (!downscale || !downscale.available || typeof Worker === 'undefined'
+                || typeof OffscreenCanvas === 'undefined' || typeof createImageBitmap === 'undefined') {
+                return;
+            }
+            const saved = localStorage.getItem('shotput.downscale');
+            downscaleToggle.checked = saved === null ? downscale.default : saved === 'on';
+            downscaleMax.textContent = downscale.max_dimension;
+            downscaleOption.style.display = 'block';
+        })
+        .catch(err => console.warn('Could not load /config: ', err));
+
+    downscaleToggle.addEventListener('change', () => {
+        localStorage.setItem('shotput.downscale', downscaleToggle.checked ? 'on' : 'off');
+    });
+
+    // Downscales and re-encodes a file in a worker when enabled and worthwhile.
+    // Resolves to { file, note }: the file to upload (the original on any
+    // problem, the server validates either way) and a description of the change.
+    function prepareFile(file) {
+        const downscale = serverConfig && serverConfig.downscale;
+        if (!downscale || !downscaleToggle.checked || downscaleOption.style.display === 'none'
+            || !downscale.input_types.includes(file.type)) {
+            return Promise.resolve({ file, note: '' });
+        }
+        if (!downscaleWorker) {
+            downscaleWorker = new Worker(downscale.worker_url);
+            downscaleWorker.onmessage = (event) => {
+                const resolve = pendingPrepares.get(event.data.id);
+                pendingPrepares.delete(event.data.id);
+                if (resolve) resolve(event.data);
+            };
+            downscaleWorker.onerror = (event) => {
+                console.warn('Downscale worker failed: ', event.message);
+                pendingPrepares.forEach(resolve => resolve({ blob: null }));
+                pendingPrepares.clear();
+            };
+        }
+        const id = nextPrepareId++;
+        return new Promise(resolve => {
+            pendingPrepares.set(id, resolve);
+            downscaleWorker.postMessage({
+                id,
+                file,
+                maxDimension: downscale.max_dimension,
+                formats: downscale.formats,
+                quality: downscale.quality,
+            });
+        }).then(result => {
+            if (!result.blob) {
+                if (result.error) console.warn('Downscaling skipped: ', result.error);
+                return { file, note: '' };
+            }
+            const extension = result.blob.type.split('/')[1] === 'jpeg' ? 'jpg' : result.blob.type.split('/')[1];
+            const stem = (file.name || 'image').replace(/\.[^.]*$/, '');
+            const prepared = new File([result.blob], `${stem}.${extension}`, { type: result.blob.type });
+            const resized = result.outWidth !== result.width
+                ? `Resized ${result.width}×${result.height} → ${result.outWidth}×${result.outHeight}, `
+                : 'Re-encoded, ';
+            return { file: prepared, note: `${resized}${formatBytes(file.size)} → ${formatBytes(prepared.size)}.` };
+        });
+    }
+
+    function tooLarge(file) {
+        const limit = serverConfig && serverConfig.upload && serverConfig.upload.max_upload_bytes;
+        return limit && file.size > limit ? `Too large (${formatBytes(file.size)}, the limit is ${formatBytes(limit)}).` : '';
+    }
+
+    function formatBytes(n) {
+        if (n < 1024) return `${n} B`;
+        if (n < 1024 * 1024) return `${(n / 1024).toFixed(1)} KB`;
+        return `${(n / 1024 / 1024).toFixed(1)} MB`;
+    }
 
     // Handle click on pasteArea to trigger file input
     pasteArea.addEventListener('click', () => {
@@ -520,25 +1405,26 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     fileInput.addEventListener('change', (event) => {
-        const files = event.target.files;
-        if (files.length > 0) {
-            handleFile(files[0]);
-        }
+        handleFiles(event.target.files);
+        fileInput.value = ''; // Selecting the same files again still fires 'change'
     });
 
     // Handle paste event
     document.addEventListener('paste', (event) => {
         const items = (event.clipboardData || event.originalEvent.clipboardData).items;
+        const files = [];
         for (let item of items) {
             if (item.kind === 'file' && item.type.startsWith('image/')) {
                 const file = item.getAsFile();
                 if (file) {
-                    handleFile(file);
-                    event.preventDefault(); // Prevent pasting as text/image in contentEditable
-                    return;
+                    files.push(file);
                 }
             }
         }
+        if (files.length > 0) {
+            event.preventDefault(); // Prevent pasting as text/image in contentEditable
+            handleFiles(files);
+        }
     });
 
     // Handle drag and drop
@@ -554,10 +1440,7 @@ document.addEventListener('DOMContentLoaded', () => {
     pasteArea.addEventListener('drop', (event) => {
         event.preventDefault();
         pasteArea.classList.remove('dragover');
-        const files = event.dataTransfer.files;
-        if (files.length > 0) {
-            handleFile(files[0]);
-        }
+        handleFiles(event.dataTransfer.files);
     });
     
     // Make pasteArea focusable for keyboard paste
@@ -567,6 +1450,23 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    function handleFiles(fileList) {
+        const files = Array.from(fileList || []);
+        if (files.length === 0) {
+            return;
+        }
+        if (files.length === 1) {
+            handleFile(files[0]);
+            return;
+        }
+        const images = files.filter(file => file.type.startsWith('image/'));
+        if (images.length === 0) {
+            showStatus('Please upload image files.', true);
+            return;
+        }
+        uploadBatch(images);
+    }
+
     function handleFile(file) {
         if (!file.type.startsWith('image/')) {
             showStatus('Please upload an image file.', true);
@@ -585,19 +1485,32 @@ document.addEventListener('DOMContentLoaded', () => {
         uploadFile(file);
     }
 
-    async function uploadFile(file) {
+    async function uploadFile(original) {
         showLoader(true);
         showStatus(''); 
         resultDiv.style.display = 'none'; 
-
-        const formData = new FormData();
-        formData.append('image_blob', file);
+        batchResult.style.display = 'none';
 
         try {
-            const response = await fetch('/upload_image/', {
-                method: 'POST',
-                body: formData,
-            });
+            const { file, note } = await prepareFile(original);
+            const rejection = tooLarge(file);
+            if (rejection) {
+                throw new Error(rejection);
+            }
+            const resumable = serverConfig && serverConfig.resumable;
+            let response;
+            if (resumable && resumable.available && file.size > resumable.chunk_bytes) {
+                response = await resumableUpload(file, resumable, (sent) => {
+                    showStatus(`Uploading… ${Math.floor(100 * sent / file.size)}%`);
+                });
+            } else {
+                const formData = new FormData();
+                formData.append('image_blob', file);
+                response = await fetch('/upload_image/', {
+                    method: 'POST',
+                    body: formData,
+                });
+            }
 
             showLoader(false);
 
@@ -607,12 +1520,23 @@ document.addEventListener('DOMContentLoaded', () => {
                 cdnLink.textContent = data.cdn_url;
                 const markdown = `![${data.image_name}](${data.cdn_url})`;
                 markdownLink.textContent = markdown;
+                // Sized <img>/<picture> with the placeholder, so pages reserve the space
+                const snippet = data.picture_html || data.img_html || '';
+                pictureHtml.textContent = snippet;
+                pictureRow.style.display = snippet ? 'block' : 'none';
                 resultDiv.style.display = 'block';
-                showStatus('Image uploaded successfully!', false);
+                const suffix = note ? ` ${note}` : '';
+                if (data.similar && data.similar.length > 0) {
+                    showStatus(`Uploaded, but it looks like ${data.similar[0].image_name} (distance ${data.similar[0].distance}).${suffix}`, false);
+                } else {
+                    showStatus((data.duplicate ? 'Image already uploaded, reusing its link.' : 'Image uploaded successfully!') + suffix, false);
+                }
                 copyCdnButton.textContent = 'Copy';
                 copyCdnButton.classList.remove('copied');
                 copyMarkdownButton.textContent = 'Copy';
                 copyMarkdownButton.classList.remove('copied');
+                copyPictureButton.textContent = 'Copy';
+                copyPictureButton.classList.remove('copied');
             } else {
                 const errorData = await response.json();
                 showStatus(`Error: ${errorData.detail || response.statusText}`, true);
@@ -622,13 +1546,231 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         } catch (error) {
             showLoader(false);
-            showStatus(`Network error: ${error.message}`, true);
+            showStatus(error instanceof TypeError ? `Network error: ${error.message}` : `Error: ${error.message}`, true);
             preview.style.display = 'none'; 
             preview.src = '#'; 
             pasteAreaPrompts.forEach(p => p.style.display = ''); 
         }
     }
 
+    // Large files go to /uploads/ (tus) in chunks. When a chunk fails, the
+    // server's offset is fetched again and the upload continues from there, so
+    // a dropped connection costs at most one chunk. Returns the response of
+    // the finalize request, or the first error response.
+    async function resumableUpload(file, resumable, onProgress) {
+        const tus = { 'Tus-Resumable': '1.0.0' };
+        const created = await fetch(resumable.endpoint, {
+            method: 'POST',
+            headers: {
+                ...tus,
+                'Upload-Length': String(file.size),
+                'Upload-Metadata': 'filename ' + btoa(unescape(encodeURIComponent(file.name || 'image'))),
+            },
+        });
+        if (!created.ok) {
+            return created;
+        }
+        const location = created.headers.get('Location');
+        let offset = 0;
+        let failures = 0;
+        while (offset < file.size) {
+            let response = null;
+            try {
+                response = await fetch(location, {
+                    method: 'PATCH',
+                    headers: { ...tus, 'Upload-Offset': String(offset), 'Content-Type': 'application/offset+octet-stream' },
+                    body: file.slice(offset, offset + resumable.chunk_bytes),
+                });
+            } catch (error) {
+                if (++failures > 8) throw error;
+            }
+            if (response && response.status === 204) {
+                offset = Number(response.headers.get('Upload-Offset'));
+                failures = 0;
+                onProgress(offset);
+                continue;
+            }
+            if (response && response.status !== 409) {
+                return response;
+            }
+            // Lost or conflicting: wait, then ask the server what it has
+            if (response && ++failures > 8) return response;
+            await new Promise(resolve => setTimeout(resolve, Math.min(1000 * 2 ** (failures - 1), 30000)));
+            try {
+                const head = await fetch(location, { method: 'HEAD', headers: tus });
+                if (head.status === 404) {
+                    throw new Error('The upload expired on the server. Please try again.');
+                }
+                if (head.ok) {
+                    offset = Number(head.headers.get('Upload-Offset'));
+                    onProgress(offset);
+                }
+            } catch (error) {
+                if (!(error instanceof TypeError)) throw error; // Offline: retry the chunk
+            }
+        }
+        return fetch(`${location}/finalize`, { method: 'POST' });
+    }
+
+    // Several files go to /upload_images/ in one request and one commit. The
+    // multipart body carries the files in order, so the bytes sent so far
+    // tell how far along each file is.
+    async function uploadBatch(originals) {
+        showStatus('');
+        resultDiv.style.display = 'none';
+        preview.style.display = 'none';
+        preview.src = '#';
+        pasteAreaPrompts.forEach(p => p.style.display = '');
+        fileList.innerHTML = '';
+        copyAllButton.disabled = true;
+        batchResult.style.display = 'block';
+
+        const rows = originals.map(file => {
+            const li = document.createElement('li');
+            li.className = 'file-row';
+            const name = document.createElement('span');
+            name.className = 'file-name';
+            name.textContent = file.name || 'pasted image';
+            const progress = document.createElement('progress');
+            progress.max = 100;
+            progress.value = 0;
+            const status = document.createElement('span');
+            status.className = 'file-status';
+            status.textContent = 'Preparing';
+            li.append(name, progress, status);
+            fileList.appendChild(li);
+            return { li, progress, status };
+        });
+
+        // One at a time: the worker is single-threaded anyway, and decoded
+        // bitmaps of several large photos at once would be a lot of memory
+        const files = [];
+        for (let i = 0; i < originals.length; i++) {
+            const { file, note } = await prepareFile(originals[i]);
+            files.push(file);
+            rows[i].li.title = note;
+            rows[i].status.textContent = 'Queued';
+        }
+        const rejection = files.map(tooLarge).find(Boolean);
+        if (rejection) {
+            files.forEach((file, i) => {
+                const reason = tooLarge(file);
+                if (reason) {
+                    rows[i].status.textContent = reason;
+                    rows[i].li.classList.add('error');
+                }
+            });
+            showStatus('Some files are too large to upload; nothing was sent.', true);
+            return;
+        }
+
+        const formData = new FormData();
+        files.forEach(file => formData.append('image_blobs', file));
+
+        const totalBytes = files.reduce((sum, file) => sum + file.size, 0);
+        const xhr = new XMLHttpRequest();
+        xhr.open('POST', '/upload_images/');
+        xhr.responseType = 'json';
+        xhr.upload.onprogress = (event) => {
+            // Scale to the file sizes; the multipart framing is a rounding error
+            const sent = event.lengthComputable ? event.loaded * totalBytes / event.total : 0;
+            let offset = 0;
+            files.forEach((file, i) => {
+                const done = Math.min(Math.max(sent - offset, 0), file.size);
+                rows[i].progress.value = file.size ? 100 * done / file.size : 100;
+                rows[i].status.textContent = done >= file.size ? 'Sent' : (done > 0 ? 'Uploading' : 'Queued');
+                offset += file.size;
+            });
+        };
+        xhr.upload.onload = () => {
+            rows.forEach(row => {
+                row.progress.value = 100;
+                row.progress.removeAttribute('value'); // Indeterminate while the server works
+                row.status.textContent = 'Processing';
+            });
+        };
+        xhr.onload = () => {
+            const data = xhr.response || {};
+            if (xhr.status !== 200 || !data.results) {
+                rows.forEach(row => {
+                    row.progress.value = 0;
+                    row.status.textContent = 'Failed';
+                    row.li.classList.add('error');
+                });
+                showStatus(`Error: ${data.detail || xhr.statusText}`, true);
+                return;
+            }
+            data.results.forEach((result, i) => showBatchResult(rows[i], result));
+            copyAllButton.disabled = data.succeeded === 0;
+            if (data.failed > 0) {
+                showStatus(`${data.succeeded} of ${data.results.length} images uploaded, ${data.failed} failed.`, true);
+            } else {
+                showStatus(`${data.succeeded} images uploaded successfully!`, false);
+            }
+        };
+        xhr.onerror = () => {
+            rows.forEach(row => {
+                row.status.textContent = 'Failed';
+                row.li.classList.add('error');
+            });
+            showStatus('Network error while uploading.', true);
+        };
+        xhr.send(formData);
+    }
+
+    function showBatchResult(row, result) {
+        row.progress.value = 100;
+        if (!result.ok) {
+            row.progress.value = 0;
+            row.status.textContent = result.detail;
+            row.li.classList.add('error');
+            return;
+        }
+        const markdown = `![${result.image_name}](${result.cdn_url})`;
+        row.li.dataset.markdown = markdown;
+        row.status.textContent = '';
+        const link = document.createElement('a');
+        link.href = result.cdn_url;
+        link.target = '_blank';
+        link.textContent = result.duplicate ? 'Already uploaded' : 'Uploaded';
+        const copy = document.createElement('button');
+        copy.className = 'copy-link-btn';
+        copy.textContent = 'Copy Markdown';
+        copy.addEventListener('click', () => copyText(copy, markdown, 'Copy Markdown'));
+        row.status.append(link, ' ', copy);
+        const snippet = result.picture_html || result.img_html;
+        if (snippet) {
+            const copyHtml = document.createElement('button');
+            copyHtml.className = 'copy-link-btn';
+            copyHtml.textContent = 'Copy HTML';
+            copyHtml.addEventListener('click', () => copyText(copyHtml, snippet, 'Copy HTML'));
+            row.status.append(' ', copyHtml);
+        }
+    }
+
+    function copyText(button, text, label) {
+        navigator.clipboard.writeText(text)
+            .then(() => {
+                button.textContent = 'Copied!';
+                button.classList.add('copied');
+                setTimeout(() => {
+                    button.textContent = label;
+                    button.classList.remove('copied');
+                }, 2000);
+            })
+            .catch(err => {
+                showStatus('Failed to copy.', true);
+                console.error('Failed to copy: ', err);
+            });
+    }
+
+    copyAllButton.addEventListener('click', () => {
+        const markdown = Array.from(fileList.querySelectorAll('li[data-markdown]'))
+            .map(li => li.dataset.markdown)
+            .join('\\n');
+        copyText(copyAllButton, markdown, 'Copy all Markdown');
+    });
+
     copyCdnButton.addEventListener('click', () => {
         navigator.clipboard.writeText(cdnLink.href)
             .then(() => {
@@ -661,12 +1803,28 @@ document.addEventListener('DOMContentLoaded', () => {
             });
     });
 
-    function showStatus(message, isError = false) {
-        statusMessage.textContent = message;
-        statusMessage.className = 'status-message'; 
-        if (message) {
-            statusMessage.classList.add(isError ? 'error' : 'success');
-        }
+    copyPictureButton.addEventListener('click', () => {
+        navigator.clipboard.writeText(pictureHtml.textContent)
+            .then(() => {
+                copyPictureButton.textContent = 'Copied!';
+                copyPictureButton.classList.add('copied');
+                setTimeout(() => {
+                    copyPictureButton.textContent = 'Copy';
+                    copyPictureButton.classList.remove('copied');
+                }, 2000);
+            })
+            .catch(err => {
+                showStatus('Failed to copy HTML.', true);
+                console.error('Failed to copy: ', err);
+            });
+    });
+
+    function showStatus(message, isError = false) {
+        statusMessage.textContent = message;
+        statusMessage.className = 'status-message'; 
+        if (message) {
+            statusMessage.classList.add(isError ? 'error' : 'success');
+        }
     }
 
     function showLoader(show) {
@@ -675,13 +1833,487 @@ document.addEventListener('DOMContentLoaded', () => {
 });
 """
 
+DOWNSCALE_WORKER_JS_CONTENT = """
+// Decodes, downscales and re-encodes one image per message, off the main thread.
+// Replies with the smallest encoding, or blob: null to upload the original.
+self.onmessage = async (event) => {
+    const { id, file, maxDimension, formats, quality } = event.data;
+    try {
+        const bitmap = await createImageBitmap(file);
+        const { width, height } = bitmap;
+        const scale = Math.min(1, maxDimension / Math.max(width, height));
+        const outWidth = Math.max(1, Math.round(width * scale));
+        const outHeight = Math.max(1, Math.round(height * scale));
+        let source = bitmap;
+        if (scale < 1) {
+            bitmap.close();
+            source = await createImageBitmap(file, {
+                resizeWidth: outWidth,
+                resizeHeight: outHeight,
+                resizeQuality: 'high',
+            });
+        }
+        const canvas = new OffscreenCanvas(outWidth, outHeight);
+        canvas.getContext('2d').drawImage(source, 0, 0, outWidth, outHeight);
+        source.close();
+
+        let best = null;
+        for (const format of formats) {
+            const type = 'image/' + format;
+            const blob = await canvas.convertToBlob({ type, quality });
+            if (blob.type !== type) continue; // No encoder for it here (the browser fell back to PNG)
+            if (!best || blob.size < best.size) best = blob;
+        }
+        // Without a resize, only a smaller file is worth sending
+        if (!best || (scale === 1 && best.size >= file.size)) {
+            self.postMessage({ id, blob: null, width, height });
+            return;
+        }
+        self.postMessage({ id, blob: best, width, height, outWidth, outHeight });
+    } catch (error) {
+        self.postMessage({ id, blob: null, error: String(error) });
+    }
+};
+"""
+
+GALLERY_HTML_CONTENT = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <link rel="icon" href="/favicon.ico">
+    <title>Shotput - Gallery</title>
+    <style>
+        body {
+            font-family: 'Segoe UI', Roboto, Helvetica, Arial, sans-serif;
+            margin: 0;
+            padding: 24px;
+            background: linear-gradient(135deg, #0f0c29 0%, #302b63 50%, #24243e 100%) fixed;
+            color: #e0e0e0;
+        }
+        h1 { color: #ffffff; text-shadow: 0 0 12px rgba(102, 204, 255, 0.6); margin: 0 0 4px; }
+        a { color: #66ccff; }
+        .summary { color: #c0c0c0; margin-bottom: 20px; }
+        .grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fill, minmax(200px, 1fr));
+            gap: 12px;
+        }
+        .tile {
+            background-color: rgba(20, 20, 40, 0.85);
+            border: 1px solid rgba(102, 204, 255, 0.2);
+            border-radius: 10px;
+            overflow: hidden;
+            cursor: pointer;
+        }
+        .tile img { display: block; width: 100%; height: 160px; object-fit: cover; background: #1a1a33; }
+        .tile .meta { padding: 6px 8px; font-size: 0.8em; color: #c0c0c0; }
+        .tile .meta .name { color: #e0e0e0; word-break: break-all; }
+        .tile.copied { border-color: #66ccff; box-shadow: 0 0 10px rgba(102, 204, 255, 0.5); }
+        #sentinel { height: 40px; margin-top: 20px; text-align: center; color: #c0c0c0; }
+    </style>
+</head>
+<body>
+    <h1>Gallery</h1>
+    <p class="summary"><a href="/">Upload</a> &middot; <span id="summary">Loading...</span> &middot; click a tile to copy its Markdown link</p>
+    <div class="grid" id="grid"></div>
+    <div id="sentinel"></div>
+<script>
+    const grid = document.getElementById('grid');
+    const sentinel = document.getElementById('sentinel');
+    const summary = document.getElementById('summary');
+    let cursor = null;
+    let loading = false;
+    let done = false;
+
+    function formatBytes(n) {
+        if (n < 1024) return n + ' B';
+        if (n < 1024 * 1024) return (n / 1024).toFixed(1) + ' KB';
+        return (n / 1024 / 1024).toFixed(1) + ' MB';
+    }
+
+    function addTile(image) {
+        const tile = document.createElement('div');
+        tile.className = 'tile';
+        const img = document.createElement('img');
+        img.loading = 'lazy';
+        img.decoding = 'async';
+        img.src = image.thumbnail_url;
+        img.alt = image.name;
+        if (image.lqip) {
+            img.style.backgroundImage = `url(${image.lqip})`;
+            img.style.backgroundSize = 'cover';
+        }
+        const meta = document.createElement('div');
+        meta.className = 'meta';
+        const dims = image.width ? `${image.width}×${image.height} · ` : '';
+        meta.innerHTML = `<div class="name"></div><div>${dims}${formatBytes(image.bytes)} · ${image.uploaded_at.replace('T', ' ')}</div>`;
+        meta.querySelector('.name').textContent = image.name;
+        tile.appendChild(img);
+        tile.appendChild(meta);
+        tile.addEventListener('click', () => {
+            navigator.clipboard.writeText(`![${image.name}](${image.cdn_url})`).then(() => {
+                tile.classList.add('copied');
+                setTimeout(() => tile.classList.remove('copied'), 1500);
+            });
+        });
+        grid.appendChild(tile);
+    }
+
+    async function loadMore() {
+        if (loading || done) return;
+        loading = true;
+        try {
+            const url = '/images?limit=60' + (cursor ? '&cursor=' + encodeURIComponent(cursor) : '');
+            const response = await fetch(url);
+            const data = await response.json();
+            if (!response.ok) {
+                summary.textContent = data.detail || 'Could not load images.';
+                done = true;
+                return;
+            }
+            data.images.forEach(addTile);
+            summary.textContent = `${data.total} images` + (data.complete ? '' : ' (still indexing)');
+            cursor = data.next_cursor;
+            done = !cursor;
+            sentinel.textContent = done ? '' : 'Loading...';
+        } catch (err) {
+            console.error(err);
+            summary.textContent = 'Could not load images.';
+        } finally {
+            loading = false;
+        }
+        // Keep filling while the sentinel is still on screen
+        if (!done && sentinel.getBoundingClientRect().top < window.innerHeight) loadMore();
+    }
+
+    new IntersectionObserver(entries => {
+        if (entries.some(e => e.isIntersecting)) loadMore();
+    }).observe(sentinel);
+    loadMore();
+</script>
+</body>
+</html>
+"""
+
+# Routes are registered on this app at import, but it is only usable once
+# create_app() has configured the module; see _require_create_app
 app = FastAPI()
+_app_created = False
+
+# Created on startup; owns the worker pools used by the upload path
+pipeline: IngestPipeline = None
+# Created on startup; publishes stored uploads and builds their URLs
+storage: StorageBackend = None
+# Created on startup with the git backend; routes commits to the one writer process
+git_coordinator: Optional[GitCoordinator] = None
+# Created when this process becomes the git writer; groups concurrent uploads into shared commits
+commit_coalescer: Optional[CommitCoalescer] = None
+# Created on startup when dedup is enabled; SHA-256 -> stored image name
+hash_index: Optional[HashIndex] = None
+# Created on startup when similar is enabled; perceptual hash -> image names
+perceptual_index: "Optional[PerceptualIndex]" = None
+# Created on startup when the manifest is enabled; image name -> metadata
+manifest: "Optional[MediaManifest]" = None
+# Created on startup when render is enabled; encodes served by /img
+render_cache: Optional[RenderCache] = None
+pusher: "Optional[BackgroundPusher]" = None
+asset_store: Optional[AssetStore] = None
+# Started on startup; builds asset_store off the event loop
+_asset_build: "Optional[asyncio.Future[AssetStore]]" = None
+# Created on startup when resumable uploads are enabled; unfinished /uploads/ sessions
+resumable_uploads: Optional[ResumableUploads] = None
+# Created on startup; refuses uploads (503/429) instead of queueing them without bound
+admission: Optional[AdmissionController] = None
+# SHA-256 of uploads currently being stored -> future resolving to their response
+_inflight_uploads: Dict[str, "asyncio.Future[Optional[dict]]"] = {}
+# Render cache keys currently being encoded -> future resolving to the bytes
+_inflight_renders: Dict[str, "asyncio.Future[Optional[bytes]]"] = {}
+# Background tasks started on startup (kept referenced until done)
+_background_tasks = set()
+
+
+def _ensure_state_dir() -> Path:
+    """Creates the state directory, ignored by git so it never shows up in the images repo."""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    gitignore = STATE_DIR / ".gitignore"
+    if not gitignore.exists():
+        gitignore.write_text("*\n")
+    return STATE_DIR
+
+
+def _start_background(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _build_hash_index(scan: bool):
+    global hash_index
+    try:
+        hash_index = await pipeline.run_io(
+            lambda: HashIndex(
+                _ensure_state_dir() / "hashes.sqlite3",
+                IMAGES_REPO_PATH / IMAGE_SUB_DIR,
+                ignore=is_derivative_name,
+            )
+        )
+        entries = await pipeline.run_io(len, hash_index)
+        if not scan:
+            logger.info(f"Hash index opened with {entries} entries; another worker process scans {IMAGE_SUB_DIR}.")
+            return
+        logger.info(f"Hash index loaded with {entries} entries, scanning {IMAGE_SUB_DIR} for changes...")
+        loop = asyncio.get_running_loop()
+        # The scan uses its own thread pool so it never competes with uploads for I/O workers
+        seen, hashed = await loop.run_in_executor(None, hash_index.scan, DEDUP_SCAN_WORKERS)
+        logger.info(f"Hash index scan complete: {seen} files, {hashed} (re)hashed.")
+    except Exception as e:
+        logger.warning(f"Could not build the hash index, deduplication is disabled: {e}")
+        hash_index = None
+
+
+def _open_perceptual_index() -> "PerceptualIndex":
+    from similar_index import PerceptualIndex  # numpy; imported on the I/O thread
+
+    return PerceptualIndex(
+        _ensure_state_dir() / f"similar-{SIMILAR_ALGORITHM}.sqlite3",
+        IMAGES_REPO_PATH / IMAGE_SUB_DIR,
+        SIMILAR_ALGORITHM,
+        ignore=is_derivative_name,
+    )
+
+
+async def _build_perceptual_index(scan: bool):
+    global perceptual_index
+    try:
+        perceptual_index = await pipeline.run_io(_open_perceptual_index)
+        entries = await pipeline.run_io(len, perceptual_index)
+        if not scan:
+            logger.info(f"Perceptual index opened with {entries} entries; another worker process scans {IMAGE_SUB_DIR}.")
+            return
+        logger.info(f"Perceptual index loaded with {entries} entries, scanning {IMAGE_SUB_DIR} for changes...")
+        loop = asyncio.get_running_loop()
+        # Decoding runs on the ingest process pool; this thread only feeds it
+        seen, hashed = await loop.run_in_executor(None, perceptual_index.scan, pipeline.cpu_executor)
+        logger.info(f"Perceptual index scan complete: {seen} images, {hashed} (re)hashed.")
+    except Exception as e:
+        logger.warning(f"Could not build the perceptual index, similarity search is disabled: {e}")
+        perceptual_index = None
+
+
+async def _expire_resumable_uploads():
+    """Deletes abandoned resumable uploads periodically."""
+    while True:
+        await asyncio.sleep(min(60, RESUMABLE_EXPIRE_S))
+        try:
+            await pipeline.run_io(resumable_uploads.expire)
+        except Exception as e:
+            logger.warning(f"Could not expire resumable uploads: {e}")
+
+
+def _open_manifest() -> "MediaManifest":
+    from manifest import MediaManifest  # GitPython; imported on the I/O thread
+
+    return MediaManifest(
+        _ensure_state_dir() / "manifest.sqlite3",
+        IMAGES_REPO_PATH / IMAGE_SUB_DIR,
+        ignore=is_derivative_name,
+    )
+
+
+async def _build_manifest(scan: bool):
+    global manifest
+    try:
+        manifest = await pipeline.run_io(_open_manifest)
+        entries = await pipeline.run_io(len, manifest)
+        if not scan:
+            logger.info(f"Manifest opened with {entries} images; another worker process bootstraps it.")
+            return
+        logger.info(f"Manifest loaded with {entries} images, scanning {IMAGE_SUB_DIR} for changes...")
+        loop = asyncio.get_running_loop()
+        seen, indexed = await loop.run_in_executor(
+            None,
+            functools.partial(
+                manifest.bootstrap,
+                GIT_DIR if storage.commits else None,
+                "HEAD",
+                IMAGE_SUB_DIR,
+                max_workers=DEDUP_SCAN_WORKERS,
+            ),
+        )
+        logger.info(f"Manifest bootstrap complete: {seen} images, {indexed} (re)indexed.")
+    except Exception as e:
+        logger.warning(f"Could not build the media manifest, /images is disabled: {e}")
+        manifest = None
+
+
+def _open_plumbing_committer() -> "PlumbingCommitter":
+    from gitstore import PlumbingCommitter  # GitPython; imported on the calling worker thread
+
+    return PlumbingCommitter(GIT_DIR)
+
+
+def _make_commit_fn(
+    auto_push: Optional[bool] = None,
+) -> Callable[[List[Path], str], Tuple[bool, str, Optional[str]]]:
+    """
+    Builds the blocking commit function for the configured commit engine.
+
+    Args:
+        auto_push: Push synchronously after every commit (default:
+            repository.git_auto_push). The server turns this off when the
+            BackgroundPusher does the pushing.
+    """
+    if auto_push is None:
+        auto_push = GIT_AUTO_PUSH
+    if GIT_COMMIT_ENGINE == "index":
+        return functools.partial(commit_and_push_images, IMAGES_REPO_PATH, auto_push=auto_push)
+    if GIT_COMMIT_ENGINE != "plumbing":
+        logger.warning(f"Unknown commit_engine '{GIT_COMMIT_ENGINE}'. Using 'plumbing'.")
+    try:
+        committer = _open_plumbing_committer()
+    except Exception as e:
+        logger.warning(f"Could not open Git repository at {GIT_DIR} ({e}). Falling back to the index commit engine.")
+        return functools.partial(commit_and_push_images, IMAGES_REPO_PATH, auto_push=auto_push)
+    logger.info(f"Committing to {committer.ref} in {GIT_DIR} ({'bare' if committer.repo.bare else 'working tree'})")
+    return functools.partial(
+        commit_and_push_images_plumbing, committer, IMAGES_REPO_PATH, auto_push=auto_push
+    )
+
+
+async def _create_storage() -> StorageBackend:
+    """
+    Sets up the configured storage backend; for git also the coordinator that
+    makes one worker process the git writer. The writer opens the repository
+    in the background, after the server is up.
+
+    Raises:
+        RuntimeError: If the S3 backend cannot be set up. Uploads are not
+            silently stored somewhere else instead.
+    """
+    global git_coordinator
+    if STORAGE_BACKEND == "filesystem":
+        return FilesystemStorage(STORAGE_BASE_URL, _local_url)
+    if STORAGE_BACKEND == "s3":
+        try:
+            backend = await pipeline.run_io(
+                lambda: S3Storage(
+                    S3_BUCKET,
+                    S3_PREFIX,
+                    max_concurrency=S3_MAX_CONCURRENCY,
+                    endpoint_url=S3_ENDPOINT_URL,
+                    region=S3_REGION,
+                    public_base_url=S3_PUBLIC_BASE_URL,
+                    cache_control=S3_CACHE_CONTROL,
+                    access_key_id=S3_ACCESS_KEY_ID,
+                    secret_access_key=S3_SECRET_ACCESS_KEY,
+                )
+            )
+            await pipeline.run_io(backend.check)
+        except Exception as e:
+            raise RuntimeError(f"Could not set up the s3 storage backend: {e}") from e
+        return backend
+
+    git_coordinator = GitCoordinator(
+        await pipeline.run_io(_ensure_state_dir),
+        pipeline.run_io,
+        _become_git_writer,
+        pending=lambda: len(commit_coalescer) if commit_coalescer is not None else 0,
+    )
+    await git_coordinator.start()
+    return GitStorage(git_coordinator, STATIC_IO_USER, STATIC_IO_REPO, STATIC_IO_BRANCH, IMAGE_SUB_DIR)
+
+
+async def _become_git_writer():
+    """
+    Sets up committing in the one process that writes to git: the commit
+    coalescer and, with auto-push, the background pusher.
+
+    Returns:
+        The function the GitCoordinator commits with.
+    """
+    global commit_coalescer, pusher
+    if GIT_AUTO_PUSH and GIT_BACKGROUND_PUSH:
+
+        def open_pusher(rebase) -> "BackgroundPusher":
+            from pusher import BackgroundPusher
+
+            return BackgroundPusher(
+                GIT_DIR,
+                debounce_ms=GIT_PUSH_DEBOUNCE_MS,
+                max_delay_ms=GIT_PUSH_MAX_DELAY_MS,
+                retry_initial_s=GIT_PUSH_RETRY_INITIAL_S,
+                retry_max_s=GIT_PUSH_RETRY_MAX_S,
+                rebase=rebase,
+                rebase_attempts=GIT_PUSH_REBASE_ATTEMPTS,
+                fetch_interval_s=GIT_FETCH_INTERVAL_S,
+            )
+
+        try:
+            rebase = None
+            if GIT_PUSH_REBASE:
+                # Rebases run on the git thread, so they never race a commit
+                rebaser = await pipeline.run_git(_open_plumbing_committer)
+                rebase = functools.partial(pipeline.run_git, rebaser.rebase_onto)
+            pusher = await pipeline.run_io(open_pusher, rebase)
+            pusher.start()
+            logger.info(f"Pushing {pusher.branch} to {pusher.remote} in the background.")
+        except Exception as e:
+            logger.warning(f"Could not start the background pusher, pushing after every commit instead: {e}")
+            pusher = None
+    commit_coalescer = CommitCoalescer(
+        await pipeline.run_git(_make_commit_fn, GIT_AUTO_PUSH and pusher is None),
+        pipeline.run_git,
+        window_ms=GIT_COMMIT_WINDOW_MS,
+        max_batch=GIT_COMMIT_MAX_BATCH,
+        on_commit=pusher.notify if pusher is not None else None,
+    )
+    return commit_coalescer.submit
+
+
+def _require_create_app():
+    """
+    Fails startup when the app was imported as `shotput:app` instead of being
+    created by create_app(): nothing is configured then, and every request
+    would fail with a NameError on an unset setting.
+    """
+    if not _app_created:
+        raise RuntimeError(
+            "shotput:app is not configured. Start Shotput with `python app/shotput.py`, or with "
+            "`uvicorn --factory shotput:create_app` from app/, instead of `uvicorn shotput:app`."
+        )
 
 
 @app.on_event("startup")
 async def startup_event():
+    _require_create_app()
+    # Only what requests need from the first one on is awaited here; the rest
+    # (assets, indexes, the git writer) is built in the background while the
+    # server already answers, so a cold start reaches /health quickly
+    global pipeline, storage, render_cache, resumable_uploads, admission, _asset_build
+    pipeline = IngestPipeline(
+        io_workers=INGEST_IO_WORKERS,
+        cpu_workers=INGEST_CPU_WORKERS,
+        max_jobs=INGEST_MAX_JOBS,
+    )
+    _asset_build = _start_background(pipeline.run_io(_build_assets))
+    storage = await _create_storage()
+    logger.info(f"Storage backend: {storage.describe()}.")
+    UPLOADS_QUEUED.function = lambda: {(): storage.pending()}
+    admission = AdmissionController(
+        max_decodes=ADMISSION_MAX_DECODES,
+        max_queued_commits=ADMISSION_MAX_QUEUED_COMMITS,
+        max_inflight_bytes=ADMISSION_MAX_INFLIGHT_MB * 1024 * 1024,
+        queued_commits=storage.pending,
+        retry_after_s=ADMISSION_RETRY_AFTER_S,
+        rate_limiter=RateLimiter(ADMISSION_RATE_LIMIT_PER_S, ADMISSION_RATE_LIMIT_BURST),
+    )
+    WORKER_QUEUE_DEPTH.function = lambda: {(pool,): n for pool, n in pipeline.queue_depths().items()}
+
     is_default_path = str(IMAGES_REPO_PATH) == DEFAULT_IMAGES_REPO_PATH_STR
-    is_default_user = STATIC_IO_USER == DEFAULT_STATIC_IO_USER
+    is_default_user = STORAGE_BACKEND == "git" and STATIC_IO_USER == DEFAULT_STATIC_IO_USER
 
     if is_default_path or is_default_user:
         print("--- SHOTPUT CONFIGURATION WARNING ---")
@@ -698,7 +2330,7 @@ async def startup_event():
 
     resolved_image_save_dir = IMAGES_REPO_PATH / IMAGE_SUB_DIR
     try:
-        resolved_image_save_dir.mkdir(parents=True, exist_ok=True)
+        await pipeline.run_io(resolved_image_save_dir.mkdir, parents=True, exist_ok=True)
         print(f"Image save directory ensured: {resolved_image_save_dir}")
     except Exception as e:
         print(
@@ -708,19 +2340,655 @@ async def startup_event():
         # Consider raising an error to halt startup if the directory is essential
         # raise RuntimeError(f"Could not create image save directory: {e}")
 
+    if RESUMABLE_ENABLED:
+        uploads = ResumableUploads(
+            resolved_image_save_dir,
+            max_bytes=MAX_UPLOAD_BYTES,
+            max_pixels=MAX_IMAGE_PIXELS,
+            expire_s=RESUMABLE_EXPIRE_S,
+            max_uploads=RESUMABLE_MAX_UPLOADS,
+        )
+        try:
+            recovered = await pipeline.run_io(uploads.recover)
+            if recovered:
+                logger.info(f"Recovered {recovered} unfinished resumable uploads.")
+            resumable_uploads = uploads
+            _start_background(_expire_resumable_uploads())
+        except Exception as e:
+            logger.warning(f"Could not set up resumable uploads, /uploads/ is disabled: {e}")
+
+    if DEDUP_ENABLED or SIMILAR_ENABLED or MANIFEST_ENABLED:
+        # The indexes are shared by all worker processes; only one of them scans
+        scan = await pipeline.run_io(lambda: statedb.claim_scans(_ensure_state_dir()))
+        if DEDUP_ENABLED:
+            _start_background(_build_hash_index(scan))
+        if SIMILAR_ENABLED:
+            _start_background(_build_perceptual_index(scan))
+        if MANIFEST_ENABLED:
+            _start_background(_build_manifest(scan))
+    if RENDER_ENABLED:
+        try:
+            render_cache = await pipeline.run_io(
+                lambda: RenderCache(
+                    claim_worker_dir(_ensure_state_dir() / "render-cache"),
+                    max_disk_bytes=RENDER_DISK_CACHE_MB * 1024 * 1024,
+                    max_memory_bytes=RENDER_MEMORY_CACHE_MB * 1024 * 1024,
+                    max_memory_item_bytes=RENDER_MEMORY_ITEM_MAX_KB * 1024,
+                )
+            )
+            logger.info(f"Render cache in {render_cache.cache_dir} ready with {len(render_cache)} cached files.")
+        except Exception as e:
+            logger.warning(f"Could not open the render cache, /img is disabled: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if pusher is not None:
+        await pusher.close()
+    if git_coordinator is not None:
+        await git_coordinator.close()
+    if pipeline is not None:
+        pipeline.shutdown()
+    if storage is not None:
+        storage.close()
+    if hash_index is not None:
+        hash_index.close()
+    if perceptual_index is not None:
+        perceptual_index.close()
+    if manifest is not None:
+        manifest.close()
+
+
+def _build_assets() -> AssetStore:
+    """
+    Encodes the UI once: the script and favicon get fingerprinted, immutable
+    URLs, which the pages (served with no-cache) reference.
+    """
+    store = AssetStore()
+    script_url = store.add(
+        "/script.js", SCRIPT_JS_CONTENT.encode("utf-8"), "application/javascript; charset=utf-8", fingerprint=True
+    )
+    store.add(
+        "/downscale-worker.js",
+        DOWNSCALE_WORKER_JS_CONTENT.encode("utf-8"),
+        "application/javascript; charset=utf-8",
+        fingerprint=True,
+    )
+    favicon_url = "/favicon.ico"
+    if FAVICON_PATH.is_file():
+        favicon_url = store.add(
+            "/favicon.ico",
+            FAVICON_PATH.read_bytes(),
+            "image/vnd.microsoft.icon",
+            cache_control="public, max-age=86400",
+            fingerprint=True,
+        )
+    for path, html in (("/", INDEX_HTML_CONTENT), ("/gallery", GALLERY_HTML_CONTENT)):
+        html = html.replace('src="/script.js"', f'src="{script_url}"')
+        html = html.replace('href="/favicon.ico"', f'href="{favicon_url}"')
+        store.add(path, html.encode("utf-8"), "text/html; charset=utf-8")
+    return store
+
+
+async def _assets() -> AssetStore:
+    """The UI assets; requests arriving while startup still builds them wait for it."""
+    global asset_store
+    if asset_store is None:
+        if _asset_build is None:  # Serving without the startup event, e.g. in tests
+            asset_store = _build_assets()
+        else:
+            asset_store = await asyncio.shield(_asset_build)
+    return asset_store
+
+
+@app.api_route("/", methods=["GET", "HEAD"], response_class=HTMLResponse)
+async def get_index_html(request: Request):
+    return (await _assets()).response("/", request)
+
+
+@app.api_route("/script.js", methods=["GET", "HEAD"], response_class=Response)
+async def get_script_js(request: Request):
+    return (await _assets()).response("/script.js", request)
+
+
+@app.get("/config")
+async def get_client_config():
+    """
+    Upload limits and the browser-side downscaling settings, so the paste UI
+    prepares uploads the way /upload_image/ will accept them.
+    """
+    return JSONResponse(
+        content={
+            "upload": {
+                "max_upload_bytes": MAX_UPLOAD_BYTES,
+                "max_image_pixels": MAX_IMAGE_PIXELS,
+                "max_batch_files": MAX_BATCH_FILES,
+                "accepted_types": ACCEPTED_UPLOAD_TYPES,
+            },
+            "downscale": {
+                "available": CLIENT_DOWNSCALE and bool(CLIENT_FORMATS),
+                "default": CLIENT_DOWNSCALE_DEFAULT,
+                "max_dimension": CLIENT_MAX_DIMENSION,
+                "formats": CLIENT_FORMATS,
+                "quality": CLIENT_QUALITY / 100,
+                # Animated GIFs would lose their animation; HEIC rarely decodes in browsers
+                "input_types": ["image/png", "image/jpeg", "image/webp"],
+                "worker_url": (await _assets()).url("/downscale-worker.js"),
+            },
+            "resumable": {
+                "available": resumable_uploads is not None,
+                "endpoint": "/uploads/",
+                "chunk_bytes": RESUMABLE_CLIENT_CHUNK_MB * 1024 * 1024,
+            },
+        },
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.api_route("/favicon.ico", methods=["GET", "HEAD"], response_class=Response)
+async def get_favicon(request: Request):
+    return (await _assets()).response("/favicon.ico", request)
+
 
-@app.get("/", response_class=HTMLResponse)
-async def get_index_html():
-    return INDEX_HTML_CONTENT
+@app.api_route("/static/{name}", methods=["GET", "HEAD"], response_class=Response)
+async def get_static_asset(name: str, request: Request):
+    """Fingerprinted assets (e.g. /static/script.<hash>.js), cacheable forever."""
+    return (await _assets()).response(f"/static/{name}", request)
 
 
-@app.get("/script.js", response_class=Response)
-async def get_script_js():
-    return Response(content=SCRIPT_JS_CONTENT, media_type="application/javascript")
+def _cdn_url(image_name: str) -> str:
+    return storage.url(image_name)
+
+
+def _local_url(image_name: str) -> str:
+    return f"/media/{image_name}"
+
+
+async def _find_duplicate(digest: str) -> Optional[dict]:
+    """Returns the upload response for an already stored image with this SHA-256, if any."""
+    image_name = await pipeline.run_io(hash_index.lookup, digest)
+    if image_name is None:
+        return None
+    if not await pipeline.run_io((IMAGES_REPO_PATH / IMAGE_SUB_DIR / image_name).is_file):
+        # Deleted behind our back; forget it and store the upload again
+        await pipeline.run_io(hash_index.remove, image_name)
+        return None
+    placeholder = None
+    if manifest is not None:
+        entry = await pipeline.run_io(manifest.get, image_name)
+        if entry is not None and entry["width"]:
+            placeholder = {key: entry[key] for key in ("width", "height", "blurhash", "lqip")}
+    result = {
+        "cdn_url": _cdn_url(image_name),
+        "local_url": _local_url(image_name),
+        "image_name": image_name,
+        "duplicate": True,
+    }
+    result.update(_image_markup(image_name, placeholder))
+    if DERIVATIVE_FORMATS:
+        derivatives = await pipeline.run_io(_existing_derivatives, image_name)
+        if derivatives:
+            result.update(_responsive_markup(image_name, derivatives, placeholder))
+    return result
+
+
+async def _stage_upload(upload: UploadFile, directory: Path) -> StagedUpload:
+    """
+    Streams an upload to a temporary file in `directory` (see ingest.stage_upload).
+
+    Starlette has already spooled the multipart body (to disk beyond 1 MB), so
+    copying from upload.file in chunks keeps per-upload memory constant.
+    """
+    try:
+        staged = await pipeline.run_io(
+            stage_upload, upload.file, directory, MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS
+        )
+    except UploadRejected as e:
+        UPLOADS.inc(outcome="rejected")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    UPLOAD_BYTES.inc(staged.size)
+    return staged
+
+
+def _client_key(request: Request) -> str:
+    """The address rate limits apply to: the first X-Forwarded-For hop behind a trusted proxy."""
+    if ADMISSION_TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for", "").split(",")[0].strip()
+        if forwarded:
+            return forwarded
+    return request.client.host if request.client is not None else "unknown"
+
+
+def _shed(e: Overloaded, headers: Optional[Dict[str, str]] = None) -> HTTPException:
+    UPLOADS_SHED.inc(reason=e.reason)
+    logger.info(f"Shed an upload: {e.detail}")
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers={**(headers or {}), **e.headers})
+
+
+def _check_rate(request: Request, cost: int = 1, headers: Optional[Dict[str, str]] = None):
+    """Raises 429 with Retry-After if the client is over its upload rate."""
+    try:
+        admission.check_rate(_client_key(request), cost)
+    except Overloaded as e:
+        raise _shed(e, headers)
+
+
+def _admit(size: int, headers: Optional[Dict[str, str]] = None) -> Admission:
+    """
+    Admits an upload of `size` bytes, or refuses it right away.
+
+    Raises:
+        HTTPException: 503 with Retry-After if this process is at one of its
+            admission limits (see admission.AdmissionController).
+    """
+    try:
+        return admission.admit(size)
+    except Overloaded as e:
+        raise _shed(e, headers)
+
+
+async def _ingest_image(
+    staged: StagedUpload, ticket: Optional[BatchTicket] = None, admitted: Optional[Admission] = None
+) -> dict:
+    """
+    Stores and commits a staged upload without blocking the event loop.
+
+    Uploads whose bytes are already stored are answered from the hash index
+    with the existing image, without any git work. Identical uploads that
+    arrive concurrently share a single store. The staged file is always
+    either renamed into place or removed.
+
+    Args:
+        staged: The staged upload.
+        ticket: For uploads of a /upload_images/ batch, their place in the
+            batch's single commit.
+        admitted: The upload's admission, released when it is answered.
+
+    Returns:
+        The JSON body for the upload response.
+    """
+    with UPLOADS_IN_FLIGHT.track(), UPLOAD_STAGE_SECONDS.time(stage="total"):
+        try:
+            return await _deduplicate_and_store(staged, ticket, admitted)
+        except Exception:
+            UPLOADS.inc(outcome="failed")
+            raise
+        finally:
+            if admitted is not None:
+                admitted.release()
+            await pipeline.run_io(staged.path.unlink, missing_ok=True)
+
+
+async def _deduplicate_and_store(
+    staged: StagedUpload, ticket: Optional[BatchTicket], admitted: Optional[Admission]
+) -> dict:
+    if hash_index is None:
+        return await _store_image(staged, ticket, admitted)
+
+    digest = staged.sha256
+    duplicate = await _find_duplicate(digest)
+    if duplicate is not None:
+        DEDUP_HITS.inc(source="index")
+        UPLOADS.inc(outcome="duplicate")
+        return duplicate
+
+    inflight = _inflight_uploads.get(digest)
+    if inflight is not None:
+        if ticket is not None:
+            # The other upload may be waiting on our batch's commit
+            ticket.release()
+        result = await asyncio.shield(inflight)
+        if result is not None:
+            DEDUP_HITS.inc(source="inflight")
+            UPLOADS.inc(outcome="duplicate")
+            return {**result, "duplicate": True}
+        # The first upload failed; try storing it ourselves
+        return await _deduplicate_and_store(staged, ticket, admitted)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight_uploads[digest] = future
+    result = None
+    try:
+        result = await _store_image(staged, ticket, admitted)
+        return result
+    finally:
+        del _inflight_uploads[digest]
+        future.set_result(result)
+
+
+async def _timed(stage: str, awaitable: Awaitable[Any]) -> Any:
+    """Awaits and records the time under UPLOAD_STAGE_SECONDS{stage=...}."""
+    with UPLOAD_STAGE_SECONDS.time(stage=stage):
+        return await awaitable
+
+
+async def _placeholder(staged: StagedUpload) -> Optional[dict]:
+    """
+    Displayed width/height, BlurHash and LQIP of a staged upload (see
+    imaging.placeholder_file). Falls back to the header's dimensions when
+    placeholders are off or the image cannot be decoded for them.
+    """
+    fallback = {"width": staged.width, "height": staged.height, "blurhash": None, "lqip": None}
+    if not PLACEHOLDERS_ENABLED:
+        return fallback
+    try:
+        width, height, blurhash, lqip = await pipeline.run_cpu(
+            placeholder_file,
+            str(staged.path),
+            PLACEHOLDER_BLURHASH_COMPONENTS,
+            PLACEHOLDER_LQIP_SIZE,
+            PLACEHOLDER_LQIP_QUALITY,
+        )
+    except Exception as e:
+        logger.warning(f"Could not compute placeholders for an upload: {e}")
+        return fallback
+    return {"width": width, "height": height, "blurhash": blurhash, "lqip": lqip}
+
+
+async def _prepare_image(path: Path, file_extension: str) -> str:
+    """Converts a staged upload in place if needed, then losslessly optimizes PNGs."""
+    with UPLOAD_STAGE_SECONDS.time(stage="convert"):
+        file_extension = await pipeline.run_cpu(prepare_image_file, str(path), file_extension)
+    if OPTIMIZE_PNG and file_extension == ".png":
+        with UPLOAD_STAGE_SECONDS.time(stage="optimize_png"):
+            before, after = await pipeline.run_cpu(optimize_png_file, str(path))
+        if after < before:
+            logger.info(f"Optimized PNG upload: {before} -> {after} bytes")
+    return file_extension
+
+
+async def _store_image(
+    staged: StagedUpload, ticket: Optional[BatchTicket] = None, admitted: Optional[Admission] = None
+) -> dict:
+    """
+    Stores and commits a new upload.
+
+    Pillow work (conversion/optimization, the perceptual hash and the
+    placeholders, in parallel, then one task per derivative) runs on the
+    process pool against the staged file, which is then renamed into place; the commit/push runs on the git
+    thread, grouped with any concurrent uploads (or with the rest of its batch
+    when a ticket is given). The original and its derivatives land in the
+    same commit. The admission's decode slot is freed once the image work
+    is done, before the wait for the commit.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    unique_id = uuid.uuid4().hex[:8]
+
+    current_image_save_dir = IMAGES_REPO_PATH / IMAGE_SUB_DIR
+
+    try:
+        if perceptual_index is not None:
+            # In-place rewrites keep the pixels, so the hash sees the same image either way
+            file_extension, phash, placeholder = await asyncio.gather(
+                _prepare_image(staged.path, staged.extension),
+                _timed(
+                    "perceptual_hash",
+                    pipeline.run_cpu(perceptual_hash_file, str(staged.path), SIMILAR_ALGORITHM),
+                ),
+                _timed("placeholder", _placeholder(staged)),
+            )
+        else:
+            file_extension, placeholder = await asyncio.gather(
+                _prepare_image(staged.path, staged.extension),
+                _timed("placeholder", _placeholder(staged)),
+            )
+            phash = None
+        image_name = f"{timestamp}_{unique_id}{file_extension}"
+        image_path = current_image_save_dir / image_name
+        with UPLOAD_STAGE_SECONDS.time(stage="store"):
+            await pipeline.run_io(os.replace, staged.path, image_path)
+    except (UnidentifiedImageError, ValueError, Image.DecompressionBombError) as e:
+        # Only what Pillow raises for the upload's own content is the client's fault
+        raise HTTPException(
+            status_code=400, detail=f"Invalid or unsupported image file: {str(e)}"
+        )
+    except BrokenProcessPool as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Image processing is temporarily unavailable: {e}",
+            headers={"Retry-After": str(max(1, math.ceil(ADMISSION_RETRY_AFTER_S)))},
+        )
+    except OSError as e:
+        logger.exception(f"Could not store upload {staged.path.name}")
+        raise HTTPException(status_code=500, detail=f"Could not store the image: {e}")
+
+    derivatives = await _timed("derivatives", _make_derivatives(image_path)) if DERIVATIVE_FORMATS else []
+    if admitted is not None:
+        admitted.decoded()
+    stored_paths = [image_path] + [current_image_save_dir / d["name"] for d in derivatives]
+
+    commit_message = f"Add image {image_name} via Shotput"
+    submit = ticket.submit if ticket is not None else storage.submit
+    # Includes the wait for other uploads of the same commit
+    success, message, commit_sha = await _timed("commit", submit(stored_paths, commit_message))
+
+    if success is None:
+        # Still spooled: a later git writer commits these files, so they stay
+        raise HTTPException(status_code=503, detail=f"The image is stored but not committed yet: {message}")
+    if not success:
+        for path in stored_paths:
+            await pipeline.run_io(path.unlink, missing_ok=True)
+        raise HTTPException(status_code=500, detail=f"Failed to commit image: {message}")
+    UPLOADS.inc(outcome="stored")
+    stored_size = (await pipeline.run_io(image_path.stat)).st_size
+    STORED_BYTES.inc(stored_size + sum(d["bytes"] for d in derivatives))
+
+    if hash_index is not None:
+        try:
+            # Keyed by the uploaded bytes, so re-uploads of the same file match
+            await pipeline.run_io(hash_index.add_file, image_path, staged.sha256)
+        except Exception as e:
+            logger.warning(f"Could not record {image_name} in the hash index: {e}")
+
+    if manifest is not None:
+        try:
+            await pipeline.run_io(manifest.add_file, image_path, time.time(), commit_sha, placeholder)
+        except Exception as e:
+            logger.warning(f"Could not record {image_name} in the manifest: {e}")
+
+    result = {
+        "cdn_url": _cdn_url(image_name),
+        "local_url": _local_url(image_name),
+        "image_name": image_name,
+        "duplicate": False,
+        "commit_sha": commit_sha,
+    }
+    result.update(_image_markup(image_name, placeholder))
+    if derivatives:
+        result.update(_responsive_markup(image_name, derivatives, placeholder))
+
+    if perceptual_index is not None:
+        if SIMILAR_WARN_ON_UPLOAD and phash is not None:
+            matches = await pipeline.run_io(
+                perceptual_index.search, phash, SIMILAR_WARN_DISTANCE, limit=5, exclude=image_name
+            )
+            result["similar"] = _similar_matches(matches)
+        try:
+            await pipeline.run_io(perceptual_index.add_file, image_path, phash)
+        except Exception as e:
+            logger.warning(f"Could not record {image_name} in the perceptual index: {e}")
+
+    return result
+
+
+async def _make_derivatives(image_path: Path) -> List[dict]:
+    """
+    Encodes the configured WebP/AVIF widths of a stored image next to it.
+
+    Every (width, format) pair is its own process-pool task, so the variants
+    encode in parallel. Variants that fail, or that are not smaller than the
+    original file, are dropped.
+
+    Returns:
+        One dict per written derivative: name, width, height, format, bytes.
+    """
+    try:
+        width, height, animated = await pipeline.run_io(image_info, str(image_path))
+    except Exception as e:
+        logger.warning(f"Could not read {image_path.name} for derivatives: {e}")
+        return []
+    if animated:
+        return []  # Would lose the animation
+
+    original_bytes = image_path.stat().st_size
+    planned = [
+        (w, fmt) for fmt in DERIVATIVE_FORMATS for w in derivative_widths(width, DERIVATIVE_WIDTHS)
+    ]
+    results = await asyncio.gather(
+        *[
+            pipeline.run_cpu(
+                write_derivative,
+                str(image_path),
+                str(image_path.with_name(derivative_name(image_path.name, w, fmt))),
+                w,
+                fmt,
+                DERIVATIVE_QUALITY.get(fmt, 80),
+            )
+            for w, fmt in planned
+        ],
+        return_exceptions=True,
+    )
+
+    derivatives = []
+    for (w, fmt), outcome in zip(planned, results):
+        name = derivative_name(image_path.name, w, fmt)
+        if isinstance(outcome, BaseException):
+            logger.warning(f"Could not encode derivative {name}: {outcome}")
+            continue
+        d_width, d_height, d_bytes = outcome
+        if d_bytes >= original_bytes:
+            await pipeline.run_io((image_path.parent / name).unlink, missing_ok=True)
+            continue
+        derivatives.append(
+            {"name": name, "width": d_width, "height": d_height, "format": fmt, "bytes": d_bytes}
+        )
+    return derivatives
+
+
+def _existing_derivatives(image_name: str) -> List[dict]:
+    """Finds the derivatives an earlier upload stored, from the predictable names."""
+    image_dir = IMAGES_REPO_PATH / IMAGE_SUB_DIR
+    try:
+        width, height, _ = image_info(str(image_dir / image_name))
+    except Exception:
+        return []
+    derivatives = []
+    for fmt in DERIVATIVE_FORMATS:
+        for w in derivative_widths(width, DERIVATIVE_WIDTHS):
+            name = derivative_name(image_name, w, fmt)
+            path = image_dir / name
+            if path.is_file():
+                derivatives.append(
+                    {
+                        "name": name,
+                        "width": w,
+                        "height": max(1, round(height * w / width)),
+                        "format": fmt,
+                        "bytes": path.stat().st_size,
+                    }
+                )
+    return derivatives
+
+
+def _placeholder_attributes(placeholder: Optional[dict]) -> str:
+    """
+    <img> attributes that show the placeholder until the image has loaded:
+    the LQIP as a background (covered by the image once it is decoded) and
+    the BlurHash in data-blurhash for pages that decode it themselves.
+    """
+    if not placeholder:
+        return ""
+    attributes = ""
+    if placeholder.get("lqip"):
+        attributes += f' style="background-size:cover;background-image:url({placeholder["lqip"]})"'
+    if placeholder.get("blurhash"):
+        attributes += f' data-blurhash="{placeholder["blurhash"]}"'
+    return attributes
+
+
+def _image_markup(image_name: str, placeholder: Optional[dict]) -> dict:
+    """
+    The upload response's dimensions, placeholders and a plain <img> snippet
+    (valid inside Markdown) that reserves the image's space on the page.
+    """
+    if not placeholder or not placeholder.get("width"):
+        return {}
+    width, height = placeholder["width"], placeholder["height"]
+    return {
+        "width": width,
+        "height": height,
+        "blurhash": placeholder.get("blurhash"),
+        "lqip": placeholder.get("lqip"),
+        "img_html": (
+            f'<img src="{_cdn_url(image_name)}" alt="{image_name}" width="{width}" height="{height}"'
+            f' loading="lazy" decoding="async"{_placeholder_attributes(placeholder)}>'
+        ),
+    }
+
+
+def _responsive_markup(image_name: str, derivatives: List[dict], placeholder: Optional[dict] = None) -> dict:
+    """
+    Builds the srcset strings and <picture> markup for an image's derivatives.
+
+    Sources are listed in DERIVATIVE_FORMATS order (AVIF before WebP), so
+    browsers take the most efficient format they support and fall back to the
+    original in the <img>, which carries the placeholder.
+    """
+    srcset = {}
+    for fmt, (_, mime) in DERIVATIVE_FORMATS_INFO.items():
+        variants = sorted((d for d in derivatives if d["format"] == fmt), key=lambda d: d["width"])
+        if variants:
+            srcset[fmt] = ", ".join(f"{_cdn_url(d['name'])} {d['width']}w" for d in variants)
+
+    largest = max(derivatives, key=lambda d: d["width"])
+    width, height = largest["width"], largest["height"]
+    sizes = f"(max-width: {width}px) 100vw, {width}px"
+    sources = "\n".join(
+        f'  <source type="{DERIVATIVE_FORMATS_INFO[fmt][1]}" srcset="{value}" sizes="{sizes}">'
+        for fmt, value in srcset.items()
+    )
+    picture_html = (
+        f"<picture>\n{sources}\n"
+        f'  <img src="{_cdn_url(image_name)}" alt="{image_name}" width="{width}" height="{height}" loading="lazy" decoding="async"'
+        f"{_placeholder_attributes(placeholder)}>\n"
+        f"</picture>"
+    )
+    return {
+        "derivatives": [{**d, "cdn_url": _cdn_url(d["name"])} for d in derivatives],
+        "srcset": srcset,
+        "picture_html": picture_html,
+    }
+
+
+def _similar_matches(matches: List[Tuple[str, int]]) -> List[dict]:
+    return [
+        {"image_name": name, "cdn_url": _cdn_url(name), "distance": distance}
+        for name, distance in matches
+    ]
+
+
+def _upload_error_info(e: BaseException):
+    """Maps an exception raised while ingesting an upload to (status_code, detail)."""
+    if isinstance(e, HTTPException):
+        return e.status_code, e.detail
+    # Also called outside the except block (async jobs), so pass the exception itself
+    logger.exception(f"An unexpected error occurred during upload: {e}", exc_info=e)
+    return 500, "An internal server error occurred during image processing."
+
+
+def _run_async(async_upload: Optional[bool]) -> bool:
+    """Whether to answer with a job: ?async= if given, else ingest.async_uploads."""
+    return INGEST_ASYNC_UPLOADS if async_upload is None else async_upload
 
 
 @app.post("/upload_image/")
-async def upload_image(image_blob: UploadFile = File(...)):
+async def upload_image(
+    request: Request,
+    image_blob: UploadFile = File(...),
+    async_upload: Optional[bool] = Query(None, alias="async"),
+):
     try:
         # Basic check if using default placeholder values that might indicate misconfiguration
         if (
@@ -736,96 +3004,746 @@ async def upload_image(image_blob: UploadFile = File(...)):
                 status_code=400, detail="Invalid file type. Please upload an image."
             )
 
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        unique_id = uuid.uuid4().hex[:8]
+        _check_rate(request)
+        admitted = _admit(image_blob.size or 0)
+        try:
+            staged = await _stage_upload(image_blob, IMAGES_REPO_PATH / IMAGE_SUB_DIR)
+        except BaseException:
+            admitted.release()
+            raise
+
+        if _run_async(async_upload):
+            # Hand the upload to the pipeline and let the client poll /jobs/{id}
+            job = pipeline.submit_job(lambda: _ingest_image(staged, admitted=admitted), _upload_error_info)
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "job_id": job.job_id,
+                    "status": job.status,
+                    "status_url": f"/jobs/{job.job_id}",
+                },
+            )
 
-        content_type_map = {
-            "image/jpeg": ".jpg",
-            "image/png": ".png",
-            "image/gif": ".gif",
-            "image/webp": ".webp",
-        }
-        file_extension = content_type_map.get(image_blob.content_type.lower(), ".png")
+        result = await _ingest_image(staged, admitted=admitted)
+        return JSONResponse(content=result)
 
-        image_name = f"{timestamp}_{unique_id}{file_extension}"
+    except HTTPException as e:
+        raise e  # Re-raise known HTTP exceptions
+    except Exception as e:
+        status_code, detail = _upload_error_info(e)
+        raise HTTPException(status_code=status_code, detail=detail)
 
-        current_image_save_dir = IMAGES_REPO_PATH / IMAGE_SUB_DIR
-        image_path = current_image_save_dir / image_name
 
-        contents = await image_blob.read()
+async def _stage_batch_file(upload: UploadFile) -> Tuple[StagedUpload, Admission]:
+    if not (upload.content_type or "").startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an image.")
+    admitted = _admit(upload.size or 0)
+    try:
+        return await _stage_upload(upload, IMAGES_REPO_PATH / IMAGE_SUB_DIR), admitted
+    except BaseException:
+        admitted.release()
+        raise
+
 
+async def _ingest_batch(staged: List[Tuple[str, Any]]) -> dict:
+    """
+    Stores a batch of staged uploads concurrently, in a single commit.
+
+    Args:
+        staged: (file name, (StagedUpload, Admission) or the exception that
+            rejected it) per uploaded file, in upload order. Files refused by
+            admission control are answered 503 while the rest are stored.
+
+    Returns:
+        The JSON body for the batch response: one result per file, in upload
+        order, each with either the single-upload response fields or
+        status_code/detail.
+    """
+    ready = [item for _, item in staged if isinstance(item, tuple)]
+    batch = BatchCommit(storage, len(ready))
+
+    async def ingest(item: Tuple[StagedUpload, Admission]) -> dict:
+        ticket = batch.ticket()
         try:
-            img = Image.open(io.BytesIO(contents))
-            if img.format and img.format.upper() in ["HEIC", "HEIF"]:
-                image_name = f"{timestamp}_{unique_id}.png"
-                image_path = current_image_save_dir / image_name
-                img.save(image_path, "PNG")
-            else:
-                with open(image_path, "wb") as f:
-                    f.write(contents)
-        except Exception as e:
-            raise HTTPException(
-                status_code=400, detail=f"Invalid or unsupported image file: {str(e)}"
-            )
+            return await _ingest_image(item[0], ticket, item[1])
+        finally:
+            ticket.release()
+
+    outcomes = iter(await asyncio.gather(*[ingest(item) for item in ready], return_exceptions=True))
+
+    results = []
+    for filename, item in staged:
+        outcome = next(outcomes) if isinstance(item, tuple) else item
+        if isinstance(outcome, BaseException):
+            status_code, detail = _upload_error_info(outcome)
+            results.append({"filename": filename, "ok": False, "status_code": status_code, "detail": detail})
+        else:
+            results.append({"filename": filename, "ok": True, "status_code": 200, **outcome})
+    succeeded = sum(1 for r in results if r["ok"])
+    return {"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}
+
+
+@app.post("/upload_images/")
+async def upload_images(
+    request: Request,
+    image_blobs: List[UploadFile] = File(...),
+    async_upload: Optional[bool] = Query(None, alias="async"),
+):
+    """
+    Uploads many images in one multipart request (repeat the image_blobs field).
+
+    Files are staged and processed concurrently and committed together in one
+    commit/push. A file that is rejected or fails does not fail the request:
+    the response lists a result per file, in upload order. Each file counts
+    against the client's rate limit.
+    """
+    if MAX_BATCH_FILES and len(image_blobs) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many files: at most {MAX_BATCH_FILES} images per request.",
+        )
+    _check_rate(request, len(image_blobs))
+
+    staged = await asyncio.gather(
+        *[_stage_batch_file(blob) for blob in image_blobs], return_exceptions=True
+    )
+    named = [(blob.filename or f"file {i + 1}", item) for i, (blob, item) in enumerate(zip(image_blobs, staged))]
+
+    if _run_async(async_upload):
+        job = pipeline.submit_job(lambda: _ingest_batch(named), _upload_error_info)
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job.job_id, "status": job.status, "status_url": f"/jobs/{job.job_id}"},
+        )
+
+    return JSONResponse(content=await _ingest_batch(named))
+
+
+def _tus_headers(upload: Optional[ResumableUpload] = None) -> Dict[str, str]:
+    headers = {"Tus-Resumable": TUS_VERSION, "Cache-Control": "no-store"}
+    if upload is not None:
+        headers["Upload-Offset"] = str(upload.offset)
+        headers["Upload-Length"] = str(upload.length)
+        headers["Upload-Expires"] = formatdate(resumable_uploads.expires_at(upload), usegmt=True)
+        if upload.metadata:
+            headers["Upload-Metadata"] = upload.metadata
+    return headers
+
+
+async def _resumable_upload(upload_id: str) -> ResumableUpload:
+    if resumable_uploads is None:
+        raise HTTPException(status_code=404, detail="Resumable uploads are disabled.")
+    upload = resumable_uploads.get(upload_id)
+    if upload is None:
+        # Created by another worker process, if any
+        upload = await pipeline.run_io(resumable_uploads.load, upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found (it may have expired).", headers=_tus_headers())
+    return upload
+
+
+async def _claim(upload: ResumableUpload):
+    # One PATCH or finalize at a time; a retry racing a dropped request that the
+    # server has not noticed yet is told to ask for the offset again. The busy
+    # flag covers this process, the file lock the other worker processes.
+    if upload.busy:
+        raise HTTPException(
+            status_code=409, detail="Another request is writing to this upload.", headers=_tus_headers(upload)
+        )
+    upload.busy = True
+    try:
+        await pipeline.run_io(resumable_uploads.acquire, upload)
+    except UploadRejected as e:
+        upload.busy = False
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=_tus_headers())
+
+
+async def _unclaim(upload: ResumableUpload):
+    try:
+        await pipeline.run_io(resumable_uploads.release, upload)
+    finally:
+        upload.busy = False
+
+
+async def _reject_resumable(upload: ResumableUpload, e: UploadRejected, discard: bool):
+    UPLOADS.inc(outcome="rejected")
+    if discard:
+        await pipeline.run_io(resumable_uploads.discard, upload)
+    raise HTTPException(status_code=e.status_code, detail=e.detail, headers=_tus_headers())
+
 
-        commit_message = f"Add image {image_name} via Shotput"
-        success, message = commit_and_push_image(
-            IMAGES_REPO_PATH, image_path, commit_message, GIT_AUTO_PUSH
+@app.options("/uploads/")
+async def resumable_upload_options():
+    """tus discovery: protocol version, extensions and the size limit."""
+    headers = {**_tus_headers(), "Tus-Version": TUS_VERSION, "Tus-Extension": TUS_EXTENSIONS}
+    if MAX_UPLOAD_BYTES:
+        headers["Tus-Max-Size"] = str(MAX_UPLOAD_BYTES)
+    return Response(status_code=204, headers=headers)
+
+
+@app.post("/uploads/")
+async def create_resumable_upload(request: Request):
+    """
+    Starts a resumable upload (tus creation). Requires an Upload-Length header;
+    an Upload-Metadata header is stored and echoed back. Answers 201 with the
+    upload's URL in Location.
+    """
+    if resumable_uploads is None:
+        raise HTTPException(status_code=404, detail="Resumable uploads are disabled.")
+    _check_rate(request, headers=_tus_headers())
+    try:
+        length = int(request.headers["upload-length"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="An Upload-Length header is required.", headers=_tus_headers())
+    try:
+        upload = await pipeline.run_io(
+            resumable_uploads.create, length, request.headers.get("upload-metadata", "")
         )
+    except UploadRejected as e:
+        UPLOADS.inc(outcome="rejected")
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=_tus_headers())
+    headers = _tus_headers(upload)
+    headers["Location"] = f"/uploads/{upload.upload_id}"
+    return Response(status_code=201, headers=headers)
+
+
+@app.head("/uploads/{upload_id}")
+async def get_resumable_upload_offset(upload_id: str):
+    """How many bytes of the upload the server has, in Upload-Offset."""
+    upload = await _resumable_upload(upload_id)
+    if not upload.busy:
+        try:
+            await pipeline.run_io(resumable_uploads.sync, upload)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail, headers=_tus_headers())
+    return Response(status_code=200, headers=_tus_headers(upload))
+
 
-        if not success:
-            image_path.unlink(missing_ok=True)
+@app.patch("/uploads/{upload_id}")
+async def append_resumable_upload(upload_id: str, request: Request):
+    """
+    Appends the request body at Upload-Offset, which must match the server's
+    offset (409 otherwise). The body is written as it arrives, so if the
+    connection drops, the bytes received so far are kept. Answers 204 with
+    the new offset.
+    """
+    upload = await _resumable_upload(upload_id)
+    if request.headers.get("content-type", "").split(";")[0].strip() != "application/offset+octet-stream":
+        raise HTTPException(
+            status_code=415, detail="Content-Type must be application/offset+octet-stream.", headers=_tus_headers()
+        )
+    try:
+        offset = int(request.headers["upload-offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="An Upload-Offset header is required.", headers=_tus_headers())
+    await _claim(upload)
+    try:
+        if offset != upload.offset:
             raise HTTPException(
-                status_code=500, detail=f"Failed to commit image: {message}"
+                status_code=409,
+                detail=f"Upload-Offset is {offset}, but the server has {upload.offset} bytes.",
+                headers=_tus_headers(upload),
             )
+        received = bytearray()
+        try:
+            try:
+                async for chunk in request.stream():
+                    received += chunk
+                    if len(received) >= UPLOAD_CHUNK_SIZE:
+                        await pipeline.run_io(resumable_uploads.append, upload, bytes(received))
+                        received.clear()
+            except ClientDisconnect:
+                pass  # Keep what arrived; the client resumes from HEAD's offset
+            if received:
+                await pipeline.run_io(resumable_uploads.append, upload, bytes(received))
+        except UploadRejected as e:
+            # A non-image will never become valid; an overlong chunk can be retried
+            await _reject_resumable(upload, e, discard=e.status_code == 415)
+    finally:
+        await _unclaim(upload)
+    return Response(status_code=204, headers=_tus_headers(upload))
+
+
+@app.delete("/uploads/{upload_id}")
+async def delete_resumable_upload(upload_id: str):
+    """Abandons an upload and deletes what was received (tus termination)."""
+    upload = await _resumable_upload(upload_id)
+    await _claim(upload)
+    await pipeline.run_io(resumable_uploads.discard, upload)
+    return Response(status_code=204, headers=_tus_headers())
+
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_resumable_upload(
+    upload_id: str,
+    async_upload: Optional[bool] = Query(None, alias="async"),
+):
+    """
+    Stores a completely received upload. It is validated like /upload_image/
+    uploads and answered the same way (202 with a job for ?async=true). When
+    the server is too busy it answers 503 with Retry-After and the upload
+    stays in place, to be finalized again later.
+    """
+    upload = await _resumable_upload(upload_id)
+    await _claim(upload)
+    try:
+        if upload.offset != upload.length:
+            raise HTTPException(
+                status_code=409,
+                detail=f"The upload is incomplete: {upload.offset} of {upload.length} bytes received.",
+                headers=_tus_headers(upload),
+            )
+        admitted = _admit(upload.length, _tus_headers(upload))
+        try:
+            staged = await pipeline.run_io(resumable_uploads.finish, upload)
+        except UploadRejected as e:
+            admitted.release()
+            await _reject_resumable(upload, e, discard=False)  # finish() already deleted it
+        except BaseException:
+            admitted.release()
+            raise
+    finally:
+        await _unclaim(upload)
+    UPLOAD_BYTES.inc(staged.size)
+
+    if _run_async(async_upload):
+        job = pipeline.submit_job(lambda: _ingest_image(staged, admitted=admitted), _upload_error_info)
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job.job_id, "status": job.status, "status_url": f"/jobs/{job.job_id}"},
+        )
+    try:
+        return JSONResponse(content=await _ingest_image(staged, admitted=admitted))
+    except HTTPException:
+        raise
+    except Exception as e:
+        status_code, detail = _upload_error_info(e)
+        raise HTTPException(status_code=status_code, detail=detail)
 
-        cdn_url = f"https://cdn.statically.io/gh/{STATIC_IO_USER}/{STATIC_IO_REPO}/{STATIC_IO_BRANCH}/{IMAGE_SUB_DIR}/{image_name}"
 
-        return JSONResponse(content={"cdn_url": cdn_url, "image_name": image_name})
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = pipeline.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.to_dict()
 
-    except HTTPException as e:
-        raise e  # Re-raise known HTTP exceptions
+
+def _similar_params(max_distance: Optional[int]) -> int:
+    if perceptual_index is None:
+        raise HTTPException(status_code=503, detail="Similarity search is not enabled or not ready.")
+    if max_distance is None:
+        return SIMILAR_WARN_DISTANCE
+    return max(0, min(max_distance, SIMILAR_MAX_DISTANCE))
+
+
+@app.get("/similar")
+async def find_similar(
+    image_name: str, max_distance: Optional[int] = None, limit: int = Query(20, ge=1, le=100)
+):
+    """Lists stored images that look like an already stored image."""
+    max_distance = _similar_params(max_distance)
+    h = await pipeline.run_io(perceptual_index.hash_of, image_name)
+    if h is None:
+        raise HTTPException(status_code=404, detail=f"No perceptual hash recorded for '{image_name}'.")
+    matches = await pipeline.run_io(perceptual_index.search, h, max_distance, limit, exclude=image_name)
+    return {"hash": format(h, "016x"), "matches": _similar_matches(matches)}
+
+
+@app.post("/similar")
+async def find_similar_to_upload(
+    image_blob: UploadFile = File(...),
+    max_distance: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+):
+    """Lists stored images that look like the uploaded image, without storing it."""
+    max_distance = _similar_params(max_distance)
+    staged = await _stage_upload(image_blob, _ensure_state_dir())
+    try:
+        h = await pipeline.run_cpu(perceptual_hash_file, str(staged.path), SIMILAR_ALGORITHM)
+    finally:
+        await pipeline.run_io(staged.path.unlink, missing_ok=True)
+    if h is None:
+        raise HTTPException(status_code=400, detail="Invalid or unsupported image file.")
+    matches = await pipeline.run_io(perceptual_index.search, h, max_distance, limit)
+    return {"hash": format(h, "016x"), "matches": _similar_matches(matches)}
+
+
+# --- Local media serving ---
+
+# Image names are unique and never rewritten under the same content by uploads,
+# so responses can be cached forever; the ETag still changes if a backfill
+# optimizes a file in place.
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MEDIA_ETAG_CACHE_SIZE = 8192
+
+# (name, size, mtime_ns) -> strong ETag; hashing a file once per version is enough
+_media_etags: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+
+
+async def _media_etag(path: Path, st: os.stat_result) -> str:
+    key = (path.name, st.st_size, st.st_mtime_ns)
+    etag = _media_etags.get(key)
+    if etag is None:
+        etag = f'"{await pipeline.run_io(sha256_file, path)}"'
+        _media_etags[key] = etag
+        if len(_media_etags) > MEDIA_ETAG_CACHE_SIZE:
+            _media_etags.popitem(last=False)
+    else:
+        _media_etags.move_to_end(key)
+    return etag
+
+
+def _accepted_media_types(accept: str) -> set:
+    """Media types named explicitly in an Accept header with q > 0 (wildcards are ignored)."""
+    accepted = set()
+    for part in accept.split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(media_type.lower())
+    return accepted
+
+
+@functools.lru_cache(maxsize=4096)
+def _image_width(image_path: Path, mtime_ns: int) -> Optional[int]:
+    try:
+        return image_info(str(image_path))[0]
+    except Exception:
+        return None
+
+
+def _full_width_variants(image_path: Path, mtime_ns: int) -> Dict[str, Tuple[Path, os.stat_result]]:
+    """{format: (path, stat)} of the derivatives with the same dimensions as the original."""
+    width = _image_width(image_path, mtime_ns)
+    if width is None:
+        return {}
+    variants = {}
+    for fmt in DERIVATIVE_FORMATS_INFO:
+        variant = image_path.with_name(derivative_name(image_path.name, width, fmt))
+        try:
+            variants[fmt] = (variant, variant.stat())
+        except FileNotFoundError:
+            continue
+    return variants
+
+
+def _is_not_modified(request: Request, etag: str, st: os.stat_result) -> bool:
+    """Evaluates If-None-Match (or, without it, If-Modified-Since) per RFC 9110."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(st.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@app.api_route("/media/{name}", methods=["GET", "HEAD"])
+async def get_media(name: str, request: Request):
+    """
+    Serves a stored image (or derivative) from the local repository checkout.
+
+    A local origin next to the CDN: new uploads can be previewed before the CDN
+    has them, and the CDN can be pointed here. For originals, clients whose
+    Accept header names image/avif or image/webp get the full-size variant in
+    that format when one exists (with Vary: Accept). Responses carry a strong
+    ETag from the SHA-256 of the bytes served and immutable caching; Range,
+    If-Range, If-None-Match and If-Modified-Since are honoured. The body is
+    sent with the ASGI pathsend extension (sendfile) when the server offers
+    it, otherwise streamed in chunks.
+    """
+    image_dir = IMAGES_REPO_PATH / IMAGE_SUB_DIR
+    if name.startswith(".") or "/" in name or "\\" in name:
+        raise HTTPException(status_code=404, detail="Not found.")
+    path = image_dir / name
+    try:
+        st = await pipeline.run_io(path.stat)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Not found.")
+    if not stat.S_ISREG(st.st_mode):
+        raise HTTPException(status_code=404, detail="Not found.")
+
+    headers = {"Cache-Control": MEDIA_CACHE_CONTROL}
+    media_type = None
+    if not is_derivative_name(name):
+        headers["Vary"] = "Accept"
+        accepted = _accepted_media_types(request.headers.get("accept", ""))
+        wanted = [fmt for fmt, (_, mime) in DERIVATIVE_FORMATS_INFO.items() if mime in accepted]
+        if wanted:
+            variants = await pipeline.run_io(_full_width_variants, path, st.st_mtime_ns)
+            for fmt in wanted:  # DERIVATIVE_FORMATS_INFO order: AVIF first
+                if fmt in variants and variants[fmt][0].suffix != path.suffix:
+                    path, st = variants[fmt]
+                    media_type = DERIVATIVE_FORMATS_INFO[fmt][1]
+                    headers["Content-Location"] = _local_url(path.name)
+                    break
+
+    etag = await _media_etag(path, st)
+    headers["ETag"] = etag
+    if _is_not_modified(request, etag, st):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers, media_type=media_type, stat_result=st)
+
+
+# --- On-demand renders ---
+
+
+def _render_params(w: int, h: int, fmt: Optional[str], q: Optional[int], source_ext: str) -> Tuple[str, int]:
+    """Checks /img parameters against the allowlist; returns (fmt, quality)."""
+    if w and w not in RENDER_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"w must be one of {sorted(RENDER_WIDTHS)}.")
+    if h and h not in RENDER_HEIGHTS:
+        raise HTTPException(status_code=400, detail=f"h must be one of {sorted(RENDER_HEIGHTS)}.")
+    if fmt is None:
+        fmt = RENDER_SOURCE_FORMATS.get(source_ext.lower(), "png")
+        if fmt not in RENDER_FORMATS_ALLOWED:
+            fmt = "png"
+    elif fmt not in RENDER_FORMATS_ALLOWED:
+        raise HTTPException(status_code=400, detail=f"fmt must be one of {RENDER_FORMATS_ALLOWED}.")
+    if q is None:
+        q = RENDER_QUALITY
+    elif q not in RENDER_QUALITIES:
+        raise HTTPException(status_code=400, detail=f"q must be one of {sorted(RENDER_QUALITIES)}.")
+    if fmt == "png":
+        q = 0  # Lossless; keeps one cache entry per size
+    return fmt, q
+
+
+async def _render(key: str, path: Path, w: int, h: int, fmt: str, q: int) -> bytes:
+    """Encodes a render once, however many requests for it arrive concurrently."""
+    inflight = _inflight_renders.get(key)
+    if inflight is not None:
+        data = await asyncio.shield(inflight)
+        if data is not None:
+            return data
+        # The first request failed; try ourselves
+        return await _render(key, path, w, h, fmt, q)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight_renders[key] = future
+    data = None
+    try:
+        data = await pipeline.run_cpu(render_variant, str(path), w, h, fmt, q)
+        try:
+            await pipeline.run_io(render_cache.put, key, data)
+        except Exception as e:
+            logger.warning(f"Could not cache render {key}: {e}")
+        return data
+    finally:
+        del _inflight_renders[key]
+        future.set_result(data)
+
+
+@app.get("/img/{name}")
+async def render_image(
+    name: str,
+    request: Request,
+    w: int = 0,
+    h: int = 0,
+    fmt: Optional[str] = None,
+    q: Optional[int] = None,
+):
+    """
+    Resizes and/or transcodes a stored original on demand, without committing anything.
+
+    `w` or `h` alone scale proportionally, both together cover-crop to that
+    box, and nothing is upscaled (see imaging.render_geometry). `fmt`
+    defaults to the original's format and `q` to render.default_quality.
+    Every parameter must come from the [render] allowlist, which bounds how
+    many distinct encodes can exist per image. Encodes are served from a
+    memory LRU for small results and a size-capped disk cache for the rest.
+    """
+    if render_cache is None:
+        raise HTTPException(status_code=503, detail="On-demand rendering is not enabled or not ready.")
+    if name.startswith(".") or "/" in name or "\\" in name or is_derivative_name(name):
+        raise HTTPException(status_code=404, detail="Not found.")
+    path = IMAGES_REPO_PATH / IMAGE_SUB_DIR / name
+    try:
+        st = await pipeline.run_io(path.stat)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Not found.")
+    if not stat.S_ISREG(st.st_mode):
+        raise HTTPException(status_code=404, detail="Not found.")
+    fmt, q = _render_params(w, h, fmt, q, path.suffix)
+
+    # The source's size and mtime are part of the key, so a backfilled original renders afresh
+    key = f"{name}:{st.st_size}:{st.st_mtime_ns}:{w}x{h}:q{q}.{fmt}"
+    etag = f'W/"{sha256_bytes(key.encode("utf-8"))[:32]}"'
+    headers = {"Cache-Control": MEDIA_CACHE_CONTROL, "ETag": etag}
+    if _is_not_modified(request, etag[2:], st):
+        return Response(status_code=304, headers=headers)
+
+    media_type = RENDER_FORMATS[fmt][1]
+    data, tier = await pipeline.run_io(render_cache.get, key)
+    if data is not None:
+        headers["X-Render-Cache"] = tier
+        return Response(content=data, media_type=media_type, headers=headers)
+
+    try:
+        data = await _render(key, path, w, h, fmt, q)
     except Exception as e:
-        print(
-            f"An unexpected error occurred during upload: {e}"
-        )  # Log for server-side debugging
-        import traceback
+        raise HTTPException(status_code=422, detail=f"Could not render {name}: {e}")
+    headers["X-Render-Cache"] = "miss"
+    return Response(content=data, media_type=media_type, headers=headers)
+
+
+# --- Listing ---
+
+
+def _thumbnail_url(image_name: str) -> str:
+    """A small allowlisted /img rendition for galleries, or the original if rendering is off."""
+    if render_cache is None or not RENDER_WIDTHS:
+        return _local_url(image_name)
+    width = min((w for w in RENDER_WIDTHS if w >= 320), default=max(RENDER_WIDTHS))
+    fmt = "webp" if "webp" in RENDER_FORMATS_ALLOWED else None
+    return f"/img/{image_name}?w={width}" + (f"&fmt={fmt}" if fmt else "")
+
+
+def _manifest_entry(entry: dict) -> dict:
+    name = entry["name"]
+    return {
+        **entry,
+        "uploaded_at": datetime.fromtimestamp(entry["uploaded_at"]).isoformat(timespec="seconds"),
+        "cdn_url": _cdn_url(name),
+        "local_url": _local_url(name),
+        "thumbnail_url": _thumbnail_url(name),
+    }
+
+
+def _require_manifest() -> "MediaManifest":
+    if manifest is None:
+        raise HTTPException(status_code=503, detail="The media manifest is not enabled or not ready.")
+    return manifest
+
+
+@app.get("/images")
+async def list_images(limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = None):
+    """
+    Lists stored images newest first from the manifest.
+
+    Pass the returned next_cursor to get the following page; it is null on the last page.
+    """
+    media = _require_manifest()
+    try:
+        images, next_cursor = await pipeline.run_io(media.page, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "images": [_manifest_entry(entry) for entry in images],
+        "next_cursor": next_cursor,
+        "total": await pipeline.run_io(len, media),
+        "complete": await pipeline.run_io(lambda: media.bootstrap_complete),
+    }
 
-        traceback.print_exc()
-        raise HTTPException(
-            status_code=500,
-            detail="An internal server error occurred during image processing.",
-        )
+
+@app.get("/images/{name}")
+async def get_image_info(name: str):
+    entry = await pipeline.run_io(_require_manifest().get, name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"No image named '{name}'.")
+    return _manifest_entry(entry)
+
+
+@app.api_route("/gallery", methods=["GET", "HEAD"], response_class=HTMLResponse)
+async def get_gallery_html(request: Request):
+    return (await _assets()).response("/gallery", request)
+
+
+@app.get("/push_status")
+async def push_status():
+    """Background push state: commits not yet on the remote, last push and last error."""
+    writer = await pipeline.run_io(git_coordinator.status) if git_coordinator is not None else None
+    if pusher is None:
+        # With several workers only the git writer pushes; ask again to reach it
+        return {"enabled": False, "auto_push": GIT_AUTO_PUSH, "git_writer": writer}
+    return {**await pipeline.run_io(pusher.status), "git_writer": writer}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of the upload, git and push metrics."""
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
 
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    """
+    Liveness plus this process's admission limits. With
+    admission.health_503_when_saturated, a process at one of its limits
+    answers 503 (with Retry-After), so a load balancer's health check routes
+    uploads to other instances until it has caught up.
+    """
+    if admission is None:
+        return {"status": "ok"}
+    status = admission.status()
+    if status["saturated"] and ADMISSION_HEALTH_503_WHEN_SATURATED:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "saturated", "admission": status},
+            headers={"Retry-After": str(max(1, math.ceil(ADMISSION_RETRY_AFTER_S)))},
+        )
+    return {"status": "saturated" if status["saturated"] else "ok", "admission": status}
+
+
+def create_app() -> FastAPI:
+    """
+    Application factory: sets up logging, reads config.toml (writing a
+    template if there is none) and applies it. Importing this module does
+    none of that, so the app must be created through here: run it with
+    `uvicorn --factory shotput:create_app` (as `python app/shotput.py`
+    does) rather than `uvicorn shotput:app`.
+    """
+    global _app_created
+    configure_logging()
+    apply_config(load_config(CONFIG_FILE_PATH))
+    _app_created = True
+    if not CONFIG_FILE_PATH.exists():
+        print(
+            f"{CONFIG_FILE_PATH} not found. Using default configurations and creating a template."
+        )
+        write_template_config(CONFIG_FILE_PATH)
+    return app
 
 
 if __name__ == "__main__":
+    import uvicorn
+
+    application = create_app()
     print("--- Shotput Application Runner ---")
     print(f"Attempting to start server on http://0.0.0.0:{APP_PORT}")
     print(f"Using image repository: {IMAGES_REPO_PATH.resolve()}")
     print(f"Image subdirectory: {IMAGE_SUB_DIR}")
-    print(
-        f"Statically.io CDN: User='{STATIC_IO_USER}', Repo='{STATIC_IO_REPO}', Branch='{STATIC_IO_BRANCH}'"
-    )
-    print(f"Git auto-push: {'Enabled' if GIT_AUTO_PUSH else 'Disabled'}")
+    print(f"Storage backend: {STORAGE_BACKEND}")
+    if STORAGE_BACKEND == "git":
+        print(
+            f"Statically.io CDN: User='{STATIC_IO_USER}', Repo='{STATIC_IO_REPO}', Branch='{STATIC_IO_BRANCH}'"
+        )
+        print(
+            f"Git auto-push: {('Enabled (background)' if GIT_BACKGROUND_PUSH else 'Enabled') if GIT_AUTO_PUSH else 'Disabled'}"
+        )
     print(
         f"Config loaded from: {CONFIG_FILE_PATH.resolve() if CONFIG_FILE_PATH.exists() else 'Defaults (config file not found or error)'}"
     )
-    if (
-        not CONFIG_FILE_PATH.exists()
-        or STATIC_IO_USER == DEFAULT_STATIC_IO_USER
-        or STATIC_IO_REPO == DEFAULT_STATIC_IO_REPO
+    if not CONFIG_FILE_PATH.exists() or (
+        STORAGE_BACKEND == "git"
+        and (STATIC_IO_USER == DEFAULT_STATIC_IO_USER or STATIC_IO_REPO == DEFAULT_STATIC_IO_REPO)
     ):
         print(
             "\nIMPORTANT: Review 'config.toml'. Update 'static_cdn.user' and 'static_cdn.repo' with your actual GitHub username and image repository name."
         )
 
     is_default_path_main = str(IMAGES_REPO_PATH) == DEFAULT_IMAGES_REPO_PATH_STR
-    is_default_user_main = STATIC_IO_USER == DEFAULT_STATIC_IO_USER
+    is_default_user_main = STORAGE_BACKEND == "git" and STATIC_IO_USER == DEFAULT_STATIC_IO_USER
 
     if is_default_path_main or is_default_user_main:
         print("\n--- CONFIGURATION NOTICE (from main execution block) ---")
@@ -845,4 +3763,12 @@ if __name__ == "__main__":
         )
         print("--- END CONFIGURATION NOTICE ---\n")
 
-    uvicorn.run(app, host="0.0.0.0", port=APP_PORT, log_level="info")
+    if APP_WORKERS > 1:
+        # Workers import the app by name. Each one processes uploads with its
+        # own pools; a single one of them commits (see coordinator.py).
+        print(f"Starting {APP_WORKERS} worker processes.")
+        uvicorn.run(
+            "shotput:create_app", factory=True, host="0.0.0.0", port=APP_PORT, workers=APP_WORKERS, log_level="info"
+        )
+    else:
+        uvicorn.run(application, host="0.0.0.0", port=APP_PORT, log_level="info")
@@ -0,0 +1,307 @@
+"""
+Perceptual near-duplicate index of the images under IMAGE_SUB_DIR.
+
+Every image gets a 64-bit perceptual hash (dHash or pHash, see imaging.py).
+The hashes live in one contiguous uint64 NumPy array, so a Hamming-distance
+query is a single vectorized XOR + popcount over all images. Unlike bucketed
+schemes (BK-trees, multi-index hashing) the cost does not depend on how the
+hashes cluster, and at 100k images a query takes ~0.2 ms for any threshold.
+
+The hashes are stored in SQLite, which every worker process shares; each
+process keeps its own copy of the array. Every write also appends the name to
+a change log, and before a query a process applies the rows changed since it
+last looked, so an image stored by one worker is found by all of them.
+"""
+
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import functools
+import itertools
+import logging
+import os
+import threading
+
+import numpy as np
+
+from imaging import perceptual_hash_file
+import statedb
+
+logger = logging.getLogger(__name__)
+
+# Change log rows kept for other processes to catch up from; a process that
+# fell further behind reloads all hashes instead
+CHANGES_KEPT = 10_000
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif"}
+
+if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+
+    def _popcount(values: "np.ndarray") -> "np.ndarray":
+        return np.bitwise_count(values)
+
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values: "np.ndarray") -> "np.ndarray":
+        return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+class PerceptualIndex:
+    """
+    Hamming-distance index over the perceptual hashes of one image directory.
+
+    Args:
+        db_path: SQLite database file (created if missing).
+        image_dir: Directory whose images are indexed (not recursive).
+        algorithm: "dhash" or "phash".
+        ignore: Predicate for file names the scan should skip (e.g. derivatives).
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        image_dir: Path,
+        algorithm: str = "dhash",
+        ignore: Optional[Callable[[str], bool]] = None,
+    ):
+        self.image_dir = image_dir
+        self.ignore = ignore
+        self.algorithm = algorithm
+        self._lock = threading.Lock()
+        self._db = statedb.connect(db_path)
+        # hash is stored as hex text (SQLite integers are signed 64-bit); NULL
+        # marks a file that is not a decodable image, so it is not retried
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS phashes ("
+            " name TEXT PRIMARY KEY, hash TEXT,"
+            " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL)"
+        )
+        self._db.commit()
+        self._load()
+        self.scan_complete = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._files)
+
+    def _load(self):
+        """(Re)reads every hash from the database. Caller holds _lock."""
+        self._files: Dict[str, Tuple[Optional[int], int, int]] = {}
+        # Slot storage for the vectorized search; freed slots are reused
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._valid = np.zeros(1024, dtype=bool)
+        self._slot_names: List[Optional[str]] = []
+        self._slots: Dict[str, int] = {}
+        self._free_slots: List[int] = []
+        # Read before the rows: changes made in between are applied twice, not missed
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        self._synced_seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        for name, hex_hash, size, mtime_ns in self._db.execute(
+            "SELECT name, hash, size, mtime_ns FROM phashes"
+        ):
+            self._put(name, int(hex_hash, 16) if hex_hash else None, size, mtime_ns)
+
+    def _sync(self):
+        """
+        Applies the rows other processes changed since the last sync. Costs one
+        PRAGMA when nothing changed. Caller holds _lock.
+        """
+        data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        changes = self._db.execute(
+            "SELECT seq, name FROM changes WHERE seq > ? ORDER BY seq", (self._synced_seq,)
+        ).fetchall()
+        if not changes:
+            return
+        if changes[0][0] != self._synced_seq + 1:
+            # Sequence numbers have no gaps, so the ones we missed were pruned
+            self._load()
+            return
+        for name in {name for _, name in changes}:
+            row = self._db.execute(
+                "SELECT hash, size, mtime_ns FROM phashes WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None:
+                self._drop(name)
+            else:
+                hex_hash, size, mtime_ns = row
+                self._put(name, int(hex_hash, 16) if hex_hash else None, size, mtime_ns)
+        self._synced_seq = changes[-1][0]
+
+    def _write(self, names: List[str], statement: str, params: list):
+        """
+        Runs statement for every params entry and logs names as changed, in one
+        transaction. The in-memory copy is synced first, so it is current up to
+        this write. Caller holds _lock and updates the copy for this write.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._sync()
+            self._db.executemany(statement, params)
+            self._db.executemany("INSERT INTO changes (name) VALUES (?)", [(name,) for name in names])
+            latest = self._db.execute("SELECT MAX(seq) FROM changes").fetchone()[0]
+            self._db.execute("DELETE FROM changes WHERE seq <= ?", (latest - CHANGES_KEPT,))
+            self._db.commit()
+        except BaseException:
+            self._db.rollback()
+            raise
+        self._synced_seq = latest
+
+    def _put(self, name: str, h: Optional[int], size: int, mtime_ns: int):
+        self._drop(name)
+        self._files[name] = (h, size, mtime_ns)
+        if h is None:
+            return
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._slot_names[slot] = name
+        else:
+            slot = len(self._slot_names)
+            self._slot_names.append(name)
+            if slot >= len(self._hashes):
+                self._hashes = np.resize(self._hashes, len(self._hashes) * 2)
+                self._valid = np.resize(self._valid, len(self._valid) * 2)
+                self._valid[slot:] = False
+        self._hashes[slot] = h
+        self._valid[slot] = True
+        self._slots[name] = slot
+
+    def _drop(self, name: str):
+        self._files.pop(name, None)
+        slot = self._slots.pop(name, None)
+        if slot is None:
+            return
+        self._valid[slot] = False
+        self._slot_names[slot] = None
+        self._free_slots.append(slot)
+
+    def hash_of(self, name: str) -> Optional[int]:
+        with self._lock:
+            self._sync()
+            entry = self._files.get(name)
+        return entry[0] if entry else None
+
+    def add(self, name: str, h: Optional[int], size: int, mtime_ns: int):
+        self.add_many([(name, h, size, mtime_ns)])
+
+    def add_many(self, rows: Iterable[Tuple[str, Optional[int], int, int]]):
+        """Records (name, hash or None, size, mtime_ns) rows in one transaction."""
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            self._write(
+                [name for name, _, _, _ in rows],
+                "INSERT OR REPLACE INTO phashes (name, hash, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                [
+                    (name, format(h, "016x") if h is not None else None, size, mtime_ns)
+                    for name, h, size, mtime_ns in rows
+                ],
+            )
+            for name, h, size, mtime_ns in rows:
+                self._put(name, h, size, mtime_ns)
+
+    def add_file(self, path: Path, h: Optional[int]):
+        """Records a file that was just written to image_dir with its precomputed hash."""
+        st = path.stat()
+        self.add(path.name, h, st.st_size, st.st_mtime_ns)
+
+    def remove(self, name: str):
+        self.remove_many([name])
+
+    def remove_many(self, names: Iterable[str]):
+        names = list(names)
+        if not names:
+            return
+        with self._lock:
+            self._write(names, "DELETE FROM phashes WHERE name = ?", [(name,) for name in names])
+            for name in names:
+                self._drop(name)
+
+    def search(
+        self, h: int, max_distance: int = 8, limit: int = 20, exclude: Optional[str] = None
+    ) -> List[Tuple[str, int]]:
+        """
+        Finds stored images within max_distance bits of h.
+
+        Returns:
+            Up to `limit` (image_name, distance) pairs, closest first.
+        """
+        with self._lock:
+            self._sync()
+            n = len(self._slot_names)
+            distances = _popcount(self._hashes[:n] ^ np.uint64(h))
+            hits = np.flatnonzero(self._valid[:n] & (distances <= max_distance))
+            matches = [
+                (self._slot_names[i], int(distances[i]))
+                for i in hits
+                if self._slot_names[i] != exclude
+            ]
+        matches.sort(key=lambda m: (m[1], m[0]))
+        return matches[:limit]
+
+    def scan(self, executor: Executor, batch_size: int = 256) -> Tuple[int, int]:
+        """
+        Brings the index in line with image_dir.
+
+        Only images whose size or mtime changed since they were recorded are
+        decoded; hashing runs on `executor` (normally the ingest process pool)
+        and progress is committed every batch_size files, so an interrupted scan
+        resumes where it left off. A batch is written only once all of it is
+        hashed, keeping the write transaction short.
+
+        Returns:
+            A tuple (files_seen: int, files_hashed: int).
+        """
+        if not self.image_dir.is_dir():
+            self.scan_complete = True
+            return 0, 0
+
+        with self._lock:
+            self._sync()
+            known = {name: (size, mtime_ns) for name, (_, size, mtime_ns) in self._files.items()}
+        seen = set()
+        stale = []
+        with os.scandir(self.image_dir) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.startswith("."):
+                    continue
+                if self.ignore is not None and self.ignore(entry.name):
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                seen.add(entry.name)
+                st = entry.stat()
+                if known.get(entry.name) == (st.st_size, st.st_mtime_ns):
+                    continue
+                stale.append((entry.name, st.st_size, st.st_mtime_ns))
+
+        hashed = 0
+        paths = [str(self.image_dir / name) for name, _, _ in stale]
+        hashes = executor.map(
+            functools.partial(perceptual_hash_file, algorithm=self.algorithm), paths, chunksize=16
+        )
+        rows = ((name, h, size, mtime_ns) for (name, size, mtime_ns), h in zip(stale, hashes))
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            self.add_many(batch)
+            hashed += len(batch)
+            logger.info(f"Perceptual index scan: {hashed}/{len(stale)} images hashed")
+
+        self.remove_many(set(known) - seen)
+
+        self.scan_complete = True
+        return len(seen), hashed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
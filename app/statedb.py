@@ -0,0 +1,66 @@
+"""
+SQLite state databases shared by Shotput's worker processes.
+
+The hash index, the perceptual index and the manifest each keep one database
+under the state directory, and every worker process opens the same files.
+They are opened in WAL mode, so readers never wait for a writer, and with a
+busy timeout, so a writer waits for another process's transaction instead of
+failing with "database is locked". Writers keep their transactions short:
+anything slow (hashing, decoding) happens before the transaction opens.
+
+The startup scans that bring the databases in line with the image directory
+run in one process only (see claim_scans); every process reads and adds to
+the same rows.
+"""
+
+from pathlib import Path
+from typing import Optional
+import os
+import sqlite3
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: a single process, which always scans
+    fcntl = None
+
+# How long a write waits for another connection's transaction to finish
+BUSY_TIMEOUT_MS = 30_000
+
+# Lock held by the process that runs the startup scans, until it exits
+_scan_lock_fd: Optional[int] = None
+
+
+def connect(db_path: Path) -> sqlite3.Connection:
+    """
+    Opens (creating if missing) a state database for use from several threads
+    and processes. Callers serialize their own threads with a lock.
+    """
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(str(db_path), timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # Persistent: set once per file, but cheap to repeat
+    db.execute("PRAGMA journal_mode = WAL")
+    return db
+
+
+def claim_scans(state_dir: Path) -> bool:
+    """
+    Whether this process runs the startup scans of the state databases.
+
+    The first worker process to lock <state_dir>/index-scan.lock holds it
+    until it exits and scans; the others skip the scans, so N workers do not
+    hash every image N times. A process that restarts after the scanner
+    exited may become the scanner itself. Repeated calls in the scanning
+    process return True.
+    """
+    global _scan_lock_fd
+    if fcntl is None or _scan_lock_fd is not None:
+        return True
+    fd = os.open(state_dir / "index-scan.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _scan_lock_fd = fd
+    return True
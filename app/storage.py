@@ -0,0 +1,243 @@
+"""
+Storage backends for Shotput.
+
+Uploads are always written to the local image directory first: /media, /img,
+the indexes and the manifest read them there. A backend then publishes the
+stored files (an image and its derivatives) and builds the URLs they are
+served from:
+
+- GitStorage commits them through the CommitCoalescer and pushes the branch;
+  URLs point at the repository on the statically.io GitHub CDN.
+- FilesystemStorage leaves them where they are; URLs point at `base_url`
+  (a web server or CDN in front of the image directory) or at /media.
+- S3Storage uploads them to an S3-compatible bucket (AWS S3, MinIO, R2, ...)
+  with immutable cache headers; URLs point at `public_base_url` or the bucket.
+
+Only GitStorage grows the repository or pays the per-commit cost.
+"""
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple
+import asyncio
+import logging
+import mimetypes
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("git", "filesystem", "s3")
+
+# (success, message, commit SHA or None), as returned by CommitCoalescer.submit.
+# success is None when the outcome is not known yet (git with several worker
+# processes: the upload stays spooled for a later writer); keep the files then.
+SubmitResult = Tuple[Optional[bool], str, Optional[str]]
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+
+class StorageBackend(ABC):
+    """Publishes stored images and addresses them."""
+
+    name = ""
+    commits = False  # Whether submit() creates git commits (and returns their SHAs)
+
+    @abstractmethod
+    def url(self, image_name: str) -> str:
+        """Public URL of a stored image or derivative."""
+
+    @abstractmethod
+    async def submit(self, paths: List[Path], message: str) -> SubmitResult:
+        """
+        Publishes files that were just stored in the image directory.
+
+        Args:
+            paths: The image and its derivatives.
+            message: Description of the change (the commit message for git).
+
+        Returns:
+            (success, message, commit SHA or None). Failures are returned,
+            not raised, like CommitCoalescer.submit. success is None if the
+            files may still be published later (see SubmitResult).
+        """
+
+    def pending(self) -> int:
+        """Stored uploads waiting to be published (read by /metrics)."""
+        return 0
+
+    def describe(self) -> str:
+        return self.name
+
+    def close(self):
+        """Releases what the backend holds (blocking; called at shutdown)."""
+
+
+class GitStorage(StorageBackend):
+    """
+    Commits uploads to the images repository and serves them from statically.io.
+
+    Args:
+        coalescer: The CommitCoalescer that groups concurrent uploads into commits.
+        user, repo, branch: The GitHub repository the CDN serves from.
+        sub_dir: The image directory, relative to the repository root.
+    """
+
+    name = "git"
+    commits = True
+
+    def __init__(self, coalescer: Any, user: str, repo: str, branch: str, sub_dir: str):
+        self.coalescer = coalescer
+        self.base_url = f"https://cdn.statically.io/gh/{user}/{repo}/{branch}/{sub_dir}"
+
+    def url(self, image_name: str) -> str:
+        return f"{self.base_url}/{image_name}"
+
+    async def submit(self, paths: List[Path], message: str) -> SubmitResult:
+        return await self.coalescer.submit(paths, message)
+
+    def pending(self) -> int:
+        return len(self.coalescer)
+
+    def describe(self) -> str:
+        return f"git, served from {self.base_url}"
+
+
+class FilesystemStorage(StorageBackend):
+    """
+    Keeps uploads in the image directory without any version control.
+
+    Args:
+        base_url: URL the image directory is served at. Empty means Shotput's
+            own /media URLs, via local_url.
+        local_url: Builds the /media URL of an image name.
+    """
+
+    name = "filesystem"
+
+    def __init__(self, base_url: str, local_url: Callable[[str], str]):
+        self.base_url = base_url.rstrip("/")
+        self.local_url = local_url
+
+    def url(self, image_name: str) -> str:
+        if self.base_url:
+            return f"{self.base_url}/{image_name}"
+        return self.local_url(image_name)
+
+    async def submit(self, paths: List[Path], message: str) -> SubmitResult:
+        return True, "Stored on the filesystem.", None
+
+    def describe(self) -> str:
+        return f"filesystem, served from {self.base_url or '/media'}"
+
+
+class S3Storage(StorageBackend):
+    """
+    Uploads images to an S3-compatible object store.
+
+    boto3 is only imported when this backend is configured. Credentials come
+    from the usual AWS sources (environment, shared config, instance role)
+    unless given here.
+
+    Args:
+        bucket: Bucket to upload to.
+        prefix: Key prefix, e.g. "blog-media" (keys are <prefix>/<image name>).
+        max_concurrency: Threads uploading objects, in a pool of this backend's
+            own so that slow uploads do not hold up the ingest I/O threads.
+        endpoint_url: For non-AWS stores, e.g. "http://localhost:9000" for MinIO.
+        region: Region name; empty uses the configured default.
+        public_base_url: URL the bucket (with prefix) is served at, e.g. a CDN.
+            Empty means <endpoint_url>/<bucket>/<prefix> (path-style) or the
+            virtual-hosted AWS URL.
+        cache_control: Cache-Control stored with every object.
+        access_key_id, secret_access_key: Explicit credentials (optional).
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str,
+        max_concurrency: int = 16,
+        endpoint_url: str = "",
+        region: str = "",
+        public_base_url: str = "",
+        cache_control: str = "public, max-age=31536000, immutable",
+        access_key_id: str = "",
+        secret_access_key: str = "",
+    ):
+        if not bucket:
+            raise ValueError("storage.s3.bucket is not set")
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError(
+                "The s3 storage backend needs boto3 (e.g. `uv run --with boto3 app/shotput.py`)"
+            ) from None
+
+        # The app logs at DEBUG, where botocore logs every hook and signature step
+        for name in ("boto3", "botocore", "s3transfer", "urllib3"):
+            logging.getLogger(name).setLevel(logging.INFO)
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.cache_control = cache_control
+        max_concurrency = max(1, max_concurrency)
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+            # Path-style works for MinIO and friends without wildcard DNS
+            config=Config(
+                s3={"addressing_style": "path" if endpoint_url else "auto"},
+                max_pool_connections=max_concurrency,
+                retries={"max_attempts": 5, "mode": "standard"},
+            ),
+        )
+        if public_base_url:
+            self.base_url = public_base_url.rstrip("/")
+        elif endpoint_url:
+            self.base_url = f"{endpoint_url.rstrip('/')}/{bucket}"
+        else:
+            self.base_url = f"https://{bucket}.s3.{self.client.meta.region_name}.amazonaws.com"
+        if self.prefix and not public_base_url:
+            self.base_url = f"{self.base_url}/{self.prefix}"
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="shotput-s3")
+
+    def key(self, image_name: str) -> str:
+        return f"{self.prefix}/{image_name}" if self.prefix else image_name
+
+    def url(self, image_name: str) -> str:
+        return f"{self.base_url}/{image_name}"
+
+    def check(self):
+        """Fails early (blocking) if the bucket is missing or not accessible."""
+        self.client.head_bucket(Bucket=self.bucket)
+
+    def _put(self, path: Path):
+        content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.client.upload_file(
+            str(path),
+            self.bucket,
+            self.key(path.name),
+            ExtraArgs={"ContentType": content_type, "CacheControl": self.cache_control},
+        )
+
+    async def submit(self, paths: List[Path], message: str) -> SubmitResult:
+        try:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[loop.run_in_executor(self._executor, self._put, path) for path in paths])
+        except Exception as e:
+            logger.error(f"Upload to s3://{self.bucket} failed: {e}")
+            return False, f"Upload to s3://{self.bucket} failed: {e}", None
+        return True, f"Uploaded {len(paths)} files to s3://{self.bucket}/{self.prefix}", None
+
+    def describe(self) -> str:
+        return f"s3://{self.bucket}/{self.prefix}, served from {self.base_url}"
+
+    def close(self):
+        self._executor.shutdown(wait=True)
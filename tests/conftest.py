@@ -0,0 +1,6 @@
+"""Puts app/ on sys.path: Shotput's modules are scripts side by side, not a package."""
+
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
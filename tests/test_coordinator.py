@@ -0,0 +1,109 @@
+"""
+Tests for the git writer election across worker processes: a writer killed in
+the middle of a commit, with another worker's upload spooled.
+"""
+
+from pathlib import Path
+from typing import List
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import time
+
+from coordinator import GitCoordinator
+
+
+# Run in spawned worker processes, so they must be importable module functions
+
+
+def _log(log_path: str, *fields):
+    with open(log_path, "a") as f:
+        f.write(json.dumps([os.getpid(), *fields]) + "\n")
+
+
+def run_worker(state_dir: str, log_path: str, hang: bool, message: str = ""):
+    """
+    A worker process with a GitCoordinator whose "git" only logs commits.
+    With hang, commits never finish, like a writer stuck in git when it dies.
+    With a message, the worker stores one upload and logs the submit result.
+    """
+
+    async def main():
+        loop = asyncio.get_running_loop()
+
+        async def run_io(fn, *args, **kwargs):
+            return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+        async def commit(paths: List[Path], commit_message: str):
+            _log(log_path, "commit-start", commit_message)
+            if hang:
+                await asyncio.Event().wait()
+            _log(log_path, "committed", commit_message)
+            return True, "Committed.", "0" * 40
+
+        async def become_writer():
+            _log(log_path, "writer")
+            return commit
+
+        coordinator = GitCoordinator(Path(state_dir), run_io, become_writer, takeover_interval=0.05)
+        await coordinator.start()
+        if message:
+            path = Path(state_dir) / f"{message}.png"
+            path.write_bytes(b"image")
+            result = await coordinator.submit([path], message)
+            _log(log_path, "result", list(result))
+        await asyncio.Event().wait()  # Serve until killed
+
+    asyncio.run(main())
+
+
+def read_log(log_path: Path) -> list:
+    if not log_path.exists():
+        return []
+    return [json.loads(line) for line in log_path.read_text().splitlines()]
+
+
+def wait_for_entry(log_path: Path, event: str, timeout: float = 20) -> list:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for entry in read_log(log_path):
+            if entry[1] == event:
+                return entry
+        time.sleep(0.02)
+    raise AssertionError(f"No {event!r} in {read_log(log_path)}")
+
+
+def test_next_writer_commits_a_dead_writers_spooled_entry_once(tmp_path):
+    state_dir = tmp_path / "state"
+    state_dir.mkdir()
+    log_path = tmp_path / "log.jsonl"
+    spawn = multiprocessing.get_context("spawn")
+
+    writer = spawn.Process(target=run_worker, args=(str(state_dir), str(log_path), True))
+    writer.start()
+    worker = None
+    try:
+        assert wait_for_entry(log_path, "writer")[0] == writer.pid
+
+        worker = spawn.Process(target=run_worker, args=(str(state_dir), str(log_path), False, "upload-1"))
+        worker.start()
+        # The writer received the worker's request and is stuck committing it
+        assert wait_for_entry(log_path, "commit-start") == [writer.pid, "commit-start", "upload-1"]
+        assert len(list((state_dir / "git-spool").glob("*.json"))) == 1
+
+        writer.kill()
+        writer.join()
+
+        assert wait_for_entry(log_path, "result") == [worker.pid, "result", [True, "Committed.", "0" * 40]]
+        time.sleep(0.5)  # Room for a second, duplicate commit to show up
+        log = read_log(log_path)
+        assert [entry[0] for entry in log if entry[1] == "writer"] == [writer.pid, worker.pid]
+        assert [entry for entry in log if entry[1] == "committed"] == [[worker.pid, "committed", "upload-1"]]
+        assert list((state_dir / "git-spool").glob("*.json")) == []
+    finally:
+        for process in (writer, worker):
+            if process is not None and process.is_alive():
+                process.kill()
+                process.join()
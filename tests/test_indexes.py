@@ -0,0 +1,168 @@
+"""
+Tests for the state databases behind deduplication, similarity search and the
+manifest, as shared by several worker processes.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+import hash_index
+import similar_index
+import statedb
+from hash_index import HashIndex, sha256_file
+from manifest import MediaManifest
+from similar_index import PerceptualIndex
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for i in range(6):
+        Image.new("RGB", (32, 24), (40 * i, 255 - 40 * i, 0)).save(image_dir / f"2026010100000{i}_a.png")
+    return image_dir
+
+
+@pytest.fixture
+def short_busy_timeout(monkeypatch):
+    """Makes a writer blocked by another connection fail fast instead of waiting."""
+    monkeypatch.setattr(statedb, "BUSY_TIMEOUT_MS", 200)
+
+
+def test_state_databases_use_wal(tmp_path):
+    db = statedb.connect(tmp_path / "state" / "test.sqlite3")
+    assert db.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert db.execute("PRAGMA busy_timeout").fetchone() == (statedb.BUSY_TIMEOUT_MS,)
+
+
+def test_hash_scan_holds_no_write_transaction_while_hashing(tmp_path, image_dir, monkeypatch, short_busy_timeout):
+    db_path = tmp_path / "hashes.sqlite3"
+    scanner = HashIndex(db_path, image_dir)
+    other_worker = HashIndex(db_path, image_dir)
+    hashed = []
+
+    def hash_and_write(path: Path) -> str:
+        # Another worker stores an upload while the scan is between batches
+        hashed.append(path.name)
+        if len(hashed) == 4:
+            other_worker.add("upload.png", "0" * 64, 1, 1)
+        return sha256_file(path)
+
+    monkeypatch.setattr(hash_index, "sha256_file", hash_and_write)
+    assert scanner.scan(max_workers=1, batch_size=2) == (6, 6)
+    assert HashIndex(db_path, image_dir).lookup("0" * 64) == "upload.png"
+
+
+def test_perceptual_scan_writes_in_batches(tmp_path, image_dir, short_busy_timeout):
+    db_path = tmp_path / "similar.sqlite3"
+    index = PerceptualIndex(db_path, image_dir)
+    with ThreadPoolExecutor(2) as executor:
+        assert index.scan(executor, batch_size=4) == (6, 6)
+        (image_dir / "20260101000000_a.png").unlink()
+        assert index.scan(executor) == (5, 0)
+    assert len(PerceptualIndex(db_path, image_dir)) == 5
+
+
+def test_manifest_bootstrap_writes_in_batches(tmp_path, image_dir, short_busy_timeout):
+    db_path = tmp_path / "manifest.sqlite3"
+    manifest = MediaManifest(db_path, image_dir)
+    assert manifest.bootstrap(batch_size=4) == (6, 6)
+    (image_dir / "20260101000000_a.png").unlink()
+    assert manifest.bootstrap() == (5, 0)
+
+    images, _ = MediaManifest(db_path, image_dir).page(10)
+    assert [image["name"] for image in images][:2] == ["20260101000005_a.png", "20260101000004_a.png"]
+    assert images[0]["width"] == 32 and images[0]["blurhash"] is None
+
+
+# --- Several workers sharing the databases ---
+# Two instances on one file stand in for two worker processes: each has its own
+# SQLite connection, as separate processes would.
+
+
+def test_hash_lookups_see_other_workers_uploads(tmp_path, image_dir):
+    db_path = tmp_path / "hashes.sqlite3"
+    worker_a = HashIndex(db_path, image_dir)
+    worker_b = HashIndex(db_path, image_dir)
+
+    worker_a.add("upload.png", "a" * 64, 10, 1)
+    assert worker_b.lookup("a" * 64) == "upload.png"
+    assert len(worker_b) == 1
+
+    worker_a.add("copy.png", "a" * 64, 10, 2)
+    worker_b.remove("upload.png")
+    # Another file with the same bytes still answers
+    assert worker_a.lookup("a" * 64) == "copy.png"
+
+
+def test_perceptual_search_sees_other_workers_uploads(tmp_path, image_dir):
+    db_path = tmp_path / "similar.sqlite3"
+    worker_a = PerceptualIndex(db_path, image_dir)
+    worker_b = PerceptualIndex(db_path, image_dir)
+
+    worker_a.add("a.png", 0b1111, 10, 1)
+    worker_a.add("b.png", 0b0111, 10, 1)
+    assert worker_b.search(0b1111, max_distance=1) == [("a.png", 0), ("b.png", 1)]
+    assert worker_b.hash_of("b.png") == 0b0111
+
+    worker_b.add("c.png", 0b1110, 10, 1)
+    worker_a.remove("a.png")
+    assert worker_a.search(0b1111, max_distance=1) == [("b.png", 1), ("c.png", 1)]
+    assert worker_b.search(0b1111, max_distance=1) == [("b.png", 1), ("c.png", 1)]
+    assert worker_b.hash_of("a.png") is None
+
+
+def test_perceptual_worker_behind_the_pruned_change_log_reloads(tmp_path, image_dir, monkeypatch):
+    monkeypatch.setattr(similar_index, "CHANGES_KEPT", 2)
+    db_path = tmp_path / "similar.sqlite3"
+    worker_a = PerceptualIndex(db_path, image_dir)
+    worker_b = PerceptualIndex(db_path, image_dir)
+    worker_b.add("old.png", 0, 10, 1)
+    assert worker_a.hash_of("old.png") == 0
+
+    for i in range(5):
+        worker_b.add(f"{i}.png", 1 << i, 10, 1)
+    worker_b.remove("old.png")
+
+    assert len(worker_a) == 5
+    assert worker_a.hash_of("old.png") is None
+    assert worker_a.search(1 << 4, max_distance=0) == [("4.png", 0)]
+
+
+def test_manifest_bootstrap_state_is_shared(tmp_path, image_dir):
+    db_path = tmp_path / "manifest.sqlite3"
+    scanner = MediaManifest(db_path, image_dir)
+    other_worker = MediaManifest(db_path, image_dir)
+    assert not other_worker.bootstrap_complete
+
+    scanner.bootstrap()
+    assert other_worker.bootstrap_complete
+    assert len(other_worker) == 6
+
+
+def test_only_one_process_claims_the_scans(tmp_path):
+    script = (
+        "import sys; from pathlib import Path; import statedb; "
+        "print(statedb.claim_scans(Path(sys.argv[1])), flush=True); sys.stdin.read()"
+    )
+    env = {**os.environ, "PYTHONPATH": str(Path(statedb.__file__).parent)}
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", script, str(tmp_path)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env,
+        )
+        for _ in range(3)
+    ]
+    try:
+        claimed = sorted(worker.stdout.readline().strip() for worker in workers)
+    finally:
+        for worker in workers:
+            worker.communicate("")
+
+    assert claimed == ["False", "False", "True"]
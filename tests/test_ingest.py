@@ -0,0 +1,167 @@
+"""
+Tests for the ingest pipeline: upload staging and validation, and the image
+worker pool recovering from a worker process that died.
+"""
+
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from PIL import Image, ImageFile
+
+import ingest
+from ingest import IngestPipeline, UploadRejected, stage_upload
+
+
+class CountingReader(io.BytesIO):
+    """An upload stream that records how many bytes were read from it."""
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def png_bytes(width: int, height: int) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 40, 40)).save(out, format="PNG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def no_decoding(monkeypatch):
+    """Fails the test if any image file's pixel data is decoded."""
+
+    def load(self):
+        raise AssertionError("pixel data was decoded")
+
+    monkeypatch.setattr(ImageFile.ImageFile, "load", load)
+
+
+def staged_files(directory: Path):
+    return list(directory.glob(".upload-*"))
+
+
+def test_stage_upload_hashes_and_measures_a_valid_image(tmp_path, no_decoding):
+    data = png_bytes(40, 30)
+
+    staged = stage_upload(io.BytesIO(data), tmp_path, max_bytes=len(data), max_pixels=40 * 30)
+
+    assert (staged.extension, staged.width, staged.height) == (".png", 40, 30)
+    assert staged.size == len(data)
+    assert staged.sha256 == hashlib.sha256(data).hexdigest()
+    assert staged.path.read_bytes() == data
+
+
+def test_stage_upload_stops_reading_past_the_byte_limit(tmp_path, monkeypatch, no_decoding):
+    monkeypatch.setattr(ingest, "UPLOAD_CHUNK_SIZE", 1024)
+    src = CountingReader(png_bytes(8, 8) + b"\0" * 10 * 1024)
+
+    with pytest.raises(UploadRejected) as rejected:
+        stage_upload(src, tmp_path, max_bytes=2048)
+
+    assert rejected.value.status_code == 413
+    assert src.bytes_read <= 3 * 1024
+    assert staged_files(tmp_path) == []
+
+
+def test_stage_upload_rejects_unknown_magic_bytes_after_one_chunk(tmp_path, monkeypatch, no_decoding):
+    monkeypatch.setattr(ingest, "UPLOAD_CHUNK_SIZE", 1024)
+    src = CountingReader(b"%PDF-1.7\n" + b"\0" * 10 * 1024)
+
+    with pytest.raises(UploadRejected) as rejected:
+        stage_upload(src, tmp_path)
+
+    assert rejected.value.status_code == 415
+    assert src.bytes_read == 1024
+    assert staged_files(tmp_path) == []
+
+
+def test_stage_upload_checks_the_pixel_limit_from_the_header(tmp_path, no_decoding):
+    with pytest.raises(UploadRejected) as rejected:
+        stage_upload(io.BytesIO(png_bytes(100, 100)), tmp_path, max_pixels=100 * 99)
+
+    assert rejected.value.status_code == 413
+    assert "100x100" in rejected.value.detail
+    assert staged_files(tmp_path) == []
+
+
+def test_stage_upload_rejects_a_corrupt_header(tmp_path, no_decoding):
+    with pytest.raises(UploadRejected) as rejected:
+        stage_upload(io.BytesIO(b"\x89PNG\r\n\x1a\n" + b"\0" * 64), tmp_path)
+
+    assert rejected.value.status_code == 400
+    assert staged_files(tmp_path) == []
+
+
+# Run in the spawned worker processes, so they must be importable module functions
+
+
+def _double(x: int) -> int:
+    return 2 * x
+
+
+def _exit(code: int = 1):
+    os._exit(code)
+
+
+def _exit_once(marker: str) -> str:
+    """Kills its worker the first time it runs, like a decoder crash on a bad file."""
+    if not os.path.exists(marker):
+        Path(marker).touch()
+        os._exit(1)
+    return "recovered"
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = IngestPipeline(io_workers=1, cpu_workers=1)
+    yield pipeline
+    pipeline.shutdown()
+
+
+def test_run_cpu_replaces_a_broken_pool_and_retries_once(pipeline, tmp_path):
+    broken = pipeline.cpu_executor
+
+    result = asyncio.run(pipeline.run_cpu(_exit_once, str(tmp_path / "crashed")))
+
+    assert result == "recovered"
+    assert pipeline.cpu_executor is not broken
+
+
+def test_run_cpu_raises_when_the_retry_dies_too(pipeline):
+    async def scenario():
+        with pytest.raises(BrokenProcessPool):
+            await pipeline.run_cpu(_exit)
+        # The pool that broke on the retry is replaced for the next call as well
+        return await pipeline.run_cpu(_double, 21)
+
+    assert asyncio.run(scenario()) == 42
+
+
+def test_calls_sharing_a_broken_pool_replace_it_once(pipeline, tmp_path):
+    marker = str(tmp_path / "crashed")
+
+    async def scenario():
+        return await asyncio.gather(
+            pipeline.run_cpu(_exit_once, marker), *(pipeline.run_cpu(_double, i) for i in range(4))
+        )
+
+    replaced = []
+    new_executor = pipeline._new_cpu_executor
+
+    def counting_new_executor():
+        replaced.append(True)
+        return new_executor()
+
+    pipeline._new_cpu_executor = counting_new_executor
+    assert asyncio.run(scenario()) == ["recovered", 0, 2, 4, 6]
+    assert len(replaced) == 1
@@ -0,0 +1,239 @@
+"""
+Tests for the background pusher: pushes, the tracking ref, backoff and
+rejected pushes. Every test works on throwaway repositories in tmp_path: a
+bare "origin" and clones of it, as on a server and a second instance pushing
+to the same remote.
+"""
+
+from pathlib import Path
+import asyncio
+import logging
+import re
+import subprocess
+import time
+
+import pytest
+
+from gitstore import PlumbingCommitter
+from pusher import BackgroundPusher, PushFailed
+
+
+def git(cwd: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch):
+    for role in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{role}_NAME", "Shotput Tests")
+        monkeypatch.setenv(f"GIT_{role}_EMAIL", "tests@example.com")
+
+
+@pytest.fixture
+def origin(tmp_path: Path) -> Path:
+    """A bare remote whose main branch has one commit."""
+    remote = tmp_path / "origin.git"
+    git(tmp_path, "init", "-q", "--bare", "-b", "main", str(remote))
+    seed = tmp_path / "seed"
+    git(tmp_path, "clone", "-q", str(remote), str(seed))
+    git(seed, "checkout", "-q", "-b", "main")
+    (seed / "README").write_text("images\n")
+    git(seed, "add", "README")
+    git(seed, "commit", "-q", "-m", "init")
+    git(seed, "push", "-q", "origin", "main")
+    return remote
+
+
+def clone(origin: Path, name: str) -> Path:
+    path = origin.parent / name
+    git(origin.parent, "clone", "-q", "-b", "main", str(origin), str(path))
+    return path
+
+
+def commit_file(repo: Path, name: str, content: str = "") -> str:
+    """Commits a file the way the server does (without the working index)."""
+    path = repo / name
+    path.write_text(content or name)
+    committer = PlumbingCommitter(repo)
+    try:
+        return committer.commit_files([(name, path)], f"Add {name}").hexsha
+    finally:
+        committer.repo.close()
+
+
+def tip(repo: Path, ref: str = "refs/heads/main") -> str:
+    return git(repo, "rev-parse", ref)
+
+
+def make_pusher(repo: Path, rebase: bool = False, **kwargs) -> BackgroundPusher:
+    """A pusher without debounce; rebases (if enabled) run on their own thread."""
+    rebase_fn = None
+    if rebase:
+        committer = PlumbingCommitter(repo)
+
+        async def rebase_fn(upstream: str):
+            return await asyncio.get_running_loop().run_in_executor(None, committer.rebase_onto, upstream)
+
+    kwargs.setdefault("debounce_ms", 0)
+    kwargs.setdefault("max_delay_ms", 0)
+    return BackgroundPusher(repo, rebase=rebase_fn, **kwargs)
+
+
+async def wait_for(condition, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for the pusher")
+        await asyncio.sleep(0.02)
+
+
+def test_push_moves_remote_and_tracking_ref(origin):
+    server = clone(origin, "server")
+    sha = commit_file(server, "a.png")
+
+    async def scenario():
+        pusher = make_pusher(server)
+        pusher.start()
+        await wait_for(lambda: pusher.pushes == 1)
+        status = pusher.status()
+        await pusher.close()
+        return pusher, status
+
+    pusher, status = asyncio.run(scenario())
+    assert tip(origin) == sha
+    assert tip(server, "refs/remotes/origin/main") == sha
+    assert pusher.last_pushed_sha == sha
+    assert (status["ahead"], status["behind"]) == (0, 0)
+
+
+def test_push_with_nothing_new_is_a_no_op(origin):
+    server = clone(origin, "server")
+    pusher = make_pusher(server)
+    assert pusher._push() is None
+    assert pusher.pushes == 0
+
+
+def test_rejected_push_without_rebase_fails_as_rejected(origin):
+    server, other = clone(origin, "server"), clone(origin, "other")
+    commit_file(other, "theirs.png")
+    git(other, "push", "-q", "origin", "main")
+    commit_file(server, "ours.png")
+
+    pusher = make_pusher(server)
+    with pytest.raises(PushFailed) as failure:
+        pusher._push()
+    assert failure.value.rejected
+    # The rejection fetched the remote branch, ready to rebase onto
+    assert tip(server, "refs/remotes/origin/main") == tip(other)
+
+
+def test_failed_pushes_back_off_exponentially(origin, monkeypatch, caplog):
+    server = clone(origin, "server")
+    commit_file(server, "a.png")
+    git(server, "remote", "set-url", "origin", str(origin.parent / "missing.git"))
+    monkeypatch.setattr("pusher.random.uniform", lambda a, b: 1.0)
+
+    async def scenario():
+        pusher = make_pusher(server, retry_initial_s=0.1, retry_max_s=0.4)
+        pusher.start()
+        await wait_for(lambda: pusher.consecutive_failures >= 4)
+        await pusher.close()
+        return pusher
+
+    with caplog.at_level(logging.WARNING, logger="pusher"):
+        pusher = asyncio.run(scenario())
+    delays = [float(d) for d in re.findall(r"retrying in ([\d.]+)s", caplog.text)]
+    assert delays[:4] == [0.1, 0.2, 0.4, 0.4]
+    assert pusher.pushes == 0
+    assert "failed" in pusher.last_error
+
+
+def test_rejected_push_rebases_onto_remote_and_pushes_again(origin):
+    server, other = clone(origin, "server"), clone(origin, "other")
+    theirs = commit_file(other, "theirs.png")
+    git(other, "push", "-q", "origin", "main")
+    commit_file(server, "ours.png")
+
+    async def scenario():
+        pusher = make_pusher(server, rebase=True)
+        pusher.start()
+        await wait_for(lambda: pusher.pushes == 1)
+        await pusher.close()
+        return pusher
+
+    pusher = asyncio.run(scenario())
+    assert pusher.rebases == 1
+    assert tip(origin) == tip(server) == pusher.last_pushed_sha
+    # Our commit was replayed on top of theirs, not merged
+    assert git(server, "rev-parse", "main~1") == theirs
+    assert git(server, "log", "--format=%s", "-1") == "Add ours.png"
+    assert git(server, "rev-list", "--merges", "--count", "main") == "0"
+
+
+def test_rebase_conflict_is_reported_not_merged(origin):
+    server, other = clone(origin, "server"), clone(origin, "other")
+    commit_file(other, "same.png", "theirs")
+    git(other, "push", "-q", "origin", "main")
+    ours = commit_file(server, "same.png", "ours")
+
+    async def scenario():
+        pusher = make_pusher(server, rebase=True, retry_initial_s=30)
+        pusher.start()
+        await wait_for(lambda: pusher.consecutive_failures == 1)
+        await pusher.close()
+        return pusher
+
+    pusher = asyncio.run(scenario())
+    assert "without a merge" in pusher.last_error
+    assert tip(server) == ours  # Left alone
+    assert tip(origin) != ours
+
+
+def test_periodic_fetch_follows_the_remote_so_pushes_are_not_rejected(origin):
+    server, other = clone(origin, "server"), clone(origin, "other")
+
+    async def scenario():
+        pusher = make_pusher(server, rebase=True, fetch_interval_s=0.2)
+        pusher.start()
+        # The remote moves while nothing is pending here; the periodic fetch
+        # fast-forwards onto it, so the next local commit pushes at once
+        commit_file(other, "theirs.png")
+        git(other, "push", "-q", "origin", "main")
+        await wait_for(lambda: pusher.rebases == 1)
+        commit_file(server, "ours.png")
+        pusher.notify()
+        await wait_for(lambda: pusher.pushes == 1)
+        await pusher.close()
+        return pusher
+
+    pusher = asyncio.run(scenario())
+    assert pusher.failures == 0
+    assert tip(origin) == tip(server)
+    assert git(server, "log", "--format=%s", "-2").splitlines() == ["Add ours.png", "Add theirs.png"]
+
+
+def test_commit_during_debounce_does_not_stop_the_push_loop(origin):
+    server = clone(origin, "server")
+    commit_file(server, "a.png")
+
+    async def scenario():
+        pusher = make_pusher(server, debounce_ms=200, max_delay_ms=1000)
+        pusher.start()
+        await asyncio.sleep(0.05)
+        # Lands while the first push waits for a quiet period
+        commit_file(server, "b.png")
+        pusher.notify()
+        await wait_for(lambda: pusher.pushes == 1 or pusher._task.done())
+        await asyncio.sleep(0.1)
+        alive = not pusher._task.done()
+        commit_file(server, "c.png")
+        pusher.notify()
+        if alive:
+            await wait_for(lambda: pusher.pushes == 2)
+        await pusher.close()
+        return alive
+
+    assert asyncio.run(scenario())
+    assert tip(origin) == tip(server)
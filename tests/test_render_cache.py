@@ -0,0 +1,134 @@
+"""
+Tests for the render cache: LRU order and byte budgets of both tiers, and one
+cache directory per worker process.
+"""
+
+from pathlib import Path
+import os
+import subprocess
+import sys
+
+import render_cache
+from render_cache import RenderCache, claim_worker_dir
+
+
+def make_cache(tmp_path, max_disk_bytes=1000, max_memory_bytes=1000, max_memory_item_bytes=100):
+    return RenderCache(tmp_path / "cache", max_disk_bytes, max_memory_bytes, max_memory_item_bytes)
+
+
+def disk_files(cache):
+    return sorted(p.name for p in cache.cache_dir.iterdir())
+
+
+def test_put_then_get_hits_memory(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("a.w100.webp", b"aaaa")
+
+    assert cache.get("a.w100.webp") == (b"aaaa", "memory")
+    assert cache.get("b.w100.webp") == (None, None)
+
+
+def test_entries_over_the_item_size_cutoff_are_kept_on_disk_only(tmp_path):
+    cache = make_cache(tmp_path, max_memory_item_bytes=4)
+    cache.put("small.webp", b"1234")
+    cache.put("large.webp", b"12345")
+
+    assert cache.get("small.webp") == (b"1234", "memory")
+    assert cache.get("large.webp") == (b"12345", "disk")
+    assert cache.stats() == {"memory_entries": 1, "memory_bytes": 4, "disk_entries": 2, "disk_bytes": 9}
+
+
+def test_memory_evicts_least_recently_used_first(tmp_path):
+    cache = make_cache(tmp_path, max_memory_bytes=8)
+    cache.put("a.webp", b"aaaa")
+    cache.put("b.webp", b"bbbb")
+    cache.get("a.webp")  # b is now the least recently used
+    cache.put("c.webp", b"cccc")
+
+    assert cache.get("a.webp") == (b"aaaa", "memory")
+    assert cache.get("c.webp") == (b"cccc", "memory")
+    # Still on disk, which has room for all three
+    assert cache.get("b.webp") == (b"bbbb", "disk")
+    assert cache.stats()["memory_bytes"] == 8
+
+
+def test_disk_evicts_least_recently_used_first(tmp_path):
+    cache = make_cache(tmp_path, max_disk_bytes=8, max_memory_item_bytes=0)
+    a = cache.put("a.webp", b"aaaa")
+    b = cache.put("b.webp", b"bbbb")
+    cache.get("a.webp")
+    c = cache.put("c.webp", b"cccc")
+
+    assert cache.get("b.webp") == (None, None)
+    assert not b.exists()
+    assert disk_files(cache) == sorted([a.name, c.name])
+    assert cache.stats()["disk_bytes"] == 8
+
+
+def test_replacing_an_entry_counts_its_bytes_once(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("a.webp", b"aaaa")
+    cache.put("a.webp", b"aaaaaa")
+
+    assert cache.get("a.webp") == (b"aaaaaa", "memory")
+    assert cache.stats() == {"memory_entries": 1, "memory_bytes": 6, "disk_entries": 1, "disk_bytes": 6}
+
+
+def test_an_entry_larger_than_the_disk_budget_is_still_kept(tmp_path):
+    cache = make_cache(tmp_path, max_disk_bytes=4, max_memory_item_bytes=0)
+    cache.put("a.webp", b"aaaa")
+    cache.put("b.webp", b"bbbbbbbb")
+
+    assert cache.get("a.webp") == (None, None)
+    assert cache.get("b.webp") == (b"bbbbbbbb", "disk")
+
+
+def test_a_vanished_disk_file_is_a_miss(tmp_path):
+    cache = make_cache(tmp_path, max_memory_item_bytes=0)
+    path = cache.put("a.webp", b"aaaa")
+    path.unlink()
+
+    assert cache.get("a.webp") == (None, None)
+    assert cache.stats()["disk_entries"] == 0
+    assert cache.stats()["disk_bytes"] == 0
+
+
+def test_existing_files_are_picked_up_oldest_access_first(tmp_path):
+    cache = make_cache(tmp_path, max_memory_item_bytes=0)
+    old = cache.put("old.webp", b"oooo")
+    new = cache.put("new.webp", b"nnnn")
+    os.utime(old, (1_000_000, 1_000_000))
+    os.utime(new, (2_000_000, 2_000_000))
+    (cache.cache_dir / ".partial.tmp").write_bytes(b"x")  # An interrupted put
+
+    reopened = make_cache(tmp_path, max_disk_bytes=6, max_memory_item_bytes=0)
+
+    assert reopened.get("old.webp") == (None, None)
+    assert reopened.get("new.webp") == (b"nnnn", "disk")
+    assert reopened.stats()["disk_bytes"] == 4
+
+
+def test_each_process_claims_its_own_worker_dir(tmp_path):
+    parent = tmp_path / "render-cache"
+    script = (
+        "import sys; from pathlib import Path; from render_cache import claim_worker_dir; "
+        "print(claim_worker_dir(Path(sys.argv[1])).name, flush=True); sys.stdin.read()"
+    )
+    env = {**os.environ, "PYTHONPATH": str(Path(render_cache.__file__).parent)}
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", script, str(parent)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env,
+        )
+        for _ in range(2)
+    ]
+    try:
+        claimed = sorted(worker.stdout.readline().strip() for worker in workers)
+    finally:
+        for worker in workers:
+            worker.communicate("")
+
+    assert claimed == ["worker-0", "worker-1"]
+    # Both exited, so a restarted worker gets the first cache back
+    assert claim_worker_dir(parent) == parent / "worker-0"
+    assert claim_worker_dir(parent) == parent / "worker-0"
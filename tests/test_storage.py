@@ -0,0 +1,164 @@
+"""
+Tests for the storage backends. boto3 is replaced by a stub, so no bucket or
+network is needed.
+"""
+
+from pathlib import Path
+import asyncio
+import sys
+import threading
+import types
+
+import pytest
+
+from storage import FilesystemStorage, GitStorage, S3Storage, StorageBackend
+
+
+def test_storage_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+def test_filesystem_storage_urls_and_submit(tmp_path):
+    served = FilesystemStorage("https://img.example.com/media/", lambda name: f"/media/{name}")
+    assert served.url("a.png") == "https://img.example.com/media/a.png"
+    local = FilesystemStorage("", lambda name: f"/media/{name}")
+    assert local.url("a.png") == "/media/a.png"
+    assert asyncio.run(local.submit([tmp_path / "a.png"], "Add a.png")) == (True, "Stored on the filesystem.", None)
+    assert not local.commits and local.pending() == 0
+
+
+def test_git_storage_submits_through_the_coalescer(tmp_path):
+    class Coalescer:
+        def __init__(self):
+            self.calls = []
+
+        async def submit(self, paths, message):
+            self.calls.append((paths, message))
+            return True, "committed", "abc123"
+
+        def __len__(self):
+            return 2
+
+    coalescer = Coalescer()
+    backend = GitStorage(coalescer, "user", "repo", "main", "blog-media")
+    assert backend.url("a.png") == "https://cdn.statically.io/gh/user/repo/main/blog-media/a.png"
+    assert asyncio.run(backend.submit([tmp_path / "a.png"], "Add a.png")) == (True, "committed", "abc123")
+    assert coalescer.calls == [([tmp_path / "a.png"], "Add a.png")]
+    assert backend.pending() == 2
+
+
+class FakeS3Client:
+    def __init__(self, region: str = "us-east-1", fail_on: str = ""):
+        self.meta = types.SimpleNamespace(region_name=region)
+        self.fail_on = fail_on
+        self.uploads = []
+        self.checked = []
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None):
+        if self.fail_on and key.endswith(self.fail_on):
+            raise OSError("connection reset")
+        self.uploads.append((Path(filename).name, bucket, key, ExtraArgs))
+
+    def head_bucket(self, Bucket):
+        self.checked.append(Bucket)
+
+
+@pytest.fixture
+def fake_boto3(monkeypatch):
+    """Installs stub boto3/botocore modules; records every client() call and client."""
+    created = []
+    clients = []
+
+    def client(service, **kwargs):
+        created.append((service, kwargs))
+        clients.append(FakeS3Client(region=kwargs.get("region_name") or "eu-west-1"))
+        return clients[-1]
+
+    boto3 = types.ModuleType("boto3")
+    boto3.client = client
+    botocore = types.ModuleType("botocore")
+    botocore_config = types.ModuleType("botocore.config")
+    botocore_config.Config = lambda **kwargs: kwargs
+    botocore.config = botocore_config
+    monkeypatch.setitem(sys.modules, "boto3", boto3)
+    monkeypatch.setitem(sys.modules, "botocore", botocore)
+    monkeypatch.setitem(sys.modules, "botocore.config", botocore_config)
+    return types.SimpleNamespace(created=created, clients=clients)
+
+
+def test_s3_storage_requires_a_bucket(fake_boto3):
+    with pytest.raises(ValueError):
+        S3Storage("", "blog-media")
+
+
+def test_s3_storage_urls(fake_boto3):
+    aws = S3Storage("shots", "blog-media")
+    assert aws.url("a.png") == "https://shots.s3.eu-west-1.amazonaws.com/blog-media/a.png"
+    minio = S3Storage("shots", "/blog-media/", endpoint_url="http://localhost:9000/")
+    assert minio.url("a.png") == "http://localhost:9000/shots/blog-media/a.png"
+    cdn = S3Storage("shots", "blog-media", public_base_url="https://cdn.example.com/i/")
+    assert cdn.url("a.png") == "https://cdn.example.com/i/a.png"
+    assert cdn.key("a.png") == "blog-media/a.png"
+    assert S3Storage("shots", "").key("a.png") == "a.png"
+
+    _, minio_kwargs = fake_boto3.created[1]
+    assert minio_kwargs["config"]["s3"] == {"addressing_style": "path"}
+    for backend in (aws, minio, cdn):
+        backend.close()
+
+
+def test_s3_storage_uploads_every_file_with_cache_headers(tmp_path, fake_boto3):
+    backend = S3Storage("shots", "blog-media", max_concurrency=2, cache_control="public, max-age=60")
+    paths = [tmp_path / name for name in ("a.png", "a.w480.webp", "a.w480.avif")]
+    for path in paths:
+        path.write_bytes(b"x")
+
+    success, message, sha = asyncio.run(backend.submit(paths, "Add a.png"))
+    backend.close()
+
+    assert (success, sha) == (True, None)
+    assert "3 files" in message
+    uploads = sorted(fake_boto3.clients[0].uploads)
+    assert [key for _, _, key, _ in uploads] == ["blog-media/a.png", "blog-media/a.w480.avif", "blog-media/a.w480.webp"]
+    content_types = {key: extra["ContentType"] for _, _, key, extra in uploads}
+    assert content_types == {
+        "blog-media/a.png": "image/png",
+        "blog-media/a.w480.avif": "image/avif",
+        "blog-media/a.w480.webp": "image/webp",
+    }
+    assert {extra["CacheControl"] for _, _, _, extra in uploads} == {"public, max-age=60"}
+    assert fake_boto3.created[0][1]["config"]["max_pool_connections"] == 2
+
+
+def test_s3_storage_reports_failed_uploads(tmp_path, fake_boto3):
+    backend = S3Storage("shots", "blog-media")
+    fake_boto3.clients[0].fail_on = ".webp"
+    paths = [tmp_path / "a.png", tmp_path / "a.w480.webp"]
+    for path in paths:
+        path.write_bytes(b"x")
+
+    success, message, sha = asyncio.run(backend.submit(paths, "Add a.png"))
+    backend.close()
+
+    assert success is False and sha is None
+    assert "connection reset" in message
+
+
+def test_s3_storage_uploads_off_the_event_loop_on_its_own_threads(tmp_path, fake_boto3):
+    backend = S3Storage("shots", "blog-media")
+    threads = []
+    backend._put = lambda path: threads.append(threading.current_thread().name)
+    path = tmp_path / "a.png"
+    path.write_bytes(b"x")
+
+    asyncio.run(backend.submit([path], "Add a.png"))
+    backend.close()
+    assert threads and all(name.startswith("shotput-s3") for name in threads)
+
+
+def test_s3_storage_check_heads_the_bucket(fake_boto3):
+    backend = S3Storage("shots", "blog-media")
+    backend.check()
+    backend.close()
+    assert fake_boto3.clients[0].checked == ["shots"]